@@ -0,0 +1,46 @@
+import threading
+import pytest
+from app.batching import EmbeddingBatcher
+
+
+'''
+тесты на микробатчирование
+1. элементы из разных потоков объединяются в один батч, каждый получает свой результат
+2. ошибка модели передается всем вызывающим
+'''
+
+def test_concurrent_items_batched():
+    calls = []
+
+    def embed_fn(items):
+        calls.append(len(items))
+        return [item * 10 for item in items]
+
+    batcher = EmbeddingBatcher(embed_fn, max_batch=8, max_wait_ms=200)
+    results = {}
+    start = threading.Barrier(4)
+
+    def caller(i):
+        start.wait()
+        results[i] = batcher.embed([i, i + 100])
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert results == {i: [i * 10, (i + 100) * 10] for i in range(4)}, 'Результаты перепутались'
+    assert sum(calls) == 8
+    assert len(calls) < 8, 'Элементы не объединились в батч'
+
+
+def test_error_propagates():
+    def embed_fn(items):
+        raise RuntimeError("модель упала")
+
+    batcher = EmbeddingBatcher(embed_fn, max_wait_ms=1)
+    with pytest.raises(RuntimeError):
+        batcher.embed([1])
+    batcher.close()
@@ -0,0 +1,63 @@
+import json
+import sys
+import numpy as np
+import pytest
+from app import benchmark
+from app.benchmark import measure, synthetic_frame, RandomEmbedder, seed_database
+from app.models import Person
+
+
+'''
+тесты на бенчмарки
+1. замер возвращает p50/p95/mean и количество замеров
+2. сгенерированные кадры и случайный эмбеддер детерминированы, разные кадры дают разные векторы
+3. база заполняется заданным количеством клиентов с уникальными телефонами
+4. --quick пишет результаты в JSON, --compare сравнивает их с предыдущим запуском
+'''
+
+def test_measure():
+    calls = []
+    stats = measure(lambda: calls.append(1), repeats=5, warmup=2)
+    assert len(calls) == 7
+    assert stats["n"] == 5
+    assert 0 <= stats["p50_ms"] <= stats["p95_ms"]
+
+
+def test_synthetic_frame_and_embedder():
+    frame = synthetic_frame(320, 240, seed=1)
+    assert frame.shape == (240, 320, 3) and frame.dtype == np.uint8
+    assert np.array_equal(frame, synthetic_frame(320, 240, seed=1))
+    assert not np.array_equal(frame, synthetic_frame(320, 240, seed=2))
+
+    embedder = RandomEmbedder(seed=0)
+    first, same, other = embedder.embed_batch([frame, frame.copy(), synthetic_frame(320, 240, seed=2)])
+    assert first.shape == (512,)
+    assert np.linalg.norm(first) == pytest.approx(1, abs=1e-5)
+    assert np.allclose(first, same)
+    assert np.allclose(first, RandomEmbedder(seed=0).embed_batch([frame])[0], atol=1e-5)
+    assert float(first @ other) < 0.99, 'Разные кадры дают почти одинаковые эмбеддинги'
+
+
+def test_seed_database(tmp_path):
+    db = seed_database(str(tmp_path / "bench.db"), 25)
+    assert db.query(Person).count() == 25
+    assert db.query(Person.phone_number).distinct().count() == 25
+    db.close()
+
+
+def test_quick_output_and_compare(tmp_path, monkeypatch, capsys):
+    output = tmp_path / "bench.json"
+    monkeypatch.setattr(sys, "argv", ["benchmark", "--quick", "--only", "database", "--output", str(output)])
+    benchmark.main()
+    report = json.loads(output.read_text(encoding="utf-8"))
+    names = {result["name"] for result in report["results"]}
+    assert {"db.dashboard_stats", "db.page_20_deep", "db.export_full_scan"} <= names
+    assert all(result["params"] == {"rows": 1000} and result["n"] == 3 for result in report["results"])
+    assert "cpu_count" in report["meta"]
+
+    capsys.readouterr()
+    monkeypatch.setattr(sys, "argv", ["benchmark", "--quick", "--only", "database", "--compare", str(output)])
+    benchmark.main()
+    lines = [line for line in capsys.readouterr().out.splitlines() if line.startswith("db.")]
+    # Каждый бенчмарк печатается один раз с результатом и один раз в сравнении
+    assert len(lines) == 2 * len(report["results"])
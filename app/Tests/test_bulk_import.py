@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, Person
+from app import bulk_import
+from app.bulk_import import read_records, import_persons, PhotoSource
+from app.photo_store import content_hash
+
+
+'''
+тесты на массовый импорт клиентов
+1. строки вставляются пачками, ошибки по строкам попадают в отчет и не прерывают импорт;
+   клиент без найденного фото вставляется, а строка попадает в предупреждения
+2. JSONL читается так же, как CSV
+3. фото из папки сохраняются в хранилище по хэшу и привязываются к клиенту
+4. строки с файлом, который не является изображением, пропускаются
+'''
+
+CSV_DATA = """first_name,last_name,middle_name,birth_date,phone_number,email,payment_date,payment_amount,photo
+Иван,Иванович,Иванов,1990-01-01,+70000000001,ivan@mail.ru,2025-01-01,1000,ivan.jpg
+Петр,Петрович,Петров,1991-02-02,+70000000002,petr@mail.ru,2025-01-02,0,
+Анна,Ивановна,Иванова,не-дата,+70000000003,anna@mail.ru,2025-01-03,500,
+Олег,Олегович,Олегов,1992-03-03,+70000000001,oleg@mail.ru,2025-01-04,500,
+Мария,Ивановна,Петрова,1993-04-04,+70000000005,maria@mail.ru,2025-01-05,700,missing.jpg
+"""
+
+JPEG = cv2.imencode(".jpg", np.full((32, 32, 3), 128, dtype=np.uint8))[1].tobytes()
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Фикстура с базой SQLite во временной папке"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def photo_dir(tmp_path, monkeypatch):
+    """Фикстура: фото клиентов и папка static/photo во временной папке"""
+    monkeypatch.setattr(bulk_import, "BASE_DIR", str(tmp_path))
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "ivan.jpg").write_bytes(JPEG)
+    (source / "page.html").write_bytes(b"<script>alert(1)</script>")
+    (source / "fake.png").write_bytes(b"<svg></svg>")
+    return source
+
+
+def test_import_csv(db, photo_dir, tmp_path):
+    report = import_persons(db, read_records(CSV_DATA.encode(), "clients.csv"),
+                            PhotoSource(str(photo_dir)), embed=False, batch_size=2)
+
+    assert report["rows"] == 5
+    assert report["inserted"] == 3
+    assert sorted(error["row"] for error in report["errors"]) == [3, 4], 'Ошибки по строкам не попали в отчет'
+    assert report["warnings"] == [{"row": 5, "warning": "Фото missing.jpg не найдено"}]
+    assert db.query(Person).count() == 3
+    # Строка с ненайденным фото вставлена без фото, строки с ошибками — нет
+    assert db.query(Person).filter(Person.email == "maria@mail.ru").one().photo_path is None
+
+    ivan = db.query(Person).filter(Person.email == "ivan@mail.ru").one()
+    digest = content_hash(JPEG)
+    assert ivan.photo_path == f"/static/photo/{digest[:2]}/{digest}.jpg"
+    assert (tmp_path / "static" / "photo" / digest[:2] / f"{digest}.jpg").read_bytes() == JPEG
+
+
+def test_import_jsonl_skips_existing(db, photo_dir):
+    import_persons(db, read_records(CSV_DATA.encode(), "clients.csv"), embed=False)
+    jsonl = ('{"first_name": "Иван", "last_name": "Иванович", "middle_name": "Иванов", "birth_date": "1990-01-01", '
+             '"phone_number": "+70000000001", "email": "new@mail.ru", "payment_date": "2025-01-01", "payment_amount": 1}\n'
+             '{"first_name": "Ольга", "last_name": "Олеговна", "middle_name": "Олегова", "birth_date": "1990-01-01", '
+             '"phone_number": "+70000000009", "email": "olga@mail.ru", "payment_date": "2025-01-01", "payment_amount": 1}\n')
+    report = import_persons(db, read_records(jsonl, "clients.jsonl"), embed=False)
+    assert report["inserted"] == 1
+    assert report["errors"] == [{"row": 1, "error": "Телефон или email уже есть в базе"}]
+
+
+def test_import_rejects_non_images(db, photo_dir, tmp_path):
+    rows = CSV_DATA.splitlines()[0] + "\n" + "\n".join([
+        "Иван,Иванович,Иванов,1990-01-01,+70000000001,ivan@mail.ru,2025-01-01,1000,page.html",
+        "Петр,Петрович,Петров,1991-02-02,+70000000002,petr@mail.ru,2025-01-02,0,fake.png",
+        "Олег,Олегович,Олегов,1992-03-03,+70000000001,oleg@mail.ru,2025-01-04,500,ivan.jpg",
+    ])
+    report = import_persons(db, read_records(rows, "clients.csv"), PhotoSource(str(photo_dir)), embed=False)
+    assert [error["row"] for error in report["errors"]] == [1, 2]
+    assert (report["inserted"], report["photos"]) == (1, 1)
+    # Телефон пропущенной строки не считается занятым
+    assert db.query(Person).one().email == "oleg@mail.ru"
+    stored = [path.suffix for path in (tmp_path / "static" / "photo").rglob("*") if path.is_file()]
+    assert stored == [".jpg"], 'Файл, который не является изображением, попал в хранилище'
@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+import pytest
+from app.camera import CaptureService, CameraError
+
+
+'''
+тесты на сервис захвата кадров
+1. папка с изображениями работает как камера, кадры попадают в кольцевой буфер
+2. изменение выданного кадра не портит буфер
+3. недоступный источник не роняет программу
+'''
+
+@pytest.fixture
+def image_dir(tmp_path):
+    """Фикстура с папкой из трех изображений разной яркости"""
+    for i in range(3):
+        cv2.imwrite(str(tmp_path / f"frame_{i}.png"), np.full((48, 64, 3), 50 * (i + 1), dtype=np.uint8))
+    return tmp_path
+
+
+def test_directory_source(image_dir):
+    service = CaptureService(str(image_dir), buffer_size=4, fps=200)
+    service.start()
+    try:
+        frames = list(service.frames(max_frames=6))
+        assert len(frames) == 6
+        assert all(frame.shape == (48, 64, 3) for frame in frames)
+        assert {int(frame[0, 0, 0]) for frame in frames} == {50, 100, 150}, 'Кадры из папки читаются не по кругу'
+
+        latest = service.latest(2)
+        assert len(latest) == 2
+        latest[0][:] = 0
+        assert service.latest(2)[0].max() > 0, 'Изменение кадра испортило буфер'
+    finally:
+        service.stop()
+    assert not service.running
+
+
+def test_missing_source(tmp_path):
+    service = CaptureService(str(tmp_path / "no_such_video.mp4"))
+    service.start()
+    with pytest.raises(CameraError):
+        list(service.frames(max_frames=1, timeout=0.5))
+    service.stop()
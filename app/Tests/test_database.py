@@ -0,0 +1,71 @@
+import asyncio
+import os
+import pytest
+from datetime import date
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import sessionmaker
+from app.database import create_db_engine, create_async_db_engine, async_database_url
+from app.models import Base, Person
+from app.stats import query_dashboard_stats, query_dashboard_stats_async, query_monthly_breakdown_async
+
+
+'''
+тесты на соединение с базой данных
+1. для файла SQLite включаются WAL, busy_timeout и внешние ключи
+2. асинхронный драйвер подставляется по синхронному URL
+3. асинхронные запросы дашборда совпадают с синхронными
+'''
+
+@pytest.fixture
+def db_url(tmp_path):
+    """URL файла SQLite с одним клиентом"""
+    url = f"sqlite:///{os.path.join(tmp_path, 'test.db')}"
+    engine = create_db_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as session:
+        session.add(Person(first_name="Иван", last_name="Иванович", middle_name="Иванов",
+                           birth_date=date(1990, 1, 1), phone_number="1", email="1@mail.ru",
+                           payment_date=date(2025, 1, 5), payment_amount=1500))
+        session.commit()
+    yield url
+    engine.dispose()
+
+
+def test_sqlite_pragmas(db_url):
+    engine = create_db_engine(db_url)
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        assert connection.execute(text("PRAGMA foreign_keys")).scalar() == 1
+    engine.dispose()
+
+
+def test_indexes_created(db_url):
+    engine = create_db_engine(db_url)
+    names = {index["name"] for index in inspect(engine).get_indexes("persons")}
+    assert {"ix_persons_payment_date", "ix_persons_payment_amount"} <= names
+    engine.dispose()
+
+
+def test_async_database_url():
+    assert async_database_url("sqlite:///./database.db").drivername == "sqlite+aiosqlite"
+    assert async_database_url("postgresql://user:pw@host/db").drivername == "postgresql+asyncpg"
+
+
+def test_async_dashboard_queries(db_url):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    async def run():
+        engine = create_async_db_engine(str(async_database_url(db_url)))
+        async with AsyncSession(engine) as session:
+            result = (await query_dashboard_stats_async(session), await query_monthly_breakdown_async(session))
+        await engine.dispose()
+        return result
+
+    stats, months = asyncio.run(run())
+    engine = create_db_engine(db_url)
+    with sessionmaker(bind=engine)() as session:
+        assert stats == query_dashboard_stats(session)
+    engine.dispose()
+    assert months == [{"month": "2025-01", "clients": 1, "not_paid": 0, "paid_sum": 1500.0}]
@@ -0,0 +1,45 @@
+import pytest
+import numpy as np
+from itertools import combinations
+from app.duplicates import find_duplicate, similar_pairs, duplicate_clusters
+from app.gallery_index import GalleryIndex, normalize
+
+
+'''
+тесты на поиск дубликатов по лицу
+1. при сохранении находится уже зарегистрированное лицо выше порога
+2. блочный подсчет пар совпадает с попарным сравнением
+3. связанные пары объединяются в группы
+'''
+
+@pytest.fixture
+def vectors():
+    """300 случайных векторов; 5 и 6 — почти копии 1, 11 — почти копия 10"""
+    rng = np.random.default_rng(7)
+    vectors = normalize(rng.normal(size=(300, 512)))
+    vectors[5] = normalize(vectors[1] + 0.1 * rng.normal(size=512) / np.sqrt(512))
+    vectors[6] = normalize(vectors[1] + 0.1 * rng.normal(size=512) / np.sqrt(512))
+    vectors[11] = normalize(vectors[10] + 0.1 * rng.normal(size=512) / np.sqrt(512))
+    return vectors
+
+
+def test_find_duplicate(vectors):
+    gallery = GalleryIndex()
+    gallery.build([(i + 1, v) for i, v in enumerate(vectors[:5])])
+    id_client, score = find_duplicate(gallery, vectors[5], threshold=0.8)
+    assert id_client == 2 and score > 0.9
+    assert find_duplicate(gallery, vectors[100], threshold=0.8) is None
+
+
+def test_blocked_pairs_match_bruteforce(vectors):
+    rows, cols, scores = similar_pairs(vectors, threshold=0.1, block_size=64)
+    expected = {(i, j) for i, j in combinations(range(len(vectors)), 2) if vectors[i] @ vectors[j] >= 0.1}
+    assert set(zip(rows.tolist(), cols.tolist())) == expected
+    assert np.allclose(scores, np.sum(vectors[rows] * vectors[cols], axis=1), atol=1e-5)
+
+
+def test_duplicate_clusters(vectors):
+    clusters = duplicate_clusters([(i + 1, v) for i, v in enumerate(vectors)], threshold=0.8, block_size=50)
+    assert [cluster["ids"] for cluster in clusters] == [[2, 6, 7], [11, 12]]
+    assert len(clusters[0]["pairs"]) == 3
+    assert duplicate_clusters([]) == []
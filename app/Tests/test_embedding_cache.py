@@ -0,0 +1,52 @@
+import numpy as np
+from PIL import Image
+from app.embedding_cache import EmbeddingCache, content_key, MISSING
+
+
+'''
+тесты на кэш эмбеддингов
+1. ключ зависит от содержимого изображения и версии модели
+2. записи вытесняются по LRU при превышении лимита памяти и по времени жизни
+3. у замененного фото другой ключ
+'''
+
+def test_content_key(tmp_path):
+    array = np.zeros((10, 10, 3), dtype=np.uint8)
+    assert content_key(array, "v1") == content_key(array.copy(), "v1")
+    assert content_key(array, "v1") != content_key(array, "v2")
+    assert content_key(Image.fromarray(array), "v1") == content_key(Image.fromarray(array.copy()), "v1")
+
+    photo = tmp_path / "photo.jpg"
+    photo.write_bytes(b"first")
+    key = content_key(str(photo), "v1")
+    photo.write_bytes(b"second")
+    assert content_key(str(photo), "v1") != key
+
+
+def test_lru_memory_cap():
+    cache = EmbeddingCache(max_mb=3000 / 1024 / 1024)  # три вектора по 1000 байт с накладными расходами
+    vectors = [np.zeros(218, dtype=np.float32) for _ in range(4)]
+    for i in range(3):
+        cache.put(i, vectors[i])
+    assert cache.get(0) is vectors[0]  # 0 становится самым свежим
+    cache.put(3, vectors[3])
+    assert cache.get(1) is MISSING, 'Вытеснена не самая старая запись'
+    assert cache.get(0) is vectors[0]
+    assert cache.evictions == 1
+    assert cache.bytes <= cache.max_bytes
+
+
+def test_ttl_and_counters():
+    now = [0.0]
+    cache = EmbeddingCache(max_mb=1, ttl=10, clock=lambda: now[0])
+    cache.put("no_face", None)
+    assert cache.get("no_face") is None, 'Отметка "лица нет" не сохранилась'
+    now[0] = 11
+    assert cache.get("no_face") is MISSING
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 0)
+
+
+def test_disabled():
+    cache = EmbeddingCache(max_mb=0)
+    cache.put("key", np.ones(4))
+    assert not cache.enabled and cache.get("key") is MISSING
@@ -0,0 +1,135 @@
+import pytest
+import numpy as np
+from datetime import date
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, Person
+from app.embedding_store import (
+    embedding_to_bytes, embedding_from_bytes, save_embedding, load_gallery, embed_persons,
+    save_crop, load_crop, save_crops, load_crops, save_templates, count_embeddings, count_gallery_clients
+)
+
+
+'''
+тесты на хранилище эмбеддингов
+1. вектор переживает перевод в байты и обратно
+2. повторное сохранение заменяет старый вектор той же версии модели
+3. для фото без эмбеддинга вектор считается с детекцией, для ненайденного фото — нет
+4. при сохраненном кропе лицо не детектируется заново
+5. несколько шаблонов клиента заменяют его старые векторы, в галерее он считается один раз
+6. при пересчете по кропам считаются все шаблоны клиента
+'''
+
+@pytest.fixture
+def db():
+    """Фикстура с базой SQLite в памяти"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def add_person(db, phone, photo_path=None):
+    person = Person(first_name="Иван", last_name="Иванович", middle_name="Иванов",
+                    birth_date=date(1990, 1, 1), phone_number=phone, email=f"{phone}@mail.ru",
+                    payment_date=date(2025, 1, 1), payment_amount=1000, photo_path=photo_path)
+    db.add(person)
+    db.commit()
+    return person
+
+
+class FakeDetection:
+    crop = np.full((160, 160, 3), 100, dtype=np.uint8)
+    embedding = np.ones(512, dtype=np.float32) / np.sqrt(512)
+
+
+class FakeRecognizer:
+    """Заглушка вместо FaceNet: возвращает фиксированный вектор и считает вызовы детекции"""
+    model_version = "test-model"
+
+    def __init__(self):
+        self.detected = 0
+        self.embedded_crops = 0
+
+    def analyze(self, images, use_batcher=True):
+        self.detected += len(images)
+        return [FakeDetection() for _ in images]
+
+    def embed_crops(self, crops, use_batcher=True):
+        self.embedded_crops += len(crops)
+        return [FakeDetection.embedding for _ in crops]
+
+
+def test_bytes_roundtrip():
+    vector = np.random.rand(512).astype(np.float32)
+    assert np.array_equal(embedding_from_bytes(embedding_to_bytes(vector)), vector)
+
+
+def test_save_replaces_same_version(db):
+    person = add_person(db, "+79990000001")
+    save_embedding(db, person.id_client, np.zeros(512), "v1")
+    save_embedding(db, person.id_client, np.ones(512), "v1")
+    save_embedding(db, person.id_client, np.ones(512), "v2")
+    db.commit()
+
+    gallery = load_gallery(db, "v1")
+    assert len(gallery) == 1, 'Старый вектор не заменился'
+    assert gallery[0][0] == person.id_client
+    assert gallery[0][1][0] == 1
+
+
+def test_save_templates(db):
+    person = add_person(db, "+79990000005")
+    other = add_person(db, "+79990000006")
+    save_embedding(db, person.id_client, np.zeros(512), "v1")
+    save_templates(db, person.id_client, [np.ones(512), np.full(512, 2), np.full(512, 3)], "v1")
+    save_embedding(db, other.id_client, np.ones(512), "v1")
+    db.commit()
+
+    gallery = load_gallery(db, "v1")
+    assert sorted(vector[0] for id_client, vector in gallery if id_client == person.id_client) == [1, 2, 3]
+    assert count_embeddings(db, "v1") == 4
+    assert count_gallery_clients(db, "v1") == 2
+
+
+def test_embed_persons(db, tmp_path):
+    photo = tmp_path / "static" / "photo" / "ivan.jpg"
+    photo.parent.mkdir(parents=True)
+    photo.write_bytes(b"jpeg")
+    ivan = add_person(db, "+79990000002", photo_path="/static/photo/ivan.jpg")
+    lost = add_person(db, "+79990000003", photo_path="/static/photo/missing.jpg")
+
+    recognizer = FakeRecognizer()
+    (_, vectors, crop, status), (_, lost_vectors, _, lost_status) = embed_persons(
+        recognizer, str(tmp_path), [(ivan.id_client, ivan.photo_path), (lost.id_client, lost.photo_path)])
+    assert (status, len(vectors), lost_status, lost_vectors) == ("photo", 1, "no_photo", None)
+    assert np.array_equal(crop, FakeDetection.crop), 'Кроп для сохранения не возвращен'
+    assert recognizer.detected == 1
+
+
+def test_reembed_from_crop(db, tmp_path):
+    person = add_person(db, "+79990000004", photo_path="/static/photo/missing.jpg")
+    save_crop(str(tmp_path), person.id_client, FakeDetection.crop)
+    assert np.array_equal(load_crop(str(tmp_path), person.id_client), FakeDetection.crop)
+
+    # Эмбеддинг пересчитывается по кропу, фото и детекция не нужны
+    recognizer = FakeRecognizer()
+    [(_, vectors, crop, status)] = embed_persons(recognizer, str(tmp_path), [(person.id_client, person.photo_path)])
+    assert (status, len(vectors), crop) == ("crop", 1, None)
+    assert recognizer.detected == 0 and recognizer.embedded_crops == 1
+
+
+def test_reembed_keeps_templates(db, tmp_path):
+    person = add_person(db, "+79990000007", photo_path="/static/photo/missing.jpg")
+    crops = [np.full((160, 160, 3), value, dtype=np.uint8) for value in (10, 20, 30)]
+    save_crops(str(tmp_path), person.id_client, crops)
+    save_crops(str(tmp_path), 99, crops)
+    save_crops(str(tmp_path), 99, crops[:1])
+    assert len(load_crops(str(tmp_path), 99)) == 1, 'Кропы старых шаблонов не удалены'
+    assert [crop[0, 0, 0] for crop in load_crops(str(tmp_path), person.id_client)] == [10, 20, 30]
+
+    recognizer = FakeRecognizer()
+    [(_, vectors, _, _)] = embed_persons(recognizer, str(tmp_path), [(person.id_client, person.photo_path)])
+    assert recognizer.embedded_crops == 3
+    assert len(vectors) == 3, 'Шаблоны клиента схлопнулись в один вектор'
@@ -0,0 +1,106 @@
+import pytest
+from app.faceNet_try import FaceNetVerify, load_resnet_weights, model_version_for, MODEL_VERSION
+from app.inference_profile import effective_profile
+
+
+'''
+тесты на загрузку весов FaceNet
+1. веса классификатора (logits.*) отбрасываются, остальные загружаются строго
+2. неполный или чужой файл весов не загружается молча
+3. версия эмбеддингов зависит от файла весов и фактически примененного профиля
+4. без предзагрузки сервис готов сразу, ленивая загрузка отмечает готовность;
+   после ошибки загрузки прогрев запускается повторно
+'''
+
+class FakeResnet:
+    """Как torch-модуль: load_state_dict(strict=True) падает при несовпадении ключей"""
+    keys = {"conv2d_1a.conv.weight", "last_linear.weight"}
+
+    def __init__(self):
+        self.loaded = None
+
+    def load_state_dict(self, state_dict, strict=True):
+        assert strict, 'Веса должны загружаться строго'
+        missing, unexpected = self.keys - set(state_dict), set(state_dict) - self.keys
+        if missing or unexpected:
+            raise RuntimeError(f"missing {sorted(missing)}, unexpected {sorted(unexpected)}")
+        self.loaded = state_dict
+
+
+def test_logits_dropped():
+    resnet = FakeResnet()
+    load_resnet_weights(resnet, {"conv2d_1a.conv.weight": 1, "last_linear.weight": 2,
+                                 "logits.weight": 3, "logits.bias": 4})
+    assert set(resnet.loaded) == FakeResnet.keys
+
+
+@pytest.mark.parametrize("state_dict", [
+    {"conv2d_1a.conv.weight": 1},  # обрезанный файл
+    {"conv2d_1a.conv.weight": 1, "last_linear.weight": 2, "other.weight": 3},  # чужая модель
+])
+def test_mismatched_weights_raise(state_dict):
+    with pytest.raises(ValueError, match="не подходит"):
+        load_resnet_weights(FakeResnet(), state_dict, "weights.pt")
+
+
+def test_model_version(tmp_path):
+    assert model_version_for(None, "fp32") == MODEL_VERSION
+    assert model_version_for(None, "int8-dynamic") == f"{MODEL_VERSION}+int8-dynamic"
+
+    weights = tmp_path / "weights.pt"
+    weights.write_bytes(b"a")
+    first = model_version_for(str(weights))
+    assert first != MODEL_VERSION and first == model_version_for(str(weights))
+    weights.write_bytes(b"b")
+    assert model_version_for(str(weights)) != first, 'Другие веса под той же версией'
+
+
+def test_effective_profile():
+    assert effective_profile("int8-static", calibration_dir=None) == "int8-dynamic"
+    assert effective_profile("int8-static", calibration_dir="faces/") == "int8-static"
+    assert effective_profile("fp32", calibration_dir=None) == "fp32"
+    with pytest.raises(ValueError):
+        effective_profile("int4")
+
+
+@pytest.fixture
+def recognizer(monkeypatch):
+    """Новый экземпляр FaceNetVerify, загрузка моделей заменена заглушкой"""
+    monkeypatch.setattr(FaceNetVerify, "_instance", None)
+    recognizer = FaceNetVerify()
+    recognizer.load_calls = 0
+
+    def fake_load(weights_path, traced_cache, profile):
+        recognizer.load_calls += 1
+        if recognizer.load_calls == 1 and getattr(recognizer, "fail_first", False):
+            raise RuntimeError("нет весов")
+        recognizer._mtcnn, recognizer._resnet = object(), object()
+
+    monkeypatch.setattr(recognizer, "_load_models", fake_load)
+    return recognizer
+
+
+def test_lazy_load_without_preload(recognizer):
+    ready, status = recognizer.readiness(preload=False)
+    assert ready and not status["loaded"], 'Без предзагрузки проверка готовности не пропустит первый запрос'
+    assert recognizer.readiness(preload=True)[0] is False
+
+    recognizer.resnet  # первый запрос загружает модели
+    assert recognizer.ready
+    ready, status = recognizer.readiness(preload=True)
+    assert ready and status["loaded"]
+
+
+def test_failed_load_retried(recognizer, monkeypatch):
+    recognizer.fail_first = True
+    with pytest.raises(RuntimeError):
+        recognizer.load()
+    assert recognizer.load_error == "нет весов" and not recognizer.ready
+
+    started = []
+    monkeypatch.setattr(recognizer, "start_warmup", lambda: started.append(True))
+    assert recognizer.readiness(preload=True)[0] is False
+    assert started, 'После ошибки загрузки прогрев не запущен повторно'
+
+    recognizer.load()
+    assert recognizer.ready and recognizer.load_error is None
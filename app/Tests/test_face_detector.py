@@ -1,14 +1,15 @@
 import pytest
 import cv2
 import numpy as np
-from app.face_detector import FaceDetectorHaar  # Импортируем класс из face_detector.py
+from app.face_detector import FaceDetectorHaar, FaceTracker  # Импортируем класс из face_detector.py
 
 
 '''
 тесты на работу распознавания лиц
 1. тест на загрузку каскадов Хаара
 2. тест на то, что в случае отсутствия лиц. программа не крашится
-3. 
+3. рамки из быстрого режима и из области поиска пересчитываются в координаты кадра
+4. detect_batch возвращает результаты в порядке кадров
 '''
 
 @pytest.fixture
@@ -31,3 +32,57 @@ def test_faces_none(haar_model):
 
 
 
+
+def test_detect_faces_keeps_original(haar_model):
+    """Прямоугольники рисуются на копии, исходный кадр не меняется"""
+    img = np.full((200, 200, 3), 128, dtype=np.uint8)
+    original = img.copy()
+    _, annotated = haar_model.detect_faces(img)
+    assert np.array_equal(img, original), 'Исходный кадр изменился'
+    assert annotated is not img
+
+
+class FakeCascade:
+    """Каскад, который всегда находит одно лицо в центре переданного изображения"""
+
+    def __init__(self):
+        self.shapes = []
+
+    def detectMultiScale(self, image, scaleFactor, minNeighbors, minSize):
+        self.shapes.append(image.shape)
+        h, w = image.shape[:2]
+        return np.array([[w // 4, h // 4, w // 2, h // 2]], dtype=np.int32)
+
+
+def test_fast_mode_maps_boxes_back(haar_model):
+    """Поиск идет на уменьшенной серой копии, рамка возвращается в координатах исходного кадра"""
+    haar_model._local.cascade = cascade = FakeCascade()
+    faces = haar_model.find_faces(np.zeros((800, 1600, 3), dtype=np.uint8), detect_width=400)
+    assert cascade.shapes == [(200, 400)]
+    assert faces.tolist() == [[400, 200, 800, 400]]
+
+
+def test_roi_search(haar_model):
+    """Ищем только в области; область за краем кадра обрезается"""
+    haar_model._local.cascade = cascade = FakeCascade()
+    faces = haar_model.find_faces(np.zeros((400, 400, 3), dtype=np.uint8), roi=(300, -100, 200, 300))
+    assert cascade.shapes == [(200, 100)]
+    assert faces.tolist() == [[325, 50, 50, 100]]
+    assert len(haar_model.find_faces(np.zeros((400, 400, 3), dtype=np.uint8), roi=(500, 500, 10, 10))) == 0
+
+
+def test_tracker_searches_near_previous_face(haar_model):
+    haar_model._local.cascade = cascade = FakeCascade()
+    tracker = FaceTracker(haar_model, margin=0.1, full_scan_every=2)
+    frame = np.zeros((400, 400, 3), dtype=np.uint8)
+    for _ in range(4):
+        tracker.find_faces(frame)
+    # первый кадр и каждый третий — по всему кадру, остальные — в области вокруг прошлой рамки
+    assert [shape == (400, 400) for shape in cascade.shapes] == [True, False, False, True]
+
+
+def test_detect_batch(haar_model):
+    frames = [np.full((120, 160 + 40 * i, 3), 128, dtype=np.uint8) for i in range(4)]
+    haar_model.batch_workers = 2
+    results = haar_model.detect_batch(frames)
+    assert len(results) == 4 and all(len(faces) == 0 for faces in results)
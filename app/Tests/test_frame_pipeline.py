@@ -0,0 +1,62 @@
+import numpy as np
+from app.frame_pipeline import VerificationPipeline, downscale
+
+
+'''
+тесты на конвейер верификации
+1. кадры без лица не отправляются в модель
+2. обработка заканчивается, как только несколько кадров подряд указывают на одного клиента
+3. уменьшение кадра не меняет исходный кадр
+'''
+
+class FakeDetector:
+    """Лицо есть на кадрах, где первый пиксель ненулевой"""
+    def find_faces(self, image):
+        return [(0, 0, 10, 10)] if image[0, 0, 0] else []
+
+
+class FakeRecognizer:
+    """Для каждого кадра с лицом возвращает клиента 7 со сходством 0.6"""
+    def __init__(self):
+        self.embedded = 0
+
+    def embed_batch(self, images, cache=True):
+        self.embedded += len(images)
+        return [np.ones(4) for _ in images]
+
+    def search_gallery(self, embedding, k=5, rerank=None):
+        return [(7, 0.6), (3, 0.2)][:k]
+
+    def rescore_gallery(self, embedding, candidates, top=None):
+        return candidates
+
+
+def make_frames(pattern):
+    return [np.full((20, 20, 3), value, dtype=np.uint8) for value in pattern]
+
+
+def test_faceless_frames_skipped_and_early_exit():
+    recognizer = FakeRecognizer()
+    pipeline = VerificationPipeline(FakeDetector(), recognizer, threshold=0.5, batch_size=1, min_agree=2)
+
+    result = pipeline.run(make_frames([0, 0, 1, 0, 1, 1, 1, 1]))
+    assert result["matched_id"] == 7
+    assert result["frames_examined"] == 5, 'Обработка не остановилась после устойчивого решения'
+    assert result["frames_embedded"] == recognizer.embedded == 2, 'Кадры без лица ушли в модель'
+    assert result["candidates"][0] == (7, 0.6)
+
+
+def test_no_faces():
+    pipeline = VerificationPipeline(FakeDetector(), FakeRecognizer(), threshold=0.5)
+    result = pipeline.run(make_frames([0, 0, 0]))
+    assert result["matched_id"] is None
+    assert result["frames_embedded"] == 0
+    assert result["elapsed_ms"] >= 0
+
+
+def test_downscale_keeps_original():
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    small = downscale(frame, 320)
+    small[:] = 255
+    assert small.shape == (180, 320, 3)
+    assert frame.max() == 0, 'Исходный кадр изменился'
@@ -0,0 +1,109 @@
+import pytest
+import numpy as np
+from app.gallery_index import GalleryIndex, normalize, group_templates
+
+
+'''
+тесты на поиск по галерее
+1. точный поиск возвращает ближайших по убыванию сходства
+2. добавление клиента без перестроения индекса
+3. приближенный поиск находит того же клиента, что и точный; замена вектора
+   не меняет матрицу и кластеры, которые уже взял поиск, и переносит строку в новый кластер
+4. у клиента с несколькими шаблонами в матрице поиска одна строка (центроид),
+   шаблоны поднимают сходство только лучших кандидатов
+'''
+
+@pytest.fixture
+def gallery_vectors():
+    """Фикстура со случайной галереей из 500 нормированных векторов"""
+    rng = np.random.default_rng(42)
+    return normalize(rng.normal(size=(500, 512)))
+
+
+def test_exact_top_k(gallery_vectors):
+    index = GalleryIndex(ann_threshold=10**9)
+    index.build([(i + 1, v) for i, v in enumerate(gallery_vectors)])
+
+    result = index.search(gallery_vectors[10], k=3)
+    assert len(result) == 3
+    assert result[0][0] == 11, 'Ближайшим должен быть сам клиент'
+    assert result[0][1] == pytest.approx(1.0, abs=1e-5)
+    assert result[0][1] >= result[1][1] >= result[2][1], 'Кандидаты не отсортированы'
+
+
+def test_empty_and_add(gallery_vectors):
+    index = GalleryIndex(ann_threshold=10**9)
+    assert index.search(gallery_vectors[0]) == []
+
+    index.add(7, gallery_vectors[0])
+    index.add(8, gallery_vectors[1])
+    index.add(7, gallery_vectors[2])  # замена вектора клиента
+    assert len(index) == 2
+    assert index.search(gallery_vectors[2], k=1)[0][0] == 7
+
+
+def test_ann_matches_exact(gallery_vectors):
+    exact = GalleryIndex(ann_threshold=10**9)
+    ann = GalleryIndex(ann_threshold=100, n_probe=4)
+    entries = [(i, v) for i, v in enumerate(gallery_vectors)]
+    exact.build(entries)
+    ann.build(entries)
+    assert ann.ivf is not None, 'Приближенный индекс не построен'
+
+    rng = np.random.default_rng(0)
+    for i in rng.choice(len(gallery_vectors), 20, replace=False):
+        # запрос — зашумленная копия вектора клиента
+        query = gallery_vectors[i] + 0.02 * rng.normal(size=512)
+        assert ann.search(query, k=1)[0][0] == exact.search(query, k=1)[0][0] == i
+
+
+def test_ann_replace_copy_on_write(gallery_vectors):
+    index = GalleryIndex(ann_threshold=100, n_probe=1)
+    index.build([(i, v) for i, v in enumerate(gallery_vectors[:200])])
+    matrix, ivf = index.matrix, index.ivf
+    before = matrix.copy()
+    lists_before = [members.copy() for members in ivf.lists]
+
+    # Новый вектор клиента 5 далеко от старого: он должен переехать в другой кластер
+    new_vector = gallery_vectors[300]
+    index.add(5, new_vector)
+    assert np.array_equal(matrix, before), 'Замена записала строку в матрицу, которую читает поиск'
+    assert all(np.array_equal(a, b) for a, b in zip(ivf.lists, lists_before)), 'Старые списки кластеров изменились'
+
+    lists = [c for c, members in enumerate(index.ivf.lists) if 5 in members]
+    assert lists == [int(np.argmax(index.ivf.centroids @ new_vector))], 'Строка не перенесена в ближайший кластер'
+    assert index.search(new_vector, k=1)[0][0] == 5
+    assert len(index) == 200
+
+
+def test_templates_centroid_and_rescore(gallery_vectors):
+    # Шаблоны клиента 1 — два разных ракурса, у остальных клиентов по одному вектору
+    pose_a, pose_b = gallery_vectors[0], gallery_vectors[1]
+    entries = [(1, pose_a), (1, pose_b)] + [(i, v) for i, v in enumerate(gallery_vectors[2:50], 2)]
+    ids, centroids, template_ids, templates = group_templates(entries)
+    assert len(ids) == len(centroids) == 49
+    assert list(template_ids) == [1, 1]
+
+    index = GalleryIndex(ann_threshold=10**9, rerank_top=3)
+    index.build(entries)
+    assert len(index) == 49
+
+    first_pass = index.search(pose_a, k=3, rerank=0)
+    assert first_pass[0][0] == 1
+    assert first_pass[0][1] == pytest.approx(float(normalize(pose_a + pose_b) @ pose_a), abs=1e-5), \
+        'Первый проход должен сравнивать с центроидом'
+    rescored = index.search(pose_a, k=3)
+    assert rescored[0] == (1, pytest.approx(1.0, abs=1e-5)), 'Шаблон не проверен во втором проходе'
+    assert index.rescore(pose_a, first_pass, top=0) == first_pass
+
+
+def test_add_replaces_templates(gallery_vectors):
+    index = GalleryIndex(ann_threshold=10**9)
+    index.add(5, gallery_vectors[:3])
+    index.add(6, gallery_vectors[3])
+    assert len(index) == 2 and len(index.template_ids) == 3
+
+    index.add(5, gallery_vectors[10])  # один новый вектор вместо трех шаблонов
+    assert len(index) == 2 and len(index.template_ids) == 0
+    assert index.search(gallery_vectors[0], k=1)[0][1] < 0.5, 'Старые шаблоны остались в поиске'
+    assert index.search(gallery_vectors[10], k=1)[0][0] == 5
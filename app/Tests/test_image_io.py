@@ -0,0 +1,21 @@
+import numpy as np
+from app.image_io import decode_image, encode_jpeg, frame_to_pil
+
+
+'''
+тесты на декодирование изображений в памяти
+1. JPEG из байтов декодируется в кадр того же размера
+2. битые данные не роняют программу
+'''
+
+def test_decode_jpeg_bytes():
+    frame = np.full((240, 320, 3), 128, dtype=np.uint8)
+    decoded = decode_image(encode_jpeg(frame))
+    assert decoded is not None, 'JPEG не декодировался'
+    assert decoded.shape == frame.shape
+    assert frame_to_pil(decoded).size == (320, 240)
+
+
+def test_decode_garbage():
+    assert decode_image(b"") is None
+    assert decode_image(b"not an image") is None, 'Битые данные декодировались'
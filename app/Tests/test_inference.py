@@ -0,0 +1,41 @@
+import asyncio
+import threading
+import pytest
+from app.inference import InferenceExecutor, InferenceBusyError
+
+
+'''
+тесты на пул инференса
+1. задача выполняется в отдельном потоке и возвращает результат
+2. при заполненной очереди запрос сразу отклоняется
+'''
+
+def test_run_in_pool():
+    executor = InferenceExecutor(workers=1, queue_limit=1)
+
+    async def main():
+        return await executor.run(lambda x: (x * 2, threading.current_thread().name), 21)
+
+    result, thread_name = asyncio.run(main())
+    executor.shutdown()
+    assert result == 42
+    assert thread_name.startswith("inference"), 'Задача выполнилась не в пуле'
+
+
+def test_busy_when_saturated():
+    executor = InferenceExecutor(workers=1, queue_limit=1)
+    release = threading.Event()
+
+    async def main():
+        # одна задача выполняется, одна ждет в очереди
+        running = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert executor.queue_depth == 1
+        with pytest.raises(InferenceBusyError):
+            await executor.run(release.wait)
+        release.set()
+        await asyncio.gather(*running)
+
+    asyncio.run(main())
+    executor.shutdown()
+    assert executor.pending == 0
@@ -0,0 +1,45 @@
+import pytest
+from app.inference_profile import apply_profile, quantize_dynamic
+
+
+'''
+тесты на профили инференса
+1. неизвестный профиль — ошибка
+2. fp32 возвращает исходную модель
+3. int8-dynamic квантует только линейные слои, свертки остаются fp32, выход близок к fp32
+'''
+
+def make_model():
+    torch = pytest.importorskip("torch")
+    torch.manual_seed(0)
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(3, 8, 3),
+        torch.nn.ReLU(),
+        torch.nn.AdaptiveAvgPool2d(1),
+        torch.nn.Flatten(),
+        torch.nn.Linear(8, 16),
+    ).eval()
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        apply_profile(object(), "int4")
+
+
+def test_fp32_unchanged():
+    model = object()
+    assert apply_profile(model, "fp32") is model
+
+
+def test_dynamic_quantizes_only_linear():
+    torch = pytest.importorskip("torch")
+    model = make_model()
+    quantized = quantize_dynamic(model)
+
+    assert type(quantized[0]) is torch.nn.Conv2d, 'Свертки при динамическом квантовании остаются fp32'
+    assert type(quantized[4]) is not torch.nn.Linear, 'Линейный слой не квантован'
+    assert type(model[4]) is torch.nn.Linear, 'Исходная модель изменилась'
+
+    batch = torch.rand(2, 3, 16, 16)
+    with torch.inference_mode():
+        assert torch.allclose(quantized(batch), model(batch), atol=0.05)
@@ -0,0 +1,102 @@
+import base64
+import pytest
+from datetime import date
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, Person
+from app.listing import page_persons, export_rows, export_csv, export_ndjson
+
+
+'''
+тесты на постраничный вывод и выгрузку клиентов
+1. страницы по курсору не пересекаются и покрывают всю таблицу
+2. фильтр неплательщиков
+3. выгрузка в CSV и NDJSON
+4. клиенты с пустыми ключами сортировки (фамилия, дата оплаты) не пропадают из страниц
+'''
+
+@pytest.fixture
+def db():
+    """Фикстура с базой SQLite в памяти и 25 клиентами"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    for i in range(25):
+        session.add(Person(first_name=f"Имя{i % 5}", last_name="Иванович", middle_name=f"Фамилия{i % 3}",
+                           birth_date=date(1990, 1, 1), phone_number=str(i), email=f"{i}@mail.ru",
+                           payment_date=date(2025, 1, 1 + i % 7), payment_amount=(i % 4) * 500))
+    session.commit()
+    yield session
+    session.close()
+
+
+@pytest.mark.parametrize("sort, descending", [("id", False), ("name", False), ("payment_date", True)])
+def test_pages_cover_table(db, sort, descending):
+    seen = []
+    cursor = None
+    while True:
+        persons, cursor = page_persons(db, sort=sort, after=cursor, limit=7, descending=descending)
+        seen.extend(person.id_client for person in persons)
+        if cursor is None:
+            break
+    assert sorted(seen) == list(range(1, 26)), 'Страницы пересекаются или пропускают записи'
+
+
+def test_not_paid_filter(db):
+    persons, cursor = page_persons(db, not_paid=True, limit=100)
+    assert cursor is None
+    assert len(persons) == 7
+    assert all(person.payment_amount == 0 for person in persons)
+
+
+def test_bad_cursor(db):
+    with pytest.raises(ValueError):
+        page_persons(db, sort="name", after="bm90IGpzb24=")
+
+
+@pytest.mark.parametrize("sort, payload", [
+    ("id", b"1"),  # число вместо списка
+    ("id", b'{"a": 1}'),
+    ("id", b'["1"]'),  # id_client строкой
+    ("name", b'[1, 2, 3]'),
+    ("payment_date", b'[20240101, 5]'),  # дата не строкой
+    ("payment_date", b'["not a date", 5]'),
+])
+def test_malformed_cursor(db, sort, payload):
+    with pytest.raises(ValueError):
+        page_persons(db, sort=sort, after=base64.urlsafe_b64encode(payload).decode())
+
+
+def test_export(db):
+    csv_text = "".join(export_csv(export_rows(db, search="Фамилия0")))
+    lines = csv_text.strip().splitlines()
+    assert lines[0].startswith("id_client,first_name")
+    assert len(lines) == 1 + 9
+
+    ndjson_lines = list(export_ndjson(export_rows(db, not_paid=True)))
+    assert len(ndjson_lines) == 7
+    assert '"payment_date": "2025-01-' in ndjson_lines[0]
+
+
+@pytest.mark.parametrize("sort", ["name", "payment_date"])
+@pytest.mark.parametrize("descending", [False, True])
+def test_null_sort_keys(sort, descending):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    for i in range(6):
+        db.add(Person(first_name=f"Имя{i}", last_name="Иванович", middle_name=f"Фамилия{i}" if i < 3 else None,
+                      birth_date=date(1990, 1, 1), phone_number=str(i), email=f"{i}@mail.ru",
+                      payment_date=date(2025, 1, 1 + i) if i % 2 else None, payment_amount=0))
+    db.commit()
+
+    seen = []
+    cursor = None
+    while True:
+        persons, cursor = page_persons(db, sort=sort, after=cursor, limit=2, descending=descending)
+        seen.extend(person.id_client for person in persons)
+        if cursor is None:
+            break
+    assert sorted(seen) == list(range(1, 7)), 'Клиенты с пустым ключом сортировки пропали'
+    assert len(seen) == 6
+    db.close()
@@ -0,0 +1,71 @@
+import pytest
+from app.loadtest import parse_mix, target_mix, Recorder, find_saturation, Kiosk
+
+
+'''
+тесты на нагрузочное тестирование
+1. доли запросов нормируются, неизвестный запрос — ошибка;
+   на внешнем сервере регистрации выключены, если их явно не разрешили
+2. итоги ступени: перцентили по эндпоинтам, ошибки и отказы 503 считаются отдельно
+3. точка насыщения: рост пропускной способности остановился, p95 больше SLO или есть ошибки
+'''
+
+def level(kiosks, rps, p95=100.0, error_rate=0.0, shed_rate=0.0):
+    return {"kiosks": kiosks, "throughput_rps": rps, "p95_ms": p95, "error_rate": error_rate, "shed_rate": shed_rate}
+
+
+def test_parse_mix():
+    assert parse_mix("verify_upload=3,enroll_upload=1") == {"verify_upload": 0.75, "enroll_upload": 0.25}
+    with pytest.raises(ValueError):
+        parse_mix("unknown=1")
+
+
+def test_target_mix_without_enroll():
+    mix = parse_mix("verify_upload=0.8,enroll_upload=0.1,verify_camera=0.1")
+    assert target_mix(mix, remote=False) is mix
+    assert target_mix(mix, remote=True, allow_enroll=True) is mix
+    remote = target_mix(mix, remote=True)
+    assert remote == pytest.approx({"verify_upload": 8 / 9, "verify_camera": 1 / 9})
+    with pytest.raises(ValueError):
+        target_mix(parse_mix("enroll_upload=1"), remote=True)
+
+
+def test_recorder_summary():
+    recorder = Recorder()
+    for latency in range(1, 101):
+        recorder.record("verify_upload", float(latency), 200)
+    recorder.record("enroll_upload", 5.0, 503)
+    recorder.record("enroll_upload", 5.0, 500)
+    recorder.record("enroll_upload", 5.0, "error")
+
+    summary = recorder.summary(kiosks=4, elapsed=10.0)
+    assert summary["requests"] == 103
+    assert summary["throughput_rps"] == 10.0
+    assert summary["error_rate"] == round(2 / 103, 4) and summary["shed_rate"] == round(1 / 103, 4)
+    stats = summary["endpoints"]["verify_upload"]
+    assert (stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]) == (50.5, 95.0, 99.0)
+    assert summary["endpoints"]["enroll_upload"]["statuses"] == {"500": 1, "503": 1, "error": 1}
+
+
+def test_find_saturation():
+    levels = [level(1, 5.0), level(2, 9.5), level(4, 10.0)]
+    saturation = find_saturation(levels, slo_ms=1000)
+    assert (saturation["max_kiosks"], saturation["saturated_at"]) == (2, 4)
+
+    assert find_saturation([level(1, 5.0), level(2, 9.0, p95=1500)], slo_ms=1000)["saturated_at"] == 2
+    assert find_saturation([level(1, 5.0), level(2, 9.0, shed_rate=0.05)], slo_ms=1000)["max_kiosks"] == 1
+    assert find_saturation([level(1, 5.0), level(2, 9.0)], slo_ms=1000)["saturated_at"] is None
+
+
+def test_kiosk_enrollment_is_unique():
+    kiosk = Kiosk(0, [b"a", b"b"], {"enroll_upload": 1.0})
+    first, second = kiosk.request("enroll_upload"), kiosk.request("enroll_upload")
+    assert first["data"]["phone_number"] != second["data"]["phone_number"]
+    assert len(kiosk.request("verify_upload")["files"]) == 3
+
+
+def test_kiosk_enrolls_new_faces():
+    kiosk = Kiosk(0, [b"a", b"b"], {"enroll_upload": 1.0}, new_face=lambda number: f"face{number}".encode())
+    first, second = kiosk.request("enroll_upload"), kiosk.request("enroll_upload")
+    assert first["files"][0][1][1] != second["files"][0][1][1], 'Регистрация отправляет одно и то же лицо'
+    assert first["files"][0][1][1] not in (b"a", b"b")
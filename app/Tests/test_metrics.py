@@ -0,0 +1,65 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from app.metrics import MetricsRegistry, STAGE_SECONDS, stage, start_profile, server_timing
+
+
+'''
+тесты на метрики
+1. счетчики и гистограммы выводятся в формате Prometheus
+2. этапы попадают в профиль запроса, в том числе из пула потоков
+3. заголовок Server-Timing суммирует повторяющиеся этапы
+'''
+
+def test_render():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Запросы", ("path",))
+    latency = registry.histogram("latency_seconds", "Задержка", buckets=(0.1, 1))
+    registry.gauge("queue_depth", "Очередь", lambda: 3)
+
+    requests.inc(path="/a")
+    requests.inc(2, path="/a")
+    latency.observe(0.05)
+    latency.observe(0.5)
+
+    text = registry.render()
+    assert 'requests_total{path="/a"} 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in text
+    assert "latency_seconds_count 2" in text
+    assert "queue_depth 3" in text
+    assert "# TYPE latency_seconds histogram" in text
+
+
+def test_stage_profile():
+    def run():
+        profile = start_profile()
+        before = STAGE_SECONDS.count(stage="test_stage")
+        with stage("test_stage"):
+            pass
+        # Этап из пула потоков попадает в тот же профиль, если задача запущена в копии контекста
+        with ThreadPoolExecutor(1) as pool:
+            pool.submit(contextvars.copy_context().run, _timed_stage).result()
+        return profile, STAGE_SECONDS.count(stage="test_stage") - before
+
+    profile, observed = contextvars.copy_context().run(run)
+    assert [name for name, _ in profile] == ["test_stage", "test_stage"]
+    assert observed == 2
+
+
+def _timed_stage():
+    with stage("test_stage"):
+        pass
+
+
+def test_stage_without_profile():
+    # Без профиля время все равно попадает в гистограмму
+    before = STAGE_SECONDS.count(stage="other_stage")
+    with stage("other_stage"):
+        pass
+    assert STAGE_SECONDS.count(stage="other_stage") == before + 1
+
+
+def test_server_timing():
+    header = server_timing([("haar", 0.002), ("resnet", 0.01), ("haar", 0.003)])
+    assert header == "haar;dur=5.00, resnet;dur=10.00"
@@ -0,0 +1,74 @@
+import pytest
+import cv2
+import numpy as np
+from datetime import date
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+from app.models import Base, Person
+from app.photo_store import PhotoStore, CachedStaticFiles, thumbnail_url, migrate_photos
+
+
+'''
+тесты на хранилище фото
+1. имя файла — хэш содержимого, одинаковые фото сохраняются один раз
+2. при сохранении создается уменьшенная копия
+3. фото по хэшу отдаются с долгим Cache-Control и ETag
+4. старые фото переносятся в хранилище
+'''
+
+@pytest.fixture
+def frame():
+    """Кадр 640x480 со случайным шумом"""
+    return np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+
+
+def test_save_frame_deduplicates(tmp_path, frame):
+    store = PhotoStore(str(tmp_path), thumb_size=64)
+    first = store.save_frame(frame)
+    second = store.save_frame(frame.copy())
+    other = store.save_frame(frame[::-1])
+
+    assert first.created and not second.created
+    assert first.photo_path == second.photo_path != other.photo_path
+    assert first.photo_path == f"/static/photo/{first.digest[:2]}/{first.digest}.jpg"
+    assert not list(tmp_path.rglob("*.tmp")), 'Остался временный файл'
+
+    thumb = cv2.imread(first.thumb_path)
+    assert thumb.shape == (48, 64, 3)
+    assert thumbnail_url(first.photo_path) == f"/static/thumbs/{first.digest[:2]}/{first.digest}.jpg"
+    assert thumbnail_url("/static/photo/Иван_Иванов_0.jpg") == "/static/photo/Иван_Иванов_0.jpg"
+
+
+def test_cache_headers(tmp_path, frame):
+    stored = PhotoStore(str(tmp_path)).save_frame(frame)
+    (tmp_path / "static" / "old.jpg").write_bytes(b"jpeg")
+    client = TestClient(Starlette(routes=[
+        Mount("/static", CachedStaticFiles(directory=str(tmp_path / "static")))
+    ]))
+
+    response = client.get(stored.photo_path)
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+    assert client.get(stored.photo_path, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(thumbnail_url(stored.photo_path)).status_code == 200
+    assert client.get("/static/old.jpg").headers["cache-control"] == "no-cache"
+
+
+def test_migrate_photos(tmp_path, frame):
+    (tmp_path / "static" / "photo").mkdir(parents=True)
+    cv2.imwrite(str(tmp_path / "static" / "photo" / "Иван_Иванов_0.jpg"), frame)
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    for i, photo_path in enumerate(["/static/photo/Иван_Иванов_0.jpg", "/static/photo/missing.jpg", None]):
+        db.add(Person(first_name="Иван", last_name="Иванович", middle_name="Иванов", birth_date=date(1990, 1, 1),
+                      phone_number=str(i), email=f"{i}@mail.ru", photo_path=photo_path))
+    db.commit()
+
+    assert migrate_photos(db, str(tmp_path)) == {"migrated": 1, "missing": 1}
+    person = db.query(Person).filter(Person.phone_number == "0").one()
+    assert thumbnail_url(person.photo_path) != person.photo_path
+    assert migrate_photos(db, str(tmp_path)) == {"migrated": 0, "missing": 1}
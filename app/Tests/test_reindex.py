@@ -0,0 +1,121 @@
+import numpy as np
+from datetime import date
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, Person
+from app.embedding_store import load_gallery, save_crops, count_embeddings
+from app.gallery_index import GalleryIndex
+from app.reindex import ReindexJob
+
+
+'''
+тесты на фоновый пересчет эмбеддингов
+1. обрабатываются только клиенты без вектора текущей модели, пачками с коммитом
+2. после падения повторный запуск продолжает с оставшихся клиентов
+3. в конце индекс галереи строится заново
+4. клиент с несколькими шаблонами после пересчета сохраняет все шаблоны
+5. запуск во время прохода добавляет еще один проход (новые клиенты не пропускаются)
+'''
+
+class FakeDetection:
+    crop = np.full((160, 160, 3), 100, dtype=np.uint8)
+
+    def __init__(self, seed):
+        self.embedding = np.random.default_rng(seed).normal(size=512).astype(np.float32)
+
+
+class FakeRecognizer:
+    """Лица нет на фото с именем noface.jpg; можно "упасть" после заданного количества фото"""
+    model_version = "test-model"
+
+    def __init__(self, fail_after=None):
+        self.gallery = GalleryIndex()
+        self.fail_after = fail_after
+        self.analyzed = 0
+
+    def analyze(self, images, use_batcher=True):
+        self.analyzed += len(images)
+        if self.fail_after is not None and self.analyzed > self.fail_after:
+            raise RuntimeError("сбой")
+        return [None if image.endswith("noface.jpg") else FakeDetection(i) for i, image in enumerate(images)]
+
+    def embed_crops(self, crops, use_batcher=True):
+        return [FakeDetection(i).embedding for i in range(len(crops))]
+
+
+def make_db(tmp_path, photos):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    photo_dir = tmp_path / "static" / "photo"
+    photo_dir.mkdir(parents=True)
+    db = session_factory()
+    for i, name in enumerate(photos):
+        if name != "missing.jpg":
+            (photo_dir / name).write_bytes(b"jpeg")
+        db.add(Person(first_name="Иван", last_name="Иванович", middle_name="Иванов",
+                      birth_date=date(1990, 1, 1), phone_number=str(i), email=f"{i}@mail.ru",
+                      payment_date=date(2025, 1, 1), payment_amount=1000, photo_path=f"/static/photo/{name}"))
+    db.commit()
+    db.close()
+    return session_factory
+
+
+def test_reindex(tmp_path):
+    session_factory = make_db(tmp_path, ["a.jpg", "b.jpg", "noface.jpg", "missing.jpg", "c.jpg"])
+    recognizer = FakeRecognizer()
+    job = ReindexJob(session_factory, recognizer, str(tmp_path), workers=0, chunk_size=2, batch_size=1)
+
+    progress = job.run()
+    assert progress["status"] == "done"
+    assert (progress["total"], progress["processed"], progress["embedded"]) == (5, 5, 3)
+    assert (progress["no_face"], progress["no_photo"]) == (1, 1)
+    assert len(recognizer.gallery) == 3, 'Индекс галереи не перестроен'
+
+    # Повторный запуск: посчитанные эмбеддинги не пересчитываются, кропы уже сохранены
+    progress = job.run()
+    assert (progress["total"], progress["embedded"]) == (2, 0)
+
+
+def test_resume_after_failure(tmp_path):
+    session_factory = make_db(tmp_path, ["a.jpg", "b.jpg", "c.jpg", "d.jpg"])
+    job = ReindexJob(session_factory, FakeRecognizer(fail_after=2), str(tmp_path), workers=0, chunk_size=2)
+    progress = job.run()
+    assert progress["status"] == "failed"
+    assert progress["embedded"] == 2, 'Первая пачка не закоммичена'
+
+    recognizer = FakeRecognizer()
+    job = ReindexJob(session_factory, recognizer, str(tmp_path), workers=0, chunk_size=2)
+    progress = job.run()
+    assert (progress["status"], progress["total"], progress["embedded"]) == ("done", 2, 2)
+    assert recognizer.analyzed == 2
+    assert len(load_gallery(session_factory(), "test-model")) == 4
+
+
+def test_reindex_keeps_templates(tmp_path):
+    session_factory = make_db(tmp_path, ["a.jpg", "b.jpg"])
+    save_crops(str(tmp_path), 1, [FakeDetection.crop] * 3)
+    recognizer = FakeRecognizer()
+    job = ReindexJob(session_factory, recognizer, str(tmp_path), workers=0)
+    progress = job.run()
+    assert (progress["status"], progress["embedded"]) == ("done", 2)
+    assert recognizer.analyzed == 1, 'Клиент с кропами детектировался заново'
+    assert count_embeddings(session_factory(), "test-model") == 4
+    assert len(recognizer.gallery) == 2
+
+
+def test_start_while_running_reruns(tmp_path):
+    session_factory = make_db(tmp_path, ["a.jpg"])
+    job = ReindexJob(session_factory, FakeRecognizer(), str(tmp_path), workers=0)
+    runs = []
+
+    def fake_run():
+        # Во время первого прохода задачу запускают еще раз (например, импорт клиентов)
+        runs.append(job.start() if not runs else None)
+        job.status = "done"
+
+    job.run = fake_run
+    assert job.start()
+    job._thread.join(5)
+    assert runs == [False, None], 'Запуск во время прохода не дал еще одного прохода'
+    assert job.status == "done"
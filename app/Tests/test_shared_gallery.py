@@ -0,0 +1,106 @@
+import multiprocessing
+import numpy as np
+import pytest
+from app.gallery_index import GalleryIndex, normalize
+from app.shared_gallery import SharedGalleryIndex
+
+
+'''
+тесты на общий индекс галереи в memory-mapped файлах
+1. поиск совпадает с индексом в памяти
+2. другой экземпляр (воркер) подключается к построенному индексу и видит добавленных клиентов;
+   замена вектора клиента не трогает файлы, которые отображены у читателей
+3. при заполнении файлы расширяются без потери строк
+4. шаблоны клиентов видны другому воркеру, замененные шаблоны в поиске не участвуют
+'''
+
+def make_vectors(n, seed=0):
+    return normalize(np.random.default_rng(seed).normal(size=(n, 512)))
+
+
+def test_same_results_as_memory_index(tmp_path):
+    vectors = make_vectors(300)
+    entries = [(i + 1, v) for i, v in enumerate(vectors)]
+    shared = SharedGalleryIndex(str(tmp_path), ann_threshold=10**9)
+    shared.build(entries)
+    memory = GalleryIndex(ann_threshold=10**9)
+    memory.build(entries)
+
+    for query in vectors[:5]:
+        assert [i for i, _ in shared.search(query, 5)] == [i for i, _ in memory.search(query, 5)]
+
+
+def test_worker_sees_new_clients(tmp_path):
+    vectors = make_vectors(20)
+    writer = SharedGalleryIndex(str(tmp_path))
+    writer.build([(i + 1, v) for i, v in enumerate(vectors[:10])])
+
+    reader = SharedGalleryIndex(str(tmp_path))
+    assert not reader.attach(9), 'Подключился к индексу с другим количеством строк'
+    assert reader.attach(10)
+    generation = reader.generation
+
+    writer.add(100, vectors[15])
+    assert reader.search(vectors[15], 1)[0][0] == 100, 'Новый клиент не виден другому воркеру'
+    assert reader.generation == generation + 1
+    assert len(reader) == 11
+
+    # Замена вектора существующего клиента идет в новые файлы
+    matrix = reader.matrix
+    before = np.array(matrix)
+    writer.add(100, vectors[16])
+    assert np.array_equal(matrix, before), 'Строка заменена в файлах, которые читает воркер'
+    assert reader.search(vectors[16], 1)[0][0] == 100
+    assert len(reader) == 11
+    assert len(list(tmp_path.glob("matrix.*"))) == 1, 'Старые файлы не удалены'
+
+
+def _add_in_process(directory, id_client, vector):
+    SharedGalleryIndex(directory).add(id_client, vector)
+
+
+def test_add_from_other_process(tmp_path):
+    vectors = make_vectors(3)
+    index = SharedGalleryIndex(str(tmp_path))
+    index.build([(1, vectors[0])])
+    process = multiprocessing.get_context("spawn").Process(target=_add_in_process,
+                                                           args=(str(tmp_path), 2, vectors[1]))
+    process.start()
+    process.join()
+    assert index.search(vectors[1], 1)[0][0] == 2
+
+
+def test_grow(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.shared_gallery.MIN_CAPACITY", 4)
+    vectors = make_vectors(10)
+    writer = SharedGalleryIndex(str(tmp_path))
+    writer.build([(1, vectors[0])])
+    reader = SharedGalleryIndex(str(tmp_path))
+    reader.attach(1)
+    for i in range(1, 10):
+        writer.add(i + 1, vectors[i])
+    assert len(reader) == 10
+    assert all(reader.search(v, 1)[0][0] == i + 1 for i, v in enumerate(vectors))
+    assert len(list(tmp_path.glob("matrix.*"))) == 1, 'Старые файлы не удалены'
+
+
+def test_templates_shared(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.shared_gallery.MIN_CAPACITY", 4)
+    vectors = make_vectors(20, seed=1)
+    writer = SharedGalleryIndex(str(tmp_path))
+    writer.build([(1, vectors[0]), (1, vectors[1]), (2, vectors[2])])
+    reader = SharedGalleryIndex(str(tmp_path))
+    assert reader.attach(2), 'В индексе должны считаться клиенты, а не эмбеддинги'
+    assert reader.search(vectors[1], 1)[0] == (1, pytest.approx(1.0, abs=1e-5))
+
+    # Новый клиент с тремя шаблонами: файлы шаблонов расширяются
+    writer.add(3, vectors[3:6])
+    assert len(reader) == 3
+    assert reader.search(vectors[5], 1)[0] == (3, pytest.approx(1.0, abs=1e-5))
+
+    # Замена шаблонов клиента 1: старые больше не находятся
+    writer.add(1, vectors[6:8])
+    assert len(reader) == 3
+    assert reader.search(vectors[0], 1)[0][1] < 0.5
+    assert reader.search(vectors[7], 1)[0] == (1, pytest.approx(1.0, abs=1e-5))
+    assert len(list(tmp_path.glob("templates.*"))) == 1, 'Старые файлы шаблонов не удалены'
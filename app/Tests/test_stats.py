@@ -0,0 +1,118 @@
+import pytest
+from datetime import date
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, Person
+from app import stats as stats_module
+from app.stats import query_dashboard_stats, query_monthly_breakdown, DashboardStatsCache, dashboard_stats
+
+
+'''
+тесты на статистику для дашборда
+1. итоги совпадают с подсчетом вручную
+2. кэш обновляется при добавлении клиента и сбрасывается при изменении
+   (в том числе если клиент добавлен, пока шел запрос итогов), итоги устаревают по TTL;
+   сброс после изменения происходит при коммите, откат изменения кэш не трогает
+3. разбивка по месяцам считается в SQL
+'''
+
+@pytest.fixture
+def db():
+    """Фикстура с базой SQLite в памяти и тремя клиентами"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    for i, (paid_on, amount) in enumerate([(date(2025, 1, 5), 0), (date(2025, 1, 20), 1500), (date(2025, 2, 1), 2500)]):
+        session.add(Person(first_name="Иван", last_name="Иванович", middle_name="Иванов",
+                           birth_date=date(1990, 1, 1), phone_number=str(i), email=f"{i}@mail.ru",
+                           payment_date=paid_on, payment_amount=amount))
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_dashboard_stats(db):
+    assert query_dashboard_stats(db) == {"total_clients": 3, "not_paid": 1, "total_paid": 4000.0}
+
+
+def test_empty_table():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    assert query_dashboard_stats(sessionmaker(bind=engine)()) == {"total_clients": 0, "not_paid": 0, "total_paid": 0.0}
+
+
+def test_cache_incremental_and_invalidate(db):
+    cache = DashboardStatsCache()
+    assert cache.get(db)["total_clients"] == 3
+    cache.on_person_added(0)
+    assert cache.get(db) == {"total_clients": 4, "not_paid": 2, "total_paid": 4000.0}
+    cache.invalidate()
+    assert cache.get(db)["total_clients"] == 3
+
+
+def test_person_added_during_query_not_lost(db, monkeypatch):
+    cache = DashboardStatsCache()
+
+    def query_then_enroll(session):
+        stats = query_dashboard_stats(session)
+        # Клиент добавлен и закоммичен после запроса, но до сохранения результата
+        session.add(Person(first_name="Петр", last_name="Петров", middle_name="Петрович",
+                           birth_date=date(1990, 1, 1), phone_number="9", email="9@mail.ru",
+                           payment_date=date(2025, 3, 1), payment_amount=0))
+        session.commit()
+        cache.on_person_added(0)
+        return stats
+
+    monkeypatch.setattr(stats_module, "query_dashboard_stats", query_then_enroll)
+    assert cache.get(db)["total_clients"] == 3
+    monkeypatch.setattr(stats_module, "query_dashboard_stats", query_dashboard_stats)
+    assert cache.get(db)["total_clients"] == 4, 'Устаревшие итоги попали в кэш'
+
+
+def test_cache_ttl(db, monkeypatch):
+    cache = DashboardStatsCache(ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr(stats_module.time, "monotonic", lambda: now[0])
+    assert cache.get(db)["total_clients"] == 3
+    # Клиент удален другим процессом — локальный кэш об этом не знает
+    db.execute(delete(Person.__table__).where(Person.phone_number == "0"))
+    db.commit()
+    assert cache.get(db)["total_clients"] == 3
+    now[0] += 11
+    assert cache.get(db)["total_clients"] == 2
+
+
+def test_update_invalidates_global_cache(db):
+    dashboard_stats.get(db)
+    db.query(Person).filter(Person.payment_amount == 0).update({"payment_amount": 100})
+    generation = dashboard_stats._generation
+    db.flush()
+    assert dashboard_stats._generation == generation, 'Кэш сброшен до коммита'
+    db.commit()
+    assert dashboard_stats._generation == generation + 1
+    assert dashboard_stats.get(db)["not_paid"] == 0, 'Кэш не сбросился после изменения'
+
+    person = db.query(Person).first()
+    person.payment_amount = 0
+    db.flush()
+    assert dashboard_stats._generation == generation + 1, 'Кэш сброшен до коммита'
+    db.commit()
+    assert dashboard_stats.get(db)["not_paid"] == 1, 'Кэш не сбросился после изменения клиента'
+
+
+def test_rollback_keeps_cache(db):
+    dashboard_stats.get(db)
+    db.query(Person).delete()
+    db.rollback()
+    generation = dashboard_stats._generation
+    db.query(Person).count()
+    db.commit()
+    assert dashboard_stats._generation == generation, 'Отмененное изменение сбросило кэш при следующем коммите'
+    assert dashboard_stats.get(db)["total_clients"] == 3
+
+
+def test_monthly_breakdown(db):
+    assert query_monthly_breakdown(db) == [
+        {"month": "2025-01", "clients": 2, "not_paid": 1, "paid_sum": 1500.0},
+        {"month": "2025-02", "clients": 1, "not_paid": 0, "paid_sum": 2500.0},
+    ]
@@ -0,0 +1,101 @@
+import asyncio
+import numpy as np
+from app.metrics import STREAM_DROPPED
+from app.stream import StreamSession, LatestFrame, iou
+
+
+'''
+тесты на потоковое распознавание
+1. необработанный кадр заменяется новым и считается отброшенным; кадр, пропущенный
+   из-за занятого пула инференса, тоже попадает в метрику отброшенных
+2. пока лицо на месте, эмбеддинг не пересчитывается
+3. при сдвиге лица, его пропаже и по счетчику кадров эмбеддинг считается заново
+'''
+
+class FakeDetector:
+    """Лицо в рамке, координаты которой записаны в первый пиксель кадра"""
+    def find_faces(self, image):
+        x = int(image[0, 0, 0])
+        return [(x, 10, 40, 40)] if x else []
+
+
+class FakeDetection:
+    embedding = np.ones(4)
+
+
+class FakeRecognizer:
+    def __init__(self):
+        self.analyzed = 0
+
+    def analyze(self, images, cache=True):
+        self.analyzed += len(images)
+        return [FakeDetection() for _ in images]
+
+    def search_gallery(self, embedding, k=5, rerank=None):
+        return [(7, 0.9)]
+
+    def rescore_gallery(self, embedding, candidates, top=None):
+        return candidates
+
+
+def frame(x):
+    image = np.zeros((100, 100, 3), dtype=np.uint8)
+    image[0, 0, 0] = x
+    return image
+
+
+def make_session(**kwargs):
+    described = []
+    session = StreamSession(FakeDetector(), FakeRecognizer(), threshold=0.5, prefilter_width=1000,
+                            describe=lambda id_client: described.append(id_client) or {"id_client": id_client},
+                            **kwargs)
+    return session, described
+
+
+def test_latest_frame_drops_stale():
+    before = STREAM_DROPPED.value()
+
+    async def run():
+        slot = LatestFrame(on_drop=STREAM_DROPPED.inc)
+        slot.put(b"1")
+        slot.put(b"2")
+        slot.put(b"3")
+        frame = await slot.get()
+        slot.drop()  # пул инференса занят — кадр тоже отброшен
+        return frame, slot.dropped, slot.received
+
+    assert asyncio.run(run()) == (b"3", 3, 3)
+    assert STREAM_DROPPED.value() - before == 3, 'Кадр, отброшенный из-за занятого пула, не попал в метрику'
+
+
+def test_tracking_skips_embedding():
+    session, described = make_session(reembed_every=100)
+    first = session.process(frame(20))
+    assert first["match"] == {"id_client": 7} and not first["tracked"]
+
+    second = session.process(frame(22))  # лицо почти не сдвинулось
+    assert second["tracked"] and second["match"] == {"id_client": 7}
+    assert session.recognizer.analyzed == 1
+    assert described == [7]
+
+    session.process(frame(80))  # рамка не пересекается с прежней: другое лицо
+    assert session.recognizer.analyzed == 2
+    assert described == [7], 'Тот же клиент запрошен из БД повторно'
+
+
+def test_reembed_after_face_lost_and_periodically():
+    session, _ = make_session(reembed_every=2)
+    session.process(frame(20))
+    assert session.process(frame(0))["boxes"] == []
+    session.process(frame(20))
+    assert session.recognizer.analyzed == 2, 'После пропажи лица эмбеддинг не пересчитан'
+
+    session.process(frame(20))
+    session.process(frame(20))
+    session.process(frame(20))
+    assert session.recognizer.analyzed == 3
+
+
+def test_iou():
+    assert iou((0, 0, 10, 10), (0, 0, 10, 10)) == 1
+    assert iou((0, 0, 10, 10), (20, 20, 10, 10)) == 0
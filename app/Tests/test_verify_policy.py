@@ -0,0 +1,66 @@
+import pytest
+from app.verify_policy import VerificationPolicy, decision_margin
+
+
+'''
+тесты на правила решения при верификации
+1. уверенное и однозначное совпадение принимается по первому проходу, без проверки шаблонов
+2. явное отсутствие совпадения тоже решается первым проходом
+3. пограничный случай проверяется по шаблонам, в решении есть отрыв от второго кандидата
+4. два похожих клиента (маленький отрыв) — совпадения нет
+'''
+
+class FakeRecognizer:
+    """Первый проход возвращает заданных кандидатов, второй — кандидатов после проверки шаблонов"""
+    def __init__(self, first, rescored=None):
+        self.first = first
+        self.rescored = rescored
+        self.rescore_calls = 0
+
+    def search_gallery(self, embedding, k=5, rerank=None):
+        assert rerank == 0, 'Первый проход должен идти только по центроидам'
+        return self.first[:k]
+
+    def rescore_gallery(self, embedding, candidates, top=None):
+        self.rescore_calls += 1
+        return self.rescored if self.rescored is not None else candidates
+
+
+@pytest.fixture
+def policy():
+    return VerificationPolicy(threshold=0.5, strong_threshold=0.8, reject_threshold=0.35, margin=0.05)
+
+
+def test_confident_match_single_pass(policy):
+    recognizer = FakeRecognizer([(7, 0.9), (3, 0.4)])
+    decision = policy.evaluate(recognizer, None, k=1)
+    assert (decision.id_client, decision.passes, decision.confident) == (7, 1, True)
+    assert decision.margin == pytest.approx(0.5)
+    assert decision.candidates == [(7, 0.9)]
+    assert recognizer.rescore_calls == 0
+
+
+def test_clear_reject_single_pass(policy):
+    recognizer = FakeRecognizer([(7, 0.2), (3, 0.1)])
+    decision = policy.evaluate(recognizer, None)
+    assert decision.id_client is None and decision.passes == 1
+    assert recognizer.rescore_calls == 0
+
+    empty = policy.evaluate(FakeRecognizer([]), None)
+    assert empty.id_client is None and empty.score is None and empty.margin is None
+
+
+def test_borderline_uses_templates(policy):
+    # По центроидам клиент 3 чуть выше, шаблон клиента 7 совпадает лучше
+    recognizer = FakeRecognizer([(3, 0.55), (7, 0.52), (9, 0.1)], rescored=[(7, 0.7), (3, 0.55), (9, 0.1)])
+    decision = policy.evaluate(recognizer, None)
+    assert recognizer.rescore_calls == 1
+    assert (decision.id_client, decision.passes, decision.confident) == (7, 2, False)
+    assert decision.margin == pytest.approx(0.15)
+
+
+def test_ambiguous_match_rejected(policy):
+    decision = policy.evaluate(FakeRecognizer([(3, 0.85), (7, 0.83)]), None)
+    assert decision.id_client is None, 'Совпадение с двумя похожими клиентами должно отклоняться'
+    assert decision.passes == 2
+    assert decision_margin([(3, 0.85)]) is None
@@ -0,0 +1,112 @@
+"""
+Динамическое микробатчирование для модели эмбеддингов.
+Кропы лиц от параллельных запросов собираются в один батч (до max_batch штук
+или до истечения max_wait_ms), модель вызывается один раз, и каждый
+вызывающий получает свой результат.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Максимальный размер батча
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 16))
+# Сколько миллисекунд ждать, пока наберется батч
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", 5))
+
+
+class EmbeddingBatcher:
+    """
+    Собирает элементы из разных потоков в батчи.
+
+    embed_fn: функция, которая принимает список элементов и возвращает список результатов той же длины
+    max_batch: максимальный размер батча
+    max_wait_ms: максимальное время ожидания набора батча
+    """
+
+    def __init__(self, embed_fn, max_batch=EMBED_BATCH_SIZE, max_wait_ms=EMBED_BATCH_WAIT_MS):
+        self.embed_fn = embed_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0  # сколько раз вызывалась модель
+        self.items = 0  # сколько элементов обработано
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, items):
+        """
+        Ставит элементы в очередь.
+
+        :return: список Future, по одному на элемент
+        """
+        self._ensure_started()
+        futures = []
+        for item in items:
+            future = Future()
+            self._queue.put((item, future))
+            futures.append(future)
+        return futures
+
+    def embed(self, items):
+        """Обрабатывает элементы (возможно, вместе с элементами других потоков) и ждет результат"""
+        return [future.result() for future in self.submit(items)]
+
+    def close(self):
+        """Останавливает фоновый поток после обработки уже поставленных элементов"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    def _collect(self):
+        """Ждет первый элемент и добирает батч до max_batch или до истечения max_wait"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is None:
+                # Сигнал остановки обработаем после текущего батча
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.embed_fn(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
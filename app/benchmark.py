@@ -0,0 +1,321 @@
+"""
+Набор бенчмарков: детекция Хааром, эмбеддинги FaceNet, верификация с поиском
+по галерее (1:N) и запросы к БД на больших таблицах SQLite.
+
+Работает без сети и без реальных фото: модели со случайными весами,
+изображения и галереи генерируются. Результаты пишутся в JSON, чтобы
+сравнивать коммиты между собой.
+
+Запуск:
+    python -m app.benchmark --output bench.json
+    python -m app.benchmark --quick --output new.json --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import date, timedelta
+
+import cv2
+import numpy as np
+
+from app.face_detector import FaceDetectorHaar
+from app.frame_pipeline import VerificationPipeline, PREFILTER_WIDTH
+from app.gallery_index import GalleryIndex, normalize
+
+RESOLUTIONS = {"480p": (640, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+
+
+def measure(fn, repeats=10, warmup=1):
+    """
+    Замеряет время вызова fn.
+
+    :return: словарь с p50/p95/mean в миллисекундах и количеством замеров
+    """
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(float(np.percentile(timings, 95)), 3),
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "n": repeats,
+    }
+
+
+def synthetic_frame(width, height, seed=0):
+    """Сгенерированный кадр: шум и светлый овал на месте лица"""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    center = (width // 2, height // 2)
+    cv2.ellipse(frame, center, (width // 8, height // 5), 0, 0, 360, (180, 190, 220), -1)
+    for dx in (-1, 1):
+        cv2.circle(frame, (center[0] + dx * width // 20, center[1] - height // 20), max(2, width // 80), (40, 40, 40), -1)
+    return frame
+
+
+class RandomEmbedder:
+    """
+    Эмбеддер со случайными весами.
+    Если установлен torch и facenet-pytorch — InceptionResnetV1 без предобученных весов,
+    иначе случайная проекция в NumPy (тогда замеры эмбеддингов не сопоставимы с реальной моделью).
+    """
+
+    def __init__(self, seed=0):
+        try:
+            import torch
+            from facenet_pytorch import InceptionResnetV1
+            torch.manual_seed(seed)
+            self.resnet = InceptionResnetV1(pretrained=None).eval()
+            self.backend = "torch"
+        except ImportError:
+            self.resnet = None
+            self.projection = np.random.default_rng(seed).normal(size=(3 * 32 * 32, 512)).astype(np.float32)
+            self.backend = "numpy"
+
+    def embed_crops(self, crops):
+        """Эмбеддинги для батча кропов 160x160 (RGB, uint8)"""
+        if self.resnet is not None:
+            import torch
+            batch = torch.from_numpy(np.stack(crops)).permute(0, 3, 1, 2).float().sub(127.5).div(128)
+            with torch.inference_mode():
+                return normalize(self.resnet(batch).numpy())
+        small = np.stack([cv2.resize(crop, (32, 32)) for crop in crops]).reshape(len(crops), -1)
+        # Нормировка пикселей как у ResNet: без нее все векторы почти совпадают по направлению
+        return normalize((small.astype(np.float32) - 127.5) / 128 @ self.projection)
+
+    def embed_batch(self, images):
+        """Интерфейс как у FaceNetVerify: кадр -> центральный кроп -> эмбеддинг"""
+        crops = []
+        for frame in images:
+            h, w = frame.shape[:2]
+            side = min(h, w) // 2
+            crop = frame[h // 2 - side // 2:h // 2 + side // 2, w // 2 - side // 2:w // 2 + side // 2]
+            crops.append(cv2.resize(crop, (160, 160)))
+        return list(self.embed_crops(crops))
+
+
+class GalleryRecognizer:
+    """Связка эмбеддера и индекса галереи для конвейера верификации"""
+
+    def __init__(self, embedder, gallery):
+        self.embedder = embedder
+        self.gallery = gallery
+
+    def embed_batch(self, images, cache=True):
+        return self.embedder.embed_batch(images)
+
+    def search_gallery(self, embedding, k=5, rerank=None):
+        return self.gallery.search(embedding, k, rerank)
+
+    def rescore_gallery(self, embedding, candidates, top=None):
+        return self.gallery.rescore(embedding, candidates, top)
+
+
+class AlwaysFaceDetector:
+    """Запускает настоящий Хаар (его время входит в замер), но всегда сообщает о лице"""
+
+    def __init__(self, detector):
+        self.detector = detector
+
+    def find_faces(self, image):
+        self.detector.find_faces(image)
+        return [(0, 0, 1, 1)]
+
+
+def bench_haar(repeats):
+    detector = FaceDetectorHaar()
+    results = []
+    for name, (width, height) in RESOLUTIONS.items():
+        frame = synthetic_frame(width, height)
+        stats = measure(lambda: detector.find_faces(frame), repeats)
+        results.append({"name": "haar.detect_faces", "params": {"resolution": name}, **stats})
+        # Быстрый режим: поиск на копии шириной PREFILTER_WIDTH и в области вокруг лица с прошлого кадра
+        stats = measure(lambda: detector.find_faces(frame, detect_width=PREFILTER_WIDTH), repeats)
+        results.append({"name": "haar.detect_faces", "params": {"resolution": name, "mode": "fast"}, **stats})
+        roi = (width // 3, height // 4, width // 4, height // 2)
+        stats = measure(lambda: detector.find_faces(frame, detect_width=PREFILTER_WIDTH, roi=roi), repeats)
+        results.append({"name": "haar.detect_faces", "params": {"resolution": name, "mode": "fast-roi"}, **stats})
+    frames = [synthetic_frame(1920, 1080, seed=i) for i in range(8)]
+    for mode, run in (("sequential", lambda: [detector.find_faces(f) for f in frames]),
+                      ("batch", lambda: detector.detect_batch(frames))):
+        stats = measure(run, repeats)
+        results.append({"name": "haar.detect_batch", "params": {"frames": len(frames), "mode": mode}, **stats})
+    return results
+
+
+def bench_embedding(embedder, batch_sizes, repeats):
+    rng = np.random.default_rng(1)
+    results = []
+    for batch_size in batch_sizes:
+        crops = list(rng.integers(0, 255, (batch_size, 160, 160, 3), dtype=np.uint8))
+        stats = measure(lambda: embedder.embed_crops(crops), repeats)
+        stats["per_face_ms"] = round(stats["p50_ms"] / batch_size, 3)
+        results.append({"name": "facenet.embed", "params": {"batch_size": batch_size, "backend": embedder.backend},
+                        **stats})
+    return results
+
+
+def bench_verification(embedder, gallery_sizes, repeats, frames_per_request=8):
+    rng = np.random.default_rng(2)
+    detector = AlwaysFaceDetector(FaceDetectorHaar())
+    frames = [synthetic_frame(1280, 720, seed=i) for i in range(frames_per_request)]
+    results = []
+    for size in gallery_sizes:
+        entries = list(enumerate(normalize(rng.normal(size=(size, 512))), 1))
+        gallery = GalleryIndex()
+        build = measure(lambda: gallery.build(entries), repeats=1, warmup=0)
+        results.append({"name": "gallery.build", "params": {"gallery_size": size, "ann": gallery.ivf is not None},
+                        **build})
+
+        query = normalize(rng.normal(size=512))
+        search = measure(lambda: gallery.search(query, 5), repeats * 10)
+        results.append({"name": "gallery.search", "params": {"gallery_size": size, "ann": gallery.ivf is not None},
+                        **search})
+
+        # Запрос как в /persons/verify_faces/: все кадры, без раннего выхода
+        pipeline = VerificationPipeline(detector, GalleryRecognizer(embedder, gallery), threshold=2.0,
+                                        batch_size=4, time_budget=3600)
+        stats = measure(lambda: pipeline.run(frames), repeats)
+        results.append({"name": "verify.request",
+                        "params": {"gallery_size": size, "frames": frames_per_request, "backend": embedder.backend},
+                        **stats})
+    return results
+
+
+def seed_database(path, rows):
+    """Создает SQLite-базу с rows клиентами"""
+    from sqlalchemy import create_engine, insert
+    from sqlalchemy.orm import sessionmaker
+    from app.models import Base, Person
+
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    rng = np.random.default_rng(3)
+    start_date = date(2024, 1, 1)
+    for offset in range(0, rows, 10000):
+        count = min(10000, rows - offset)
+        amounts = rng.choice([0, 1500, 2500, 3000], size=count)
+        days = rng.integers(0, 365, size=count)
+        session.execute(insert(Person), [
+            {
+                "first_name": f"Имя{i % 500}", "last_name": "Отчество", "middle_name": f"Фамилия{i % 2000}",
+                "birth_date": date(1990, 1, 1), "phone_number": f"+7{i:010d}", "email": f"client{i}@mail.ru",
+                "payment_date": start_date + timedelta(days=int(days[j])), "payment_amount": float(amounts[j]),
+                "photo_path": None,
+            }
+            for j, i in enumerate(range(offset, offset + count))
+        ])
+        session.commit()
+    return session
+
+
+def bench_database(table_sizes, repeats):
+    from app.listing import page_persons, export_rows
+    from app.stats import query_dashboard_stats, query_monthly_breakdown
+
+    results = []
+    for rows in table_sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db = seed_database(os.path.join(tmp_dir, "bench.db"), rows)
+
+            def deep_page():
+                cursor = None
+                for _ in range(20):
+                    _, cursor = page_persons(db, sort="name", after=cursor, limit=50)
+
+            cases = {
+                "db.dashboard_stats": lambda: query_dashboard_stats(db),
+                "db.monthly_breakdown": lambda: query_monthly_breakdown(db),
+                "db.page_first": lambda: page_persons(db, sort="name", limit=50),
+                "db.page_20_deep": deep_page,
+                "db.not_paid_page": lambda: page_persons(db, not_paid=True, limit=1000),
+                "db.export_full_scan": lambda: sum(1 for _ in export_rows(db)),
+            }
+            for name, fn in cases.items():
+                results.append({"name": name, "params": {"rows": rows}, **measure(fn, repeats)})
+            db.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    """Печатает отношение p50 текущего запуска к сохраненному"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    key = lambda result: (result["name"], json.dumps(result["params"], sort_keys=True))
+    old = {key(result): result for result in baseline["results"]}
+    print(f"{'бенчмарк':<28} {'параметры':<50} {'было, мс':>10} {'стало, мс':>10} {'x':>6}")
+    for result in current["results"]:
+        previous = old.get(key(result))
+        if previous is None:
+            continue
+        ratio = result["p50_ms"] / previous["p50_ms"] if previous["p50_ms"] else float("nan")
+        print(f"{result['name']:<28} {json.dumps(result['params'], ensure_ascii=False):<50} "
+              f"{previous['p50_ms']:>10.3f} {result['p50_ms']:>10.3f} {ratio:>6.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки распознавания и БД")
+    parser.add_argument("--only", nargs="+", choices=["haar", "embedding", "verification", "database"],
+                        help="запустить только указанные группы")
+    parser.add_argument("--quick", action="store_true", help="маленькие галереи и таблицы для быстрой проверки")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--output", help="файл для результатов в JSON")
+    parser.add_argument("--compare", help="JSON предыдущего запуска для сравнения")
+    args = parser.parse_args()
+
+    groups = set(args.only or ["haar", "embedding", "verification", "database"])
+    gallery_sizes = [100, 1000] if args.quick else [100, 10000, 100000]
+    table_sizes = [1000] if args.quick else [10000, 100000]
+    batch_sizes = [1, 8] if args.quick else [1, 4, 8, 16, 32]
+    repeats = 3 if args.quick else args.repeats
+
+    embedder = RandomEmbedder() if groups & {"embedding", "verification"} else None
+    results = []
+    if "haar" in groups:
+        results += bench_haar(repeats)
+    if "embedding" in groups:
+        results += bench_embedding(embedder, batch_sizes, repeats)
+    if "verification" in groups:
+        results += bench_verification(embedder, gallery_sizes, repeats)
+    if "database" in groups:
+        results += bench_database(table_sizes, repeats)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    for result in results:
+        print(f"{result['name']:<28} {json.dumps(result['params'], ensure_ascii=False):<50} p50={result['p50_ms']:.3f} мс")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
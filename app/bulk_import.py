@@ -0,0 +1,290 @@
+"""
+Массовый импорт клиентов из CSV или JSONL с фото из папки или zip-архива.
+
+Строки проверяются моделью PersonCreate и вставляются большими пачками
+(одна транзакция на пачку). Ошибки по строкам (неверные данные, повтор
+телефона или email) попадают в отчет и не прерывают импорт: такие строки
+не вставляются. Клиент, фото которого не найдено, вставляется без фото,
+а строка попадает в предупреждения (warnings).
+Эмбеддинги для фото считаются в пуле процессов (из командной строки); эндпоинт
+импорта вместо этого запускает фоновый пересчет эмбеддингов (app.reindex).
+
+Запуск из командной строки:
+    python -m app.bulk_import clients.csv --photos photos.zip --workers 4
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.camera import IMAGE_EXTENSIONS
+from app.models import Person, PersonCreate
+from app.embedding_store import save_embedding, save_crop
+from app.photo_store import PhotoStore
+from app.stats import dashboard_stats
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Сколько строк вставлять одной транзакцией
+IMPORT_BATCH_SIZE = 1000
+# Сколько фото отдавать одному процессу за раз
+EMBED_CHUNK_SIZE = 16
+
+
+def read_records(data, filename):
+    """
+    Читает строки из CSV или JSONL.
+
+    :param data: содержимое файла (bytes или str)
+    :param filename: имя файла, по расширению определяется формат
+    :return: генератор словарей
+    """
+    if isinstance(data, bytes):
+        data = data.decode("utf-8-sig")
+    if filename.lower().endswith((".jsonl", ".ndjson")):
+        for line in io.StringIO(data):
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(io.StringIO(data))
+
+
+class PhotoSource:
+    """Фото для импорта из папки или zip-архива (по имени файла из колонки photo)"""
+
+    def __init__(self, path=None):
+        self.directory = None
+        self.archive = None
+        if path is None:
+            return
+        if zipfile.is_zipfile(path):
+            self.archive = zipfile.ZipFile(path)
+            self.names = {os.path.basename(name): name for name in self.archive.namelist()}
+        else:
+            self.directory = path
+
+    def read(self, name):
+        """Байты фото или None, если фото нет"""
+        if self.archive is not None:
+            if name not in self.names:
+                return None
+            return self.archive.read(self.names[name])
+        if self.directory is not None:
+            source = os.path.join(self.directory, name)
+            if not os.path.isfile(source):
+                return None
+            with open(source, "rb") as f:
+                return f.read()
+        return None
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+
+
+def decode_photo(data, name):
+    """
+    Проверяет, что файл фото — изображение: расширение из IMAGE_EXTENSIONS и содержимое декодируется.
+    Иначе файл (например, .html или .svg) отдавался бы из /static/photo со своим типом содержимого.
+
+    :return: (расширение, кадр BGR) или None, если это не изображение
+    """
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in IMAGE_EXTENSIONS:
+        return None
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return None
+    return extension, frame
+
+
+def _init_embed_worker():
+    """Модель загружается один раз на процесс"""
+    global _worker_recognizer
+    from app.faceNet_try import FaceNetVerify
+    _worker_recognizer = FaceNetVerify()
+
+
+def _embed_chunk(chunk):
+    """
+    Считает эмбеддинги для пачки фото в процессе пула.
+
+    :param chunk: список пар (id_client, путь к фото)
+    :return: список (id_client, вектор или None, кроп лица или None, версия модели)
+    """
+    paths = [path for _, path in chunk]
+    detections = _worker_recognizer.analyze(paths, use_batcher=False)
+    return [
+        (id_client, detection.embedding, detection.crop, _worker_recognizer.model_version) if detection is not None
+        else (id_client, None, None, _worker_recognizer.model_version)
+        for (id_client, _), detection in zip(chunk, detections)
+    ]
+
+
+def embed_photos(db: Session, photos, workers=None):
+    """
+    Считает и сохраняет эмбеддинги и кропы лиц в пуле процессов.
+
+    :param photos: список пар (id_client, путь к фото)
+    :return: (количество сохраненных эмбеддингов, список id клиентов, у которых лицо не найдено)
+    """
+    chunks = [photos[i:i + EMBED_CHUNK_SIZE] for i in range(0, len(photos), EMBED_CHUNK_SIZE)]
+    saved, no_face = 0, []
+    # spawn: импорт идет и из эндпоинта, где уже работают потоки приложения, fork с ними небезопасен
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_embed_worker,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        for results in pool.map(_embed_chunk, chunks):
+            for id_client, vector, crop, model_version in results:
+                if vector is None:
+                    no_face.append(id_client)
+                    continue
+                save_crop(BASE_DIR, id_client, crop)
+                save_embedding(db, id_client, vector, model_version)
+                saved += 1
+            db.commit()
+    return saved, no_face
+
+
+def _insert_batch(db: Session, batch, report):
+    """
+    Вставляет пачку строк одной транзакцией.
+    Если пачка не прошла (например, повтор из параллельной записи), строки вставляются по одной.
+
+    :param batch: список пар (номер строки, словарь значений)
+    :return: список пар (id_client, словарь значений) для вставленных строк
+    """
+    statement = insert(Person).returning(Person.id_client, Person.phone_number)
+    try:
+        returned = db.execute(statement, [values for _, values in batch]).all()
+        db.commit()
+        by_phone = {phone: id_client for id_client, phone in returned}
+        return [(by_phone[values["phone_number"]], values) for _, values in batch]
+    except IntegrityError:
+        db.rollback()
+
+    inserted = []
+    for line, values in batch:
+        try:
+            id_client = db.execute(insert(Person).returning(Person.id_client), values).scalar_one()
+            db.commit()
+            inserted.append((id_client, values))
+        except IntegrityError:
+            db.rollback()
+            report["errors"].append({"row": line, "error": "Телефон или email уже есть в базе"})
+    return inserted
+
+
+def import_persons(db: Session, records, photo_source=None, embed=True, workers=None,
+                   batch_size=IMPORT_BATCH_SIZE):
+    """
+    Импортирует клиентов.
+
+    :param records: итерируемый объект со словарями (поля PersonCreate и необязательное поле photo)
+    :param photo_source: PhotoSource с фото клиентов
+    :param embed: считать ли эмбеддинги для фото
+    :param workers: количество процессов для эмбеддингов
+    :return: отчет: сколько строк обработано и вставлено, ошибки по невставленным строкам,
+             предупреждения по вставленным (фото не найдено), сколько эмбеддингов посчитано
+    """
+    report = {"rows": 0, "inserted": 0, "errors": [], "warnings": [], "photos": 0, "embedded": 0, "no_face": []}
+
+    # Уникальные поля проверяются заранее, чтобы повтор не отменял всю пачку
+    existing_phones = {phone for phone, in db.query(Person.phone_number)}
+    existing_emails = {email for email, in db.query(Person.email)}
+
+    photos = []
+    batch = []
+
+    def flush():
+        for id_client, values in _insert_batch(db, batch, report):
+            report["inserted"] += 1
+            if values["photo_path"]:
+                photos.append((id_client, os.path.join(BASE_DIR, values["photo_path"].lstrip("/"))))
+        batch.clear()
+
+    photo_store = PhotoStore(BASE_DIR)
+    for line, record in enumerate(records, 1):
+        report["rows"] += 1
+        try:
+            person = PersonCreate(**{key: value for key, value in record.items() if key != "photo"})
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            report["errors"].append({"row": line, "error": errors})
+            continue
+
+        if person.phone_number in existing_phones or person.email in existing_emails:
+            report["errors"].append({"row": line, "error": "Телефон или email уже есть в базе"})
+            continue
+
+        photo_path = None
+        photo_name = record.get("photo")
+        if photo_name and photo_source is not None:
+            data = photo_source.read(photo_name)
+            if data is not None:
+                decoded = decode_photo(data, photo_name)
+                if decoded is None:
+                    report["errors"].append({"row": line, "error": f"Фото {photo_name} не является изображением"})
+                    continue
+                extension, frame = decoded
+                # Имя файла по хэшу: одинаковые фото хранятся один раз, разные не перезаписывают друг друга
+                photo_path = photo_store.save_bytes(data, extension, frame).photo_path
+                report["photos"] += 1
+            else:
+                # Клиент вставляется без фото: это предупреждение, а не ошибка строки
+                report["warnings"].append({"row": line, "warning": f"Фото {photo_name} не найдено"})
+        existing_phones.add(person.phone_number)
+        existing_emails.add(person.email)
+
+        values = person.model_dump()
+        values["photo_path"] = photo_path
+        batch.append((line, values))
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    dashboard_stats.invalidate()
+
+    if embed and photos:
+        report["embedded"], report["no_face"] = embed_photos(db, photos, workers)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт клиентов из CSV или JSONL")
+    parser.add_argument("records", help="файл CSV или JSONL с клиентами")
+    parser.add_argument("--photos", help="папка или zip-архив с фото (имя файла в колонке photo)")
+    parser.add_argument("--workers", type=int, default=None, help="количество процессов для эмбеддингов")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="строк в одной транзакции")
+    parser.add_argument("--no-embed", action="store_true", help="не считать эмбеддинги")
+    args = parser.parse_args()
+
+    from app.database import SessionLocal, init_db
+    init_db()
+    db = SessionLocal()
+    photo_source = PhotoSource(args.photos)
+    try:
+        with open(args.records, "rb") as f:
+            records = read_records(f.read(), args.records)
+            report = import_persons(db, records, photo_source, embed=not args.no_embed,
+                                    workers=args.workers, batch_size=args.batch_size)
+    finally:
+        photo_source.close()
+        db.close()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Долгоживущий сервис захвата кадров с камеры.
+Камера открывается один раз при старте приложения, фоновый поток читает кадры
+в небольшой кольцевой буфер, а эндпоинты берут из него последние кадры,
+не открывая устройство заново. Вместо камеры можно указать видеофайл
+или папку с изображениями (удобно для тестов без оборудования).
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+
+# Источник кадров: индекс камеры, путь к видеофайлу или папке с изображениями ("" — не запускать)
+CAMERA_SOURCE = os.getenv("CAMERA_SOURCE", "0")
+# Сколько последних кадров хранить в буфере
+CAMERA_BUFFER_SIZE = int(os.getenv("CAMERA_BUFFER_SIZE", 30))
+# Частота кадров при чтении из файла или папки (камера задает частоту сама)
+CAMERA_FPS = float(os.getenv("CAMERA_FPS", 30))
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tiff"}
+
+
+class CameraError(Exception):
+    """Камера недоступна или не отдает кадры"""
+
+
+class ImageDirectorySource:
+    """Источник кадров из папки с изображениями (по кругу), интерфейс как у cv2.VideoCapture"""
+
+    def __init__(self, directory):
+        self.paths = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+        )
+        self.position = 0
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def read(self):
+        if not self.paths:
+            return False, None
+        frame = cv2.imread(self.paths[self.position % len(self.paths)])
+        self.position += 1
+        return frame is not None, frame
+
+    def release(self):
+        pass
+
+
+def open_source(source):
+    """
+    Открывает источник кадров.
+
+    :param source: индекс камеры (int или строка из цифр), путь к видеофайлу или папке с изображениями
+    :return: (объект с методами read/isOpened/release, нужно ли ограничивать частоту кадров)
+    """
+    if isinstance(source, int) or str(source).isdigit():
+        return cv2.VideoCapture(int(source)), False
+    if os.path.isdir(source):
+        return ImageDirectorySource(source), True
+    return cv2.VideoCapture(source), True
+
+
+class CaptureService:
+    """
+    Фоновый захват кадров в кольцевой буфер.
+
+    source: индекс камеры, путь к видеофайлу или папке с изображениями
+    buffer_size: размер кольцевого буфера
+    fps: частота чтения для файлов и папок
+    """
+
+    def __init__(self, source=CAMERA_SOURCE, buffer_size=CAMERA_BUFFER_SIZE, fps=CAMERA_FPS):
+        self.source = source
+        self.fps = fps
+        self.buffer = deque(maxlen=buffer_size)  # пары (номер кадра, кадр)
+        self.sequence = 0  # номер последнего прочитанного кадра
+        self.error = None
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Запускает фоновый поток чтения кадров"""
+        if self.running or self.source in (None, ""):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._reader, name="camera-capture", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _reader(self):
+        capture, throttle = open_source(self.source)
+        try:
+            if not capture.isOpened():
+                self.error = "Не удалось открыть камеру"
+                return
+
+            interval = 1 / self.fps if throttle and self.fps else 0
+            while not self._stop.is_set():
+                ret, frame = capture.read()
+                if not ret:
+                    if throttle:
+                        # Видеофайл закончился — начинаем сначала
+                        capture.release()
+                        capture, _ = open_source(self.source)
+                        if capture.isOpened():
+                            continue
+                    self.error = "Не удалось захватить изображение с камеры"
+                    return
+
+                with self._condition:
+                    self.sequence += 1
+                    self.buffer.append((self.sequence, frame))
+                    self.error = None
+                    self._condition.notify_all()
+
+                if interval:
+                    time.sleep(interval)
+        finally:
+            capture.release()
+            with self._condition:
+                self._condition.notify_all()
+
+    def latest(self, n=1):
+        """
+        Последние n кадров из буфера (от старых к новым), без ожидания.
+        """
+        with self._condition:
+            return [frame.copy() for _, frame in list(self.buffer)[-n:]]
+
+    def frames(self, max_frames=100, timeout=2.0):
+        """
+        Генератор новых кадров по мере их появления (начиная с последнего кадра в буфере).
+        Если потребитель не успевает, устаревшие кадры пропускаются.
+
+        :param max_frames: сколько кадров выдать
+        :param timeout: сколько секунд ждать очередной кадр
+        """
+        if not self.running and not self.buffer:
+            raise CameraError(self.error or "Камера не запущена")
+
+        with self._condition:
+            next_sequence = self.buffer[-1][0] if self.buffer else self.sequence + 1
+
+        for _ in range(max_frames):
+            with self._condition:
+                if not self._condition.wait_for(
+                        lambda: self.sequence >= next_sequence or not self.running, timeout):
+                    raise CameraError("Не удалось захватить изображение с камеры")
+                if self.sequence < next_sequence:
+                    raise CameraError(self.error or "Камера остановлена")
+                # Берем самый старый кадр, который еще не выдавали и который остался в буфере
+                sequence, frame = next(
+                    (item for item in self.buffer if item[0] >= next_sequence), self.buffer[-1]
+                )
+            next_sequence = sequence + 1
+            # Отдаем копию, чтобы потребитель не испортил кадр в общем буфере
+            yield frame.copy()
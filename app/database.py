@@ -1,16 +1,122 @@
 """
 Обеспечиваем соединение с базой данных
+
+По умолчанию используется SQLite-файл database.db; другую БД (например, PostgreSQL)
+можно задать переменной DATABASE_URL. Для SQLite включается WAL и настройки
+соединения (PRAGMA), чтобы чтение (дашборд, списки) не блокировало запись и
+параллельные записи ждали друг друга, а не падали с "database is locked".
+Для async-эндпоинтов есть асинхронные сессии (aiosqlite / asyncpg).
 """
+import logging
+import os
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from app.models import Base
 
-DATABASE_URL = "sqlite:///./database.db"  # Подключение к SQLite
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")  # Подключение к SQLite
+# URL для асинхронных сессий; если не задан, выводится из DATABASE_URL
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+# Режим журнала WAL для SQLite: читатели не блокируют писателя
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+# Сколько миллисекунд ждать освобождения БД другим писателем
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+# Кэш страниц на соединение и размер отображения файла БД в память, МБ
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", 64))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", 256))
+# Пул соединений
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+
+# Асинхронные драйверы для синхронных URL
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def is_sqlite(url):
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Настройки каждого нового соединения SQLite"""
+    cursor = dbapi_connection.cursor()
+    if SQLITE_WAL:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL NORMAL не теряет целостность, а fsync делается только на контрольных точках
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")  # отрицательное значение — в КБ
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    # Без этого SQLite не выполняет ondelete="CASCADE" у эмбеддингов
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def engine_options(url):
+    """Параметры create_engine / create_async_engine для БД"""
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite":
+        return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_pre_ping": True}
+    if url.database in (None, "", ":memory:"):
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        # Соединение используется из потоков пула инференса, а не только из потока, где создано
+        "connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+    }
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+def create_db_engine(url=DATABASE_URL):
+    """Движок SQLAlchemy с пулом соединений (и PRAGMA для SQLite)"""
+    db_engine = create_engine(url, **engine_options(url))
+    if is_sqlite(url):
+        event.listen(db_engine, "connect", set_sqlite_pragmas)
+    return db_engine
+
+
+def async_database_url(url=DATABASE_URL):
+    """URL с асинхронным драйвером: sqlite -> sqlite+aiosqlite, postgresql -> postgresql+asyncpg"""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    return url.set(drivername=driver) if driver else url
+
+
+def create_async_db_engine(url=None):
+    """
+    Асинхронный движок или None, если асинхронный драйвер не установлен
+    (тогда async-эндпоинты работают через синхронные сессии в пуле потоков).
+    """
+    url = url or ASYNC_DATABASE_URL or async_database_url()
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        db_engine = create_async_engine(url, **engine_options(url))
+    except ImportError:
+        logger.warning("Асинхронный драйвер для %s не установлен", make_url(url).drivername)
+        return None
+    if is_sqlite(url):
+        event.listen(db_engine.sync_engine, "connect", set_sqlite_pragmas)
+    return db_engine
+
+
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_db_engine()
+AsyncSessionLocal = None
+if async_engine is not None:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
 def init_db():
     """Создаем таблицы в базе данных"""
     Base.metadata.create_all(bind=engine)
+    # create_all не добавляет новые индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
@@ -0,0 +1,168 @@
+"""
+Поиск дубликатов клиентов по лицу.
+
+1. При сохранении клиента с фото его эмбеддинг ищется в индексе галереи: если
+   лицо уже есть у другого клиента (другой телефон/email), сохранение
+   отклоняется или клиент помечается как возможный дубликат.
+2. Отчет по всей таблице: попарное сходство всех эмбеддингов считается блоками
+   (умножение блока матрицы на остаток матрицы), пары выше порога объединяются в группы.
+
+Запуск отчета из командной строки:
+    python -m app.duplicates --threshold 0.8
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from app.gallery_index import normalize, client_entries
+
+# Сходство, начиная с которого лицо считается уже зарегистрированным
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", 0.8))
+# Что делать с дубликатом при сохранении: reject — отклонить (409), flag — сохранить и вернуть совпадение
+DUPLICATE_ACTION = os.getenv("DUPLICATE_ACTION", "reject")
+# Сколько строк матрицы сравнивать за один шаг в отчете (память — block_size * N чисел float32)
+DUPLICATE_BLOCK_SIZE = int(os.getenv("DUPLICATE_BLOCK_SIZE", 256))
+
+
+def find_duplicate(gallery, embedding, threshold=DUPLICATE_THRESHOLD):
+    """
+    Ближайший клиент в индексе галереи, если сходство не меньше порога.
+
+    :return: (id_client, сходство) или None
+    """
+    candidates = gallery.search(embedding, 1)
+    if candidates and candidates[0][1] >= threshold:
+        id_client, score = candidates[0]
+        return int(id_client), float(score)
+    return None
+
+
+def similar_pairs(matrix, threshold=DUPLICATE_THRESHOLD, block_size=DUPLICATE_BLOCK_SIZE):
+    """
+    Все пары строк с косинусным сходством не меньше порога.
+
+    :param matrix: эмбеддинги (N x D)
+    :return: массивы (i, j, сходство), i < j
+    """
+    matrix = normalize(matrix)
+    rows, cols, scores = [], [], []
+    for start in range(0, len(matrix), block_size):
+        block = matrix[start:start + block_size]
+        # Только правее диагонали: каждая пара считается один раз
+        sims = block @ matrix[start:].T
+        i, j = np.nonzero(sims >= threshold)
+        keep = j > i
+        i, j = i[keep], j[keep]
+        rows.append(i + start)
+        cols.append(j + start)
+        scores.append(sims[i, j])
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(scores)
+
+
+def group_pairs(n, rows, cols):
+    """
+    Объединяет связанные пары в группы (система непересекающихся множеств).
+
+    :return: список групп (индексы строк), только группы из двух и более строк
+    """
+    parent = np.arange(n)
+
+    def root(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for i, j in zip(rows, cols):
+        a, b = root(i), root(j)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+
+    groups = {}
+    for index in np.unique(np.concatenate([rows, cols])):
+        groups.setdefault(int(root(index)), []).append(int(index))
+    return list(groups.values())
+
+
+def duplicate_clusters(entries, threshold=DUPLICATE_THRESHOLD, block_size=DUPLICATE_BLOCK_SIZE):
+    """
+    Группы клиентов с похожими лицами.
+
+    :param entries: список пар (id_client, вектор)
+    :return: список групп: id клиентов и пары со сходством, от больших групп к меньшим
+    """
+    if not entries:
+        return []
+    ids = np.array([id_client for id_client, _ in entries], dtype=np.int64)
+    rows, cols, scores = similar_pairs([vector for _, vector in entries], threshold, block_size)
+    pair_group = {}
+    groups = group_pairs(len(ids), rows, cols)
+    for number, group in enumerate(groups):
+        for index in group:
+            pair_group[index] = number
+
+    clusters = [{"ids": sorted(int(ids[index]) for index in group), "pairs": []} for group in groups]
+    for i, j, score in zip(rows, cols, scores):
+        clusters[pair_group[int(i)]]["pairs"].append(
+            {"a": int(ids[i]), "b": int(ids[j]), "score": round(float(score), 4)}
+        )
+    for cluster in clusters:
+        cluster["pairs"].sort(key=lambda pair: -pair["score"])
+    return sorted(clusters, key=lambda cluster: (-len(cluster["ids"]), cluster["ids"][0]))
+
+
+def duplicate_report(db, model_version, threshold=DUPLICATE_THRESHOLD, block_size=DUPLICATE_BLOCK_SIZE):
+    """Отчет о группах дубликатов с данными клиентов"""
+    from app.embedding_store import load_gallery
+    from app.models import Person
+
+    # Шаблоны одного клиента похожи друг на друга: сравниваются центроиды клиентов
+    entries = client_entries(load_gallery(db, model_version))
+    clusters = duplicate_clusters(entries, threshold, block_size)
+    ids = {id_client for cluster in clusters for id_client in cluster["ids"]}
+    persons = {person.id_client: person for person in db.query(Person).filter(Person.id_client.in_(ids))} if ids else {}
+    for cluster in clusters:
+        cluster["persons"] = [
+            {
+                "id_client": id_client,
+                "name": f"{persons[id_client].last_name} {persons[id_client].first_name}",
+                "phone_number": persons[id_client].phone_number,
+                "email": persons[id_client].email,
+            }
+            for id_client in cluster["ids"] if id_client in persons
+        ]
+    return {
+        "model_version": model_version,
+        "threshold": threshold,
+        "clients": len(entries),
+        "clusters": clusters,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчет о клиентах с похожими лицами (возможных дубликатах)")
+    parser.add_argument("--threshold", type=float, default=DUPLICATE_THRESHOLD, help="минимальное сходство")
+    parser.add_argument("--block-size", type=int, default=DUPLICATE_BLOCK_SIZE, help="строк матрицы за один шаг")
+    parser.add_argument("--output", help="файл для отчета в JSON (по умолчанию вывод в консоль)")
+    args = parser.parse_args()
+
+    from app.database import SessionLocal, init_db
+    from app.faceNet_try import MODEL_VERSION
+
+    init_db()
+    with SessionLocal() as db:
+        report = duplicate_report(db, MODEL_VERSION, args.threshold, args.block_size)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Кэш результатов FaceNet по содержимому изображения.
+
+Ключ — хэш байтов изображения (файла, PIL.Image или массива) и версия модели,
+значение — кроп лица с эмбеддингом (или отметка, что лица нет). Повторно
+присланное то же фото (перепроверка администратором, повтор после таймаута)
+не проходит MTCNN и ResNet заново. Замененное фото клиента имеет другое
+содержимое, а значит и другой ключ, поэтому записи не нужно удалять вручную:
+старые вытесняются по LRU при превышении лимита памяти и по времени жизни.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+# Лимит памяти кэша, МБ (0 — кэш выключен)
+EMBED_CACHE_MB = float(os.getenv("EMBED_CACHE_MB", 64))
+# Время жизни записи, секунды
+EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", 600))
+
+MISSING = object()
+
+
+def content_key(image, model_version):
+    """
+    Ключ кэша по содержимому изображения.
+
+    :param image: путь к файлу, PIL.Image или np.ndarray
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(model_version.encode())
+    if isinstance(image, Image.Image):
+        digest.update(f"{image.mode}{image.size}".encode())
+        digest.update(image.tobytes())
+    elif isinstance(image, np.ndarray):
+        digest.update(f"{image.dtype}{image.shape}".encode())
+        digest.update(np.ascontiguousarray(image).data)
+    else:
+        with open(image, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def value_size(value):
+    """Примерный размер записи в байтах"""
+    if value is None:
+        return 64
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 128
+    return sum(v.nbytes for v in vars(value).values() if isinstance(v, np.ndarray)) + 512
+
+
+class EmbeddingCache:
+    """
+    LRU-кэш с ограничением по памяти и времени жизни записей (потокобезопасный).
+    """
+
+    def __init__(self, max_mb=EMBED_CACHE_MB, ttl=EMBED_CACHE_TTL, clock=time.monotonic):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl
+        self.clock = clock
+        self._items = OrderedDict()  # ключ -> (значение, размер, когда истекает)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=MISSING):
+        """Значение по ключу или default (None — допустимое значение: лица на фото нет)"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[2] < self.clock():
+                if item is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        size = value_size(value)
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (value, size, self.clock() + self.ttl)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._items.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+
+# Общий кэш процесса (HTTP-эндпоинты и фоновые задачи)
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,187 @@
+"""
+Хранилище эмбеддингов лиц клиентов.
+Эмбеддинг считается один раз при сохранении фото, а при верификации
+живой кадр сравнивается уже с готовыми векторами из БД.
+У клиента может быть несколько эмбеддингов одной версии модели (шаблоны с
+нескольких кадров регистрации); в индексе галереи они объединяются в центроид.
+Рядом хранятся выровненные кропы лица для каждого шаблона (static/crops/<id_client>.png
+для первого, <id_client>_<n>.png для следующих), чтобы при пересчете эмбеддингов
+(например, после обновления модели) не детектировать лицо заново и сохранить все шаблоны.
+"""
+import os
+
+import cv2
+import numpy as np
+from sqlalchemy import distinct, func
+from sqlalchemy.orm import Session
+
+from app.models import Person, FaceEmbedding
+
+EMBEDDING_DTYPE = np.float32
+
+
+def embedding_to_bytes(vector):
+    """Переводит вектор в байты для хранения в LargeBinary"""
+    return np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def embedding_from_bytes(blob):
+    """Восстанавливает вектор из байтов"""
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+
+def resolve_photo_path(photo_path, base_dir):
+    """
+    Переводит путь к фото из БД (/static/photo/...) в абсолютный путь на диске.
+    """
+    relative_path = photo_path.replace("\\", "/").lstrip("/")
+    return os.path.join(base_dir, relative_path)
+
+
+def crop_path(base_dir, id_client, index=0):
+    """Путь к кропу лица клиента на диске (index — номер шаблона)"""
+    name = f"{id_client}.png" if index == 0 else f"{id_client}_{index}.png"
+    return os.path.join(base_dir, "static", "crops", name)
+
+
+def save_crop(base_dir, id_client, crop, index=0):
+    """
+    Сохраняет кроп лица клиента (RGB uint8 160x160) в PNG без потерь.
+    """
+    path = crop_path(base_dir, id_client, index)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cv2.imwrite(path, cv2.cvtColor(crop, cv2.COLOR_RGB2BGR))
+    return path
+
+
+def save_crops(base_dir, id_client, crops):
+    """
+    Сохраняет кропы всех шаблонов клиента; кропы старых шаблонов сверх их количества удаляются.
+    """
+    for index, crop in enumerate(crops):
+        save_crop(base_dir, id_client, crop, index)
+    index = len(crops)
+    while os.path.exists(crop_path(base_dir, id_client, index)):
+        os.remove(crop_path(base_dir, id_client, index))
+        index += 1
+
+
+def load_crop(base_dir, id_client, index=0):
+    """
+    :return: кроп лица клиента (RGB uint8) или None, если кроп не сохранен
+    """
+    crop = cv2.imread(crop_path(base_dir, id_client, index), cv2.IMREAD_COLOR)
+    if crop is None:
+        return None
+    return cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+
+
+def load_crops(base_dir, id_client):
+    """
+    :return: кропы всех шаблонов клиента по порядку (пустой список, если кропов нет)
+    """
+    crops = []
+    while True:
+        crop = load_crop(base_dir, id_client, len(crops))
+        if crop is None:
+            return crops
+        crops.append(crop)
+
+
+def save_embedding(db: Session, id_client, vector, model_version):
+    """
+    Сохраняет эмбеддинг клиента для указанной версии модели.
+    Старые векторы той же версии заменяются. Коммит делает вызывающий код.
+    """
+    return save_templates(db, id_client, [vector], model_version)[0]
+
+
+def save_templates(db: Session, id_client, vectors, model_version):
+    """
+    Сохраняет несколько эмбеддингов (шаблонов) клиента для указанной версии модели.
+    Старые векторы той же версии заменяются. Коммит делает вызывающий код.
+    """
+    db.query(FaceEmbedding).filter(
+        FaceEmbedding.id_client == id_client,
+        FaceEmbedding.model_version == model_version,
+    ).delete(synchronize_session=False)
+
+    db_embeddings = [
+        FaceEmbedding(id_client=id_client, model_version=model_version, vector=embedding_to_bytes(vector))
+        for vector in vectors
+    ]
+    db.add_all(db_embeddings)
+    return db_embeddings
+
+
+def missing_embeddings_query(db: Session, model_version):
+    """Клиенты с фото, у которых нет эмбеддинга указанной версии модели"""
+    has_embedding = db.query(FaceEmbedding.id_client).filter(FaceEmbedding.model_version == model_version)
+    return db.query(Person).filter(
+        Person.photo_path.isnot(None),
+        Person.id_client.notin_(has_embedding),
+    )
+
+
+def embed_persons(recognizer, base_dir, persons, use_batcher=True):
+    """
+    Считает эмбеддинги для пачки клиентов: по сохраненным кропам шаблонов без детекции,
+    для остальных — детекция и эмбеддинг по фото.
+
+    :param persons: список пар (id_client, photo_path из БД)
+    :return: список (id_client, векторы шаблонов или None, новый кроп для сохранения или None, статус),
+             статус: crop, photo, no_face или no_photo
+    """
+    results = {}
+    crops, photos = [], []
+    for id_client, photo_path in persons:
+        client_crops = load_crops(base_dir, id_client)
+        if client_crops:
+            crops.append((id_client, client_crops))
+            continue
+        path = resolve_photo_path(photo_path, base_dir)
+        if os.path.exists(path):
+            photos.append((id_client, path))
+        else:
+            results[id_client] = (id_client, None, None, "no_photo")
+
+    if crops:
+        # Кропы всех клиентов идут в ResNet одним списком, затем делятся обратно по клиентам
+        vectors = recognizer.embed_crops([crop for _, client_crops in crops for crop in client_crops],
+                                         use_batcher=use_batcher)
+        start = 0
+        for id_client, client_crops in crops:
+            results[id_client] = (id_client, list(vectors[start:start + len(client_crops)]), None, "crop")
+            start += len(client_crops)
+    if photos:
+        detections = recognizer.analyze([path for _, path in photos], use_batcher=use_batcher)
+        for (id_client, _), detection in zip(photos, detections):
+            if detection is None:
+                results[id_client] = (id_client, None, None, "no_face")
+            else:
+                results[id_client] = (id_client, [detection.embedding], detection.crop, "photo")
+    return [results[id_client] for id_client, _ in persons]
+
+
+def count_embeddings(db: Session, model_version):
+    """Количество эмбеддингов указанной версии модели"""
+    return db.query(FaceEmbedding).filter(FaceEmbedding.model_version == model_version).count()
+
+
+def count_gallery_clients(db: Session, model_version):
+    """Количество клиентов с эмбеддингами указанной версии модели (строк в индексе галереи)"""
+    return db.query(func.count(distinct(FaceEmbedding.id_client))).filter(
+        FaceEmbedding.model_version == model_version
+    ).scalar()
+
+
+def load_gallery(db: Session, model_version):
+    """
+    Загружает все эмбеддинги указанной версии модели.
+
+    :return: список пар (id_client, вектор), у клиента может быть несколько пар
+    """
+    rows = db.query(FaceEmbedding.id_client, FaceEmbedding.vector).filter(
+        FaceEmbedding.model_version == model_version
+    ).all()
+    return [(id_client, embedding_from_bytes(vector)) for id_client, vector in rows]
@@ -1,7 +1,121 @@
-from facenet_pytorch import InceptionResnetV1, MTCNN
+"""
+Сравнение лиц с помощью FaceNet (MTCNN + InceptionResnetV1).
+torch и веса моделей загружаются не при импорте, а при первом обращении
+к модели или заранее в фоне при старте приложения (load + warmup).
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
 from PIL import Image
-from torch.nn.functional import cosine_similarity
-import torch
+import numpy as np
+from app.shared_gallery import make_gallery
+from app.batching import EmbeddingBatcher
+from app.metrics import stage
+from app.embedding_cache import embedding_cache, content_key, MISSING
+from app.verify_policy import VERIFY_THRESHOLD
+from app.inference_profile import (
+    INFERENCE_PROFILE, FACENET_CALIBRATION_DIR, apply_profile, configure_threads, effective_profile
+)
+
+logger = logging.getLogger(__name__)
+
+# Версия эмбеддингов модели vggface2 в fp32 (хранится рядом с вектором в БД);
+# для своих весов и int8-профилей версия строится в model_version_for
+MODEL_VERSION = "facenet-vggface2"
+# Путь к локальному файлу весов InceptionResnetV1 (state_dict); если не задан, веса vggface2 берутся из кэша torch
+FACENET_WEIGHTS = os.getenv("FACENET_WEIGHTS")
+# Путь к кэшу трассированной (TorchScript) модели; если задан, следующие запуски загружают модель из него
+FACENET_TRACED_CACHE = os.getenv("FACENET_TRACED_CACHE")
+
+
+class FaceDetection:
+    """
+    Лицо, найденное MTCNN за один проход детекции.
+
+    box: рамка (x1, y1, x2, y2) в координатах исходного изображения
+    landmarks: 5 точек (глаза, нос, уголки рта), np.ndarray формы (5, 2)
+    probability: уверенность детектора
+    face: выровненный кроп 3x160x160 (тензор, уже нормированный для ResNet; None у записей из кэша)
+    embedding: эмбеддинг кропа, заполняется после прохода ResNet
+    """
+
+    def __init__(self, box, landmarks, probability, face):
+        self.box = box
+        self.landmarks = landmarks
+        self.probability = probability
+        self.face = face
+        self.embedding = None
+        self._crop = None
+
+    @property
+    def crop(self):
+        """Кроп 160x160 в RGB, np.uint8 (для сохранения на диск)"""
+        if self._crop is None:
+            self._crop = face_to_crop(self.face)
+        return self._crop
+
+    def compact(self):
+        """Копия для кэша: вместо тензора (float32) хранится кроп uint8, в 4 раза меньше"""
+        detection = FaceDetection(self.box, self.landmarks, self.probability, None)
+        detection.embedding = self.embedding
+        detection._crop = self.crop
+        return detection
+
+
+def face_to_crop(face):
+    """Нормированный тензор MTCNN 3x160x160 -> изображение RGB uint8 160x160x3"""
+    return (face * 128 + 127.5).round().clamp(0, 255).byte().permute(1, 2, 0).numpy()
+
+
+def crop_to_face(crop):
+    """Изображение RGB uint8 160x160x3 -> нормированный тензор 3x160x160 (как на выходе MTCNN)"""
+    import torch
+    return (torch.from_numpy(np.ascontiguousarray(crop)).permute(2, 0, 1).float() - 127.5) / 128
+
+
+def weights_tag(weights_path):
+    """Короткий хэш содержимого файла весов (имя файла, если файл не прочитать)"""
+    digest = hashlib.blake2b(digest_size=6)
+    try:
+        with open(weights_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    except OSError:
+        return os.path.splitext(os.path.basename(weights_path))[0]
+    return digest.hexdigest()
+
+
+def model_version_for(weights_path=FACENET_WEIGHTS, profile="fp32"):
+    """
+    Версия эмбеддингов: веса и фактически примененный профиль инференса.
+    Векторы квантованной модели или модели со своими весами не совпадают с fp32 vggface2,
+    поэтому хранятся под своей версией и пересчитываются фоновой задачей.
+    """
+    version = f"facenet-{weights_tag(weights_path)}" if weights_path else MODEL_VERSION
+    if profile != "fp32":
+        version += f"+{profile}"
+    return version
+
+
+def load_resnet_weights(resnet, state_dict, source="state_dict"):
+    """
+    Загружает веса в InceptionResnetV1 без классификатора.
+
+    Отбрасываются только веса классификатора (logits.*): в файлах vggface2/casia-webface
+    он есть, а в модели для эмбеддингов его нет. Остальные ключи должны совпасть
+    полностью, иначе неполный или чужой файл весов тихо дал бы модель со случайными
+    весами, а ее эмбеддинги сохранились бы под версией этого файла весов.
+    """
+    state_dict = {key: value for key, value in state_dict.items() if not key.startswith("logits.")}
+    try:
+        resnet.load_state_dict(state_dict, strict=True)
+    except RuntimeError as e:
+        raise ValueError(f"Файл весов {source} не подходит к InceptionResnetV1: {e}") from e
+    return resnet
+
 
 class FaceNetVerify:
     _instance = None
@@ -9,20 +123,333 @@ class FaceNetVerify:
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super(FaceNetVerify, cls).__new__(cls, *args, **kwargs)
-            cls._instance.mtcnn = MTCNN(image_size=160, margin=0)
-            cls._instance.resnet = InceptionResnetV1(pretrained="vggface2").eval()
+            # Версия известна до загрузки модели: по ней строится галерея и ищутся клиенты без эмбеддингов
+            cls._instance.model_version = model_version_for(FACENET_WEIGHTS, effective_profile())
+            cls._instance._mtcnn = None
+            cls._instance._resnet = None
+            cls._instance._load_lock = threading.Lock()
+            cls._instance.ready = False  # модели загружены и прогреты
+            cls._instance.load_seconds = None
+            cls._instance.load_error = None
+            cls._instance.profile = None  # профиль инференса загруженной модели
+            cls._instance._warmup_thread = None
+            cls._instance._warmup_lock = threading.Lock()  # отдельно от загрузки: проверка готовности ее не ждет
+            cls._instance.gallery = make_gallery()
+            # ResNet вызывается батчами, собранными из параллельных запросов
+            cls._instance.batcher = EmbeddingBatcher(cls._instance.embed_faces)
         return cls._instance
 
+    @property
+    def mtcnn(self):
+        if self._mtcnn is None:
+            self.load()
+        return self._mtcnn
+
+    @property
+    def resnet(self):
+        if self._resnet is None:
+            self.load()
+        return self._resnet
+
+    def load(self, weights_path=FACENET_WEIGHTS, traced_cache=FACENET_TRACED_CACHE, profile=INFERENCE_PROFILE,
+             mark_ready=True):
+        """
+        Загружает MTCNN и InceptionResnetV1 (один раз, потокобезопасно).
+        После ошибки следующий вызов пробует загрузить модели снова.
+
+        :param weights_path: локальный файл весов ResNet (без обращения к сети)
+        :param traced_cache: файл TorchScript-модели: загружается, если есть, иначе создается после загрузки
+        :param profile: профиль инференса (fp32, int8-dynamic, int8-static)
+        :param mark_ready: отметить готовность сразу после загрузки (False — ее отметит warmup после прогрева)
+        """
+        with self._load_lock:
+            if self._resnet is not None:
+                return
+            try:
+                self._load_models(weights_path, traced_cache, profile)
+            except Exception as e:
+                self.load_error = str(e)
+                raise
+            self.load_error = None
+            if mark_ready:
+                # Ленивая загрузка первым запросом (FACENET_PRELOAD=0): прогрева не будет
+                self.ready = True
+
+    def _load_models(self, weights_path, traced_cache, profile):
+        """Загрузка моделей (вызывается из load под блокировкой)"""
+        import torch
+        from facenet_pytorch import MTCNN
+
+        start = time.perf_counter()
+        configure_threads()
+        mtcnn = MTCNN(image_size=160, margin=0)
+        # int8-static без калибровки применяется как int8-dynamic: записываем фактический профиль
+        profile = effective_profile(profile)
+        model_version = model_version_for(weights_path, profile)
+        # Для каждой версии (веса и профиль) свой кэш TorchScript
+        if traced_cache and model_version != MODEL_VERSION:
+            root, ext = os.path.splitext(traced_cache)
+            traced_cache = f"{root}.{model_version.replace('+', '.')}{ext}"
+
+        if traced_cache and os.path.exists(traced_cache):
+            resnet = torch.jit.load(traced_cache).eval()
+            source = traced_cache
+        else:
+            resnet, source = self.build_resnet(weights_path)
+            calibration = None
+            if profile == "int8-static":
+                calibration = self.calibration_batches(FACENET_CALIBRATION_DIR, mtcnn)
+                if not calibration:
+                    raise ValueError(f"В {FACENET_CALIBRATION_DIR} нет лиц для калибровки int8-static")
+            resnet = apply_profile(resnet, profile, calibration)
+            if traced_cache:
+                with torch.no_grad():
+                    resnet = torch.jit.trace(resnet, torch.zeros(1, 3, 160, 160))
+                torch.jit.save(resnet, traced_cache)
+        self._mtcnn, self._resnet = mtcnn, resnet
+        self.profile = profile
+        self.model_version = model_version
+        logger.info("FaceNet (%s, версия эмбеддингов %s) загружен из %s за %.2f с",
+                    profile, model_version, source, time.perf_counter() - start)
+
+    @staticmethod
+    def build_resnet(weights_path=FACENET_WEIGHTS):
+        """
+        Создает fp32 InceptionResnetV1 в режиме eval.
+
+        :return: (модель, откуда загружены веса)
+        """
+        import torch
+        from facenet_pytorch import InceptionResnetV1
+
+        if weights_path:
+            resnet = InceptionResnetV1(pretrained=None)
+            load_resnet_weights(resnet, torch.load(weights_path, map_location="cpu"), weights_path)
+            return resnet.eval(), weights_path
+        return InceptionResnetV1(pretrained="vggface2").eval(), "vggface2"
+
+    @staticmethod
+    def calibration_batches(directory, mtcnn, batch_size=8, limit=256):
+        """
+        Вырезанные лица из папки с фото для калибровки квантования.
+
+        :return: список тензоров Nx3x160x160
+        """
+        import torch
+
+        faces = []
+        for name in sorted(os.listdir(directory))[:limit]:
+            try:
+                face = mtcnn(Image.open(os.path.join(directory, name)).convert("RGB"))
+            except OSError:
+                continue
+            if face is not None:
+                faces.append(face)
+        return [torch.stack(faces[i:i + batch_size]) for i in range(0, len(faces), batch_size)]
+
+    def warmup(self):
+        """
+        Загружает модели и делает пробный прогон, чтобы первый запрос не ждал.
+        Время загрузки сохраняется в load_seconds.
+        """
+        start = time.perf_counter()
+        try:
+            self.load(mark_ready=False)
+            import torch
+            with torch.inference_mode():
+                self.resnet(torch.zeros(1, 3, 160, 160))
+                self.mtcnn(Image.new("RGB", (160, 160)))
+        except Exception as e:
+            self.load_error = str(e)
+            logger.exception("Не удалось загрузить FaceNet")
+            return
+        self.load_error = None
+        self.load_seconds = round(time.perf_counter() - start, 3)
+        self.ready = True
+        logger.info("FaceNet готов к работе, загрузка и прогрев заняли %.2f с", self.load_seconds)
+
+    def start_warmup(self):
+        """
+        Запускает warmup в фоновом потоке, если модели не готовы и прогрев еще не идет
+        (в том числе повторно после ошибки загрузки).
+
+        :return: True, если прогрев запущен
+        """
+        with self._warmup_lock:
+            if self.ready or (self._warmup_thread is not None and self._warmup_thread.is_alive()):
+                return False
+            self._warmup_thread = threading.Thread(target=self.warmup, name="facenet-warmup", daemon=True)
+            self._warmup_thread.start()
+        return True
 
-    def verify_faces(self, img1_path, img2_path, thr = 0.5):
+    def readiness(self, preload=True):
+        """
+        Готовность к запросам для /health/ready.
+        При preload=False модели загружаются первым запросом, поэтому сервис готов принимать
+        запросы и до загрузки (иначе проверка готовности не пропустила бы этот первый запрос).
+        При preload=True после ошибки загрузки прогрев запускается повторно.
+
+        :return: (готов ли сервис, состояние: ready, loaded, preload, load_seconds, error)
+        """
+        if preload and not self.ready and self.load_error is not None:
+            self.start_warmup()
+        status = {
+            "ready": self.ready or not preload,
+            "loaded": self._resnet is not None,
+            "preload": preload,
+            "load_seconds": self.load_seconds,
+            "error": self.load_error,
+        }
+        return status["ready"], status
+
+    def get_embedding(self, image):
+        """
+        Считает нормированный эмбеддинг лица на изображении.
+
+        :param image: Путь к изображению или PIL.Image (RGB).
+        :return: np.ndarray формы (512,) типа float32 или None, если лицо не найдено.
+        """
+        return self.embed_batch([image])[0]
+
+    def detect(self, images):
+        """
+        Один проход MTCNN: рамка, ключевые точки и выровненный кроп лица.
+        Изображения одного размера обрабатываются одним батчем, входные изображения не меняются.
+
+        :param images: список путей или PIL.Image
+        :return: список FaceDetection (или None, если лицо не найдено)
+        """
+        images = [image if isinstance(image, Image.Image) else Image.open(image) for image in images]
+        images = [image.convert("RGB") for image in images]
+
+        # MTCNN принимает батч только из изображений одинакового размера
+        by_size = {}
+        for i, image in enumerate(images):
+            by_size.setdefault(image.size, []).append(i)
+
+        detections = [None] * len(images)
+        import torch
+        mtcnn = self.mtcnn
+        for indexes in by_size.values():
+            batch = [images[i] for i in indexes]
+            with torch.inference_mode(), stage("mtcnn"):
+                # То же, что mtcnn(batch), но рамки и точки не теряются
+                boxes, probs, points = mtcnn.detect(batch, landmarks=True)
+                boxes, probs, points = mtcnn.select_boxes(boxes, probs, points, batch,
+                                                          method=mtcnn.selection_method)
+                faces = mtcnn.extract(batch, boxes, None)
+            for i, box, prob, point, face in zip(indexes, boxes, probs, points, faces):
+                if face is not None:
+                    detections[i] = FaceDetection(np.asarray(box[0]), np.asarray(point[0]), float(prob[0]), face)
+        return detections
+
+    def extract_faces(self, images):
+        """
+        Детектирует и вырезает лица MTCNN.
+
+        :param images: список путей или PIL.Image
+        :return: список тензоров 3x160x160 (или None, если лицо не найдено)
+        """
+        return [detection.face if detection is not None else None for detection in self.detect(images)]
+
+    def embed_faces(self, faces):
+        """
+        Один батчевый проход ResNet по вырезанным лицам.
+
+        :param faces: список тензоров 3x160x160
+        :return: нормированные эмбеддинги, np.ndarray формы (N, 512)
+        """
+        import torch
+        # inference_mode: без учета градиентов и версий тензоров
+        with torch.inference_mode(), stage("resnet_forward"):
+            embeddings = self.resnet(torch.stack(faces)).numpy().astype(np.float32)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    def _embed(self, faces, use_batcher):
+        # Для запроса этап resnet включает ожидание набора батча
+        with stage("resnet"):
+            if use_batcher:
+                return self.batcher.embed(faces)
+            return self.embed_faces(faces)
+
+    def analyze(self, images, use_batcher=True, cache=True):
+        """
+        Детекция и эмбеддинг за один проход: кропы из MTCNN сразу идут в ResNet.
+        Результаты для уже обработанных изображений (по хэшу содержимого) берутся из кэша.
+
+        :param images: список путей или PIL.Image
+        :param use_batcher: объединять ли кропы с кропами других запросов (для офлайн-обработки можно отключить)
+        :param cache: использовать ли кэш (для живых кадров камеры, которые не повторяются, можно отключить)
+        :return: список FaceDetection с заполненным embedding (или None для изображений без лица)
+        """
+        keys = None
+        if cache and embedding_cache.enabled:
+            keys = [content_key(image, self.model_version) for image in images]
+
+        results = [None] * len(images)
+        todo = []
+        for i in range(len(images)):
+            cached = embedding_cache.get(keys[i]) if keys else MISSING
+            if cached is MISSING:
+                todo.append(i)
+            else:
+                results[i] = cached
+        if not todo:
+            return results
+
+        detections = self.detect([images[i] for i in todo])
+        found = [detection for detection in detections if detection is not None]
+        if found:
+            for detection, vector in zip(found, self._embed([d.face for d in found], use_batcher)):
+                detection.embedding = vector
+        for i, detection in zip(todo, detections):
+            results[i] = detection
+            if keys:
+                embedding_cache.put(keys[i], detection.compact() if detection is not None else None)
+        return results
+
+    def embed_batch(self, images, use_batcher=True, cache=True):
+        """
+        Считает эмбеддинги для нескольких изображений.
+
+        :param images: список путей или PIL.Image
+        :param use_batcher: объединять ли кропы с кропами других запросов
+        :param cache: использовать ли кэш по содержимому изображений
+        :return: список эмбеддингов (или None для изображений без лица)
+        """
+        return [detection.embedding if detection is not None else None
+                for detection in self.analyze(images, use_batcher, cache)]
+
+    def embed_crops(self, crops, use_batcher=True, cache=True):
+        """
+        Эмбеддинги для сохраненных кропов 160x160 без повторной детекции
+        (например, при пересчете после обновления модели).
+
+        :param crops: список изображений RGB uint8 160x160x3
+        :return: список нормированных эмбеддингов формы (512,)
+        """
+        keys = [content_key(crop, self.model_version) for crop in crops] if cache and embedding_cache.enabled else None
+        results = [embedding_cache.get(key) for key in keys] if keys else [MISSING] * len(crops)
+        todo = [i for i, vector in enumerate(results) if vector is MISSING]
+        if todo:
+            vectors = self._embed([crop_to_face(crops[i]) for i in todo], use_batcher)
+            for i, vector in zip(todo, vectors):
+                results[i] = vector
+                if keys:
+                    embedding_cache.put(keys[i], vector)
+        return results
+
+    def verify_faces(self, img1_path, img2_path, thr=VERIFY_THRESHOLD):
         """
         Сравнивает два изображения лиц и определяет, совпадают ли они.
 
         :param img1_path: Путь к первому изображению (фото из камеры).
         :param img2_path: Путь ко второму изображению (фото из базы).
         : thr = пороговое значение, выше которого считается, что лицо на одном изображении есть и на другом
+                (по умолчанию VERIFY_THRESHOLD)
         :return: True, если лица совпадают, False в противном случае.
         """
+        from torch.nn.functional import cosine_similarity
         try:
             # Загрузка изображений
             img1 = Image.open(img1_path)
@@ -44,7 +471,6 @@ class FaceNetVerify:
 
             similarity = cosine_similarity(embedding1, embedding2)
             is_match = False
-            print(similarity.item())
 
             if (similarity.item() > thr):
                 is_match = True
@@ -54,6 +480,32 @@ class FaceNetVerify:
             print(f"Ошибка при сравнении лиц: {e}")
             return False
 
+    def search_gallery(self, embedding, k=5, rerank=None):
+        """
+        Ищет k наиболее похожих клиентов в галерее.
+
+        :param rerank: сколько лучших кандидатов проверять по отдельным шаблонам (0 — только центроиды)
+        :return: список пар (id_client, сходство) по убыванию сходства
+        """
+        with stage("gallery_search"):
+            return self.gallery.search(embedding, k, rerank)
+
+    def rescore_gallery(self, embedding, candidates, top=None):
+        """
+        Проверяет top лучших кандидатов по отдельным шаблонам клиентов.
+
+        :return: кандидаты, заново отсортированные по убыванию сходства
+        """
+        with stage("gallery_rescore"):
+            return self.gallery.rescore(embedding, candidates, top)
+
+    @staticmethod
+    def compare_embeddings(embedding1, embedding2):
+        """
+        Косинусное сходство двух нормированных эмбеддингов.
+        """
+        return float(np.dot(embedding1, embedding2))
+
 # Пример использования
 if __name__ == "__main__":
     face_recognizer = FaceNetVerify()
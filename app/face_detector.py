@@ -1,12 +1,37 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
+import numpy as np
+from app.metrics import stage
+
+# Параметры detectMultiScale: шаг уменьшения окна, сколько соседей нужно прямоугольнику, минимальный размер лица
+HAAR_SCALE_FACTOR = float(os.getenv("HAAR_SCALE_FACTOR", 1.1))
+HAAR_MIN_NEIGHBORS = int(os.getenv("HAAR_MIN_NEIGHBORS", 5))
+HAAR_MIN_SIZE = int(os.getenv("HAAR_MIN_SIZE", 30))
+# Быстрый режим: ширина уменьшенной копии кадра для поиска (0 — поиск в исходном разрешении)
+HAAR_DETECT_WIDTH = int(os.getenv("HAAR_DETECT_WIDTH", 0))
+# Насколько расширять рамку лица с предыдущего кадра при поиске в последовательности (доля размера рамки)
+HAAR_ROI_MARGIN = float(os.getenv("HAAR_ROI_MARGIN", 0.5))
+# Через сколько кадров искать по всему кадру, даже если лицо находится рядом с прошлой рамкой
+HAAR_FULL_SCAN_EVERY = int(os.getenv("HAAR_FULL_SCAN_EVERY", 10))
+# Количество потоков для detect_batch (0 — по числу ядер)
+HAAR_BATCH_WORKERS = int(os.getenv("HAAR_BATCH_WORKERS", 0))
+
+NO_FACES = np.empty((0, 4), dtype=np.int32)
+
+
 class FaceDetectorHaar:
-    def __init__(self, cascade_path=None):
+    def __init__(self, cascade_path=None, scale_factor=HAAR_SCALE_FACTOR, min_neighbors=HAAR_MIN_NEIGHBORS,
+                 min_size=HAAR_MIN_SIZE, detect_width=HAAR_DETECT_WIDTH, batch_workers=HAAR_BATCH_WORKERS):
         """
   Инициализирует детектор лиц с использованием каскадов Хаара.
 
   cascade_path: Путь к файлу каскада Хаара.
+  scale_factor, min_neighbors, min_size: параметры detectMultiScale (min_size — в пикселях исходного кадра).
+  detect_width: ширина копии кадра, на которой ищутся лица (0 — исходное разрешение).
+  batch_workers: количество потоков для detect_batch (0 — по числу ядер).
   """
 
         if cascade_path is None:
@@ -22,28 +47,139 @@ class FaceDetectorHaar:
         if self.face_cascade.empty():
             raise ValueError(f"Не удалось загрузить каскадный классификатор из файла: {cascade_path}")
 
+        self.cascade_path = cascade_path
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.detect_width = detect_width
+        self.batch_workers = batch_workers or os.cpu_count() or 1
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # У каждого потока свой классификатор: один CascadeClassifier нельзя вызывать из нескольких потоков сразу
+        self._local = threading.local()
+        self._local.cascade = self.face_cascade
+
+    def _cascade(self):
+        cascade = getattr(self._local, "cascade", None)
+        if cascade is None:
+            cascade = self._local.cascade = cv2.CascadeClassifier(self.cascade_path)
+        return cascade
+
+    def find_faces(self, image, detect_width=None, roi=None):
+            """
+      Ищет лица на изображении, не изменяя его.
+
+          image: Изображение в формате numpy array (BGR).
+          detect_width: ширина копии кадра для поиска (по умолчанию из настроек детектора);
+                        рамки пересчитываются в координаты исходного кадра
+          roi: область (x, y, w, h), в которой искать лица (например, вокруг лица с прошлого кадра)
+          return: список прямоугольников (x, y, w, h)
+      """
+            detect_width = self.detect_width if detect_width is None else detect_width
+            height, width = image.shape[:2]
+            # Масштаб считается по всему кадру, чтобы поиск в области и по кадру давал одинаковые рамки
+            scale = width / detect_width if detect_width and width > detect_width else 1.0
+
+            x0, y0 = 0, 0
+            if roi is not None:
+                x, y, w, h = roi
+                x0, y0 = max(int(x), 0), max(int(y), 0)
+                x1, y1 = min(int(x + w), width), min(int(y + h), height)
+                if x1 <= x0 or y1 <= y0:
+                    return NO_FACES
+                image = image[y0:y1, x0:x1]
+
+            with stage("haar"):
+                grayscale_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+                if scale > 1:
+                    # Уменьшаем уже серое изображение: в три раза меньше данных, чем у цветного
+                    size = (max(1, round(image.shape[1] / scale)), max(1, round(image.shape[0] / scale)))
+                    grayscale_image = cv2.resize(grayscale_image, size, interpolation=cv2.INTER_AREA)
+                min_size = max(1, round(self.min_size / scale))
+                # Ищем лица на изображении
+                faces = self._cascade().detectMultiScale(
+                    grayscale_image,  # Изображение в оттенках серого
+                    scaleFactor=self.scale_factor,  # На сколько уменьшать размер окна на каждом шаге
+                    minNeighbors=self.min_neighbors,  # Сколько соседей должно быть у прямоугольника
+                    minSize=(min_size, min_size)  # Минимальный размер объекта
+                )
+            if len(faces) == 0:
+                return NO_FACES
+            if scale > 1:
+                faces = np.round(faces * scale).astype(np.int32)
+            return faces + np.array([x0, y0, 0, 0], dtype=faces.dtype)
 
-    def detect_faces(self, image):
+    def detect_faces(self, image, detect_width=None):
             """
       Обнаруживает лица на изображении.
+      Прямоугольники рисуются на копии, исходный кадр не меняется.
 
           image: Изображение в формате numpy array.
-          return: список прямоугольников, изображение с отрисованными прямоугольниками
+          detect_width: ширина копии кадра для быстрого поиска (см. find_faces)
+          return: список прямоугольников, копия изображения с отрисованными прямоугольниками
       """
-            grayscale_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            # Ищем лица на изображении
-            faces = self.face_cascade.detectMultiScale(
-                grayscale_image,  # Изображение в оттенках серого
-                scaleFactor=1.1,  # На сколько уменьшать размер окна на каждом шаге
-                minNeighbors=5,  # Сколько соседей должно быть у прямоугольника
-                minSize=(30, 30)  # Минимальный размер объекта
-            )
+            faces = self.find_faces(image, detect_width)
 
             # Рисуем прямоугольники вокруг обнаруженных лиц
-            if len(faces) > 0:
-                for (x, y, w, h) in faces:
-                    cv2.rectangle(image, (x, y), (x + w, y + h), (255, 0, 0), 2)
+            annotated = image.copy()
+            for (x, y, w, h) in faces:
+                cv2.rectangle(annotated, (int(x), int(y)), (int(x + w), int(y + h)), (255, 0, 0), 2)
+
+            return faces, annotated
+
+    def detect_batch(self, frames, detect_width=None):
+            """
+      Ищет лица на нескольких кадрах параллельно (OpenCV отпускает GIL на время поиска).
+
+          frames: кадры в формате numpy array (BGR)
+          return: список прямоугольников для каждого кадра (в том же порядке)
+      """
+            frames = list(frames)
+            if len(frames) <= 1 or self.batch_workers <= 1:
+                return [self.find_faces(frame, detect_width) for frame in frames]
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.batch_workers, thread_name_prefix="haar")
+            return list(self._pool.map(lambda frame: self.find_faces(frame, detect_width), frames))
+
+
+def expand_box(box, margin):
+    """Рамка (x, y, w, h), расширенная на долю margin своего размера с каждой стороны"""
+    x, y, w, h = box
+    dx, dy = w * margin, h * margin
+    return int(x - dx), int(y - dy), int(w + 2 * dx), int(h + 2 * dy)
+
+
+class FaceTracker:
+    """
+    Поиск лица в последовательности кадров одной камеры.
+
+    Пока лицо находится рядом с рамкой с предыдущего кадра, поиск идет только в
+    расширенной области вокруг нее. Если там лица нет (или прошло full_scan_every
+    кадров), ищем по всему кадру. Интерфейс тот же, что у детектора (find_faces),
+    но состояние свое для каждой последовательности кадров.
+    """
+
+    def __init__(self, detector, margin=HAAR_ROI_MARGIN, full_scan_every=HAAR_FULL_SCAN_EVERY, detect_width=None):
+        self.detector = detector
+        self.margin = margin
+        self.full_scan_every = full_scan_every
+        self.detect_width = detect_width
+        self.reset()
 
-            return faces, image
+    def reset(self):
+        self.box = None
+        self.frames_since_full_scan = 0
 
+    def find_faces(self, image):
+        if self.box is not None and self.frames_since_full_scan < self.full_scan_every:
+            faces = self.detector.find_faces(image, self.detect_width, roi=expand_box(self.box, self.margin))
+            if len(faces):
+                self.frames_since_full_scan += 1
+                self.box = max(faces, key=lambda b: b[2] * b[3])
+                return faces
 
+        faces = self.detector.find_faces(image, self.detect_width)
+        self.frames_since_full_scan = 0
+        self.box = max(faces, key=lambda b: b[2] * b[3]) if len(faces) else None
+        return faces
@@ -0,0 +1,169 @@
+"""
+Конвейер обработки кадров при верификации:
+1. дешевая проверка Хааром на уменьшенной копии кадра — кадры без лица отбрасываются
+2. эмбеддинг считается только для кадров с лицом (пачками)
+3. решение по кадру принимает VerificationPolicy: обычно хватает одного прохода
+   по центроидам клиентов, шаблоны проверяются только в пограничных случаях
+4. результаты по кадрам объединяются в скользящем окне; как только решение
+   устойчиво (или вышло время), обработка заканчивается
+"""
+import os
+import time
+from collections import deque
+
+import cv2
+
+from app.verify_policy import VerificationPolicy, VERIFY_STRONG_THRESHOLD
+
+# Ширина уменьшенной копии кадра для проверки Хааром
+PREFILTER_WIDTH = int(os.getenv("PREFILTER_WIDTH", 320))
+# Размер скользящего окна (в кадрах с лицом)
+VERIFY_WINDOW = int(os.getenv("VERIFY_WINDOW", 3))
+# Сколько последних кадров в окне должны указывать на одного клиента
+VERIFY_MIN_AGREE = int(os.getenv("VERIFY_MIN_AGREE", 2))
+# Ограничение времени на один запрос верификации, секунды
+VERIFY_TIME_BUDGET = float(os.getenv("VERIFY_TIME_BUDGET", 5.0))
+
+
+def downscale(frame, width=PREFILTER_WIDTH):
+    """Уменьшенная копия кадра (исходный кадр не меняется)"""
+    height, frame_width = frame.shape[:2]
+    if frame_width <= width:
+        return frame.copy()
+    scale = width / frame_width
+    return cv2.resize(frame, (width, int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+class VerificationPipeline:
+    """
+    Потоковая верификация по кадрам.
+
+    detector: детектор Хаара (FaceDetectorHaar)
+    recognizer: FaceNetVerify (нужны embed_batch, search_gallery и rescore_gallery)
+    to_image: преобразование кадра в формат, который принимает recognizer
+    cache: брать ли эмбеддинги уже присланных кадров из кэша по содержимому
+    policy: правила решения по кадру (по умолчанию VerificationPolicy с порогами threshold и strong_threshold)
+    """
+
+    def __init__(self, detector, recognizer, threshold, top_k=5, batch_size=4, to_image=None,
+                 window=VERIFY_WINDOW, min_agree=VERIFY_MIN_AGREE, time_budget=VERIFY_TIME_BUDGET,
+                 strong_threshold=VERIFY_STRONG_THRESHOLD, prefilter_width=PREFILTER_WIDTH, cache=True,
+                 policy=None):
+        self.detector = detector
+        self.recognizer = recognizer
+        self.policy = policy or VerificationPolicy(threshold, strong_threshold)
+        self.threshold = self.policy.threshold
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.to_image = to_image or (lambda frame: frame)
+        self.window = window
+        self.min_agree = min_agree
+        self.time_budget = time_budget
+        self.prefilter_width = prefilter_width
+        self.cache = cache
+
+    def has_face(self, frame):
+        """Быстрая проверка наличия лица Хааром на уменьшенной копии"""
+        return len(self.detector.find_faces(downscale(frame, self.prefilter_width))) > 0
+
+    def _decision(self, window):
+        """
+        Проверяет, устойчиво ли решение по последним кадрам.
+
+        :param window: решения (Decision) по последним кадрам
+        :return: (id_client, сходство, отрыв от второго кандидата) или None
+        """
+        if not window:
+            return None
+        last = window[-1]
+        if last.confident:
+            return last.id_client, last.score, last.margin
+
+        recent = list(window)[-self.min_agree:]
+        if len(recent) < self.min_agree or last.id_client is None:
+            return None
+        if all(decision.id_client == last.id_client for decision in recent):
+            return (last.id_client, sum(d.score for d in recent) / len(recent),
+                    min((d.margin for d in recent if d.margin is not None), default=None))
+        return None
+
+    def run(self, frames):
+        """
+        Обрабатывает кадры до устойчивого решения, конца кадров или истечения времени.
+
+        :param frames: итерируемый объект с кадрами (BGR)
+        :return: словарь с id найденного клиента (или None), сходством, отрывом от второго
+                 кандидата (margin), кандидатами и статистикой
+        """
+        start = time.monotonic()
+        window = deque(maxlen=self.window)
+        result = {
+            "matched_id": None,
+            "score": None,
+            "margin": None,
+            "candidates": [],
+            "frames_examined": 0,
+            "frames_embedded": 0,
+            "frames_rescored": 0,
+            "frames_without_face": 0,
+            "timed_out": False,
+        }
+        best = None  # решение с наибольшим сходством по всем кадрам
+        best_match = None  # то же среди кадров с совпадением
+        pending = []  # кадры с лицом, ожидающие эмбеддинга
+
+        def flush():
+            nonlocal best, best_match
+            embeddings = self.recognizer.embed_batch([self.to_image(frame) for frame in pending], cache=self.cache)
+            pending.clear()
+            for embedding in embeddings:
+                if embedding is None:
+                    continue
+                result["frames_embedded"] += 1
+                frame_decision = self.policy.evaluate(self.recognizer, embedding, self.top_k)
+                if frame_decision.passes > 1:
+                    result["frames_rescored"] += 1
+                if not frame_decision.candidates:
+                    continue
+                if best is None or frame_decision.score > best.score:
+                    best = frame_decision
+                if frame_decision.id_client is not None and (
+                        best_match is None or frame_decision.score > best_match.score):
+                    best_match = frame_decision
+                window.append(frame_decision)
+                decision = self._decision(window)
+                if decision is not None:
+                    return decision
+            return None
+
+        decision = None
+        for frame in frames:
+            result["frames_examined"] += 1
+            if self.has_face(frame):
+                pending.append(frame)
+            else:
+                result["frames_without_face"] += 1
+            if len(pending) >= self.batch_size:
+                decision = flush()
+                if decision is not None:
+                    break
+            if time.monotonic() - start > self.time_budget:
+                result["timed_out"] = True
+                break
+
+        if decision is None and pending:
+            decision = flush()
+
+        if decision is not None:
+            result["matched_id"], result["score"], result["margin"] = decision
+            result["candidates"] = window[-1].candidates
+        elif best_match is not None:
+            # Кадры закончились раньше, чем решение стало устойчивым — берем лучший кадр с совпадением
+            result["matched_id"], result["score"], result["margin"] = (best_match.id_client, best_match.score,
+                                                                       best_match.margin)
+            result["candidates"] = best_match.candidates
+        elif best is not None:
+            result["candidates"] = best.candidates
+            result["score"], result["margin"] = best.score, best.margin
+        result["elapsed_ms"] = round((time.monotonic() - start) * 1000, 1)
+        return result
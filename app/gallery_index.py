@@ -0,0 +1,255 @@
+"""
+Поиск лица по всей галерее клиентов (1:N).
+Все нормированные эмбеддинги лежат в одной матрице NumPy, точный поиск top-k
+делается одним умножением матрицы на вектор. Для больших галерей
+включается приближенный поиск по инвертированным спискам (IVF).
+
+У клиента может быть несколько эмбеддингов (шаблонов) — например, с нескольких
+кадров при регистрации. В матрице поиска у клиента одна строка — центроид
+(нормированное среднее шаблонов), поэтому первый проход стоит столько же, сколько
+с одним фото. Отдельные шаблоны сравниваются с запросом только для нескольких
+лучших кандидатов первого прохода.
+"""
+import copy
+import os
+import threading
+
+import numpy as np
+
+# Размер галереи, начиная с которого используется приближенный поиск
+GALLERY_ANN_THRESHOLD = int(os.getenv("GALLERY_ANN_THRESHOLD", 20000))
+# Сколько ближайших кластеров просматривать при приближенном поиске
+GALLERY_ANN_PROBES = int(os.getenv("GALLERY_ANN_PROBES", 8))
+# Сколько лучших кандидатов первого прохода (по центроидам) проверять по отдельным шаблонам
+GALLERY_RERANK_TOP = int(os.getenv("GALLERY_RERANK_TOP", 3))
+
+
+def normalize(vectors):
+    """Нормирует векторы (или один вектор) по L2"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """Индексы k наибольших значений, отсортированные по убыванию"""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+def centroid(vectors):
+    """Нормированное среднее нормированных векторов (шаблонов одного клиента)"""
+    return normalize(normalize(vectors).mean(axis=0))
+
+
+def group_templates(entries):
+    """
+    Группирует эмбеддинги по клиентам (в порядке первого появления клиента).
+
+    :param entries: список пар (id_client, вектор), у клиента может быть несколько векторов
+    :return: (id клиентов, центроиды N x D, id клиента для каждой строки шаблонов, шаблоны T x D);
+             центроиды None, если векторов нет; шаблоны хранятся только у клиентов с двумя и более векторами
+    """
+    vectors = {}
+    for id_client, vector in entries:
+        vectors.setdefault(id_client, []).append(vector)
+    ids = np.array(list(vectors), dtype=np.int64)
+    centroids = np.array([centroid(v) if len(v) > 1 else normalize(v[0]) for v in vectors.values()],
+                         dtype=np.float32) if vectors else None
+    template_ids = np.array([id_client for id_client, v in vectors.items() if len(v) > 1 for _ in v],
+                            dtype=np.int64)
+    templates = normalize([vector for v in vectors.values() if len(v) > 1 for vector in v]) \
+        if len(template_ids) else None
+    return ids, centroids, template_ids, templates
+
+
+def client_entries(entries):
+    """Одна пара (id_client, центроид) на клиента (например, для отчета о дубликатах)"""
+    ids, centroids, _, _ = group_templates(entries)
+    return list(zip(ids.tolist(), centroids)) if len(ids) else []
+
+
+class IVFIndex:
+    """
+    Приближенный индекс: векторы разбиваются на кластеры k-means,
+    при поиске сравнение идет только с векторами из ближайших кластеров.
+    """
+
+    def __init__(self, matrix, n_lists=None, n_iter=10, seed=0):
+        n = len(matrix)
+        self.n_lists = n_lists or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        self.centroids = matrix[rng.choice(n, self.n_lists, replace=False)].copy()
+
+        # Несколько итераций сферического k-means
+        for _ in range(n_iter):
+            assignment = np.argmax(matrix @ self.centroids.T, axis=1)
+            for c in range(self.n_lists):
+                members = matrix[assignment == c]
+                if len(members):
+                    self.centroids[c] = members.mean(axis=0)
+            self.centroids = normalize(self.centroids)
+
+        assignment = np.argmax(matrix @ self.centroids.T, axis=1)
+        self.lists = [np.flatnonzero(assignment == c) for c in range(self.n_lists)]
+
+    def candidates(self, query, n_probe):
+        """Индексы строк матрицы из n_probe ближайших кластеров"""
+        nearest = top_k(self.centroids @ query, n_probe)
+        return np.concatenate([self.lists[c] for c in nearest])
+
+    def assign(self, rows, vectors):
+        """
+        Копия индекса, в которой строки rows перенесены в кластеры, ближайшие к vectors.
+        Сам индекс не меняется: поиск, который уже держит его, дочитывает старые списки.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        clusters = np.argmax(np.atleast_2d(vectors) @ self.centroids.T, axis=1)
+        index = copy.copy(self)
+        index.lists = [np.append(members[~np.isin(members, rows)], rows[clusters == c])
+                       for c, members in enumerate(self.lists)]
+        return index
+
+
+class GalleryIndex:
+    """
+    Индекс эмбеддингов галереи.
+    Хранит id клиентов и матрицу нормированных центроидов (N x 512), а также
+    шаблоны клиентов, у которых их несколько (template_ids и template_matrix).
+    """
+
+    def __init__(self, ann_threshold=GALLERY_ANN_THRESHOLD, n_probe=GALLERY_ANN_PROBES,
+                 rerank_top=GALLERY_RERANK_TOP):
+        self.ann_threshold = ann_threshold
+        self.n_probe = n_probe
+        self.rerank_top = rerank_top
+        self.ids = np.empty(0, dtype=np.int64)
+        self.matrix = None
+        self.ivf = None
+        self.template_ids = np.empty(0, dtype=np.int64)
+        self.template_matrix = None
+        self.built = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def attach(self, expected_count):
+        """
+        Подключается к уже построенному индексу другого процесса.
+        Индекс в памяти процесса строится только через build, поэтому всегда False.
+        """
+        return False
+
+    def build(self, entries):
+        """
+        Строит индекс заново.
+
+        :param entries: список пар (id_client, вектор), у клиента может быть несколько векторов
+        """
+        ids, matrix, template_ids, templates = group_templates(entries)
+        ivf = IVFIndex(matrix) if matrix is not None and len(ids) >= self.ann_threshold else None
+        with self._lock:
+            self.ids, self.matrix, self.ivf = ids, matrix, ivf
+            self.template_ids, self.template_matrix = template_ids, templates
+            self.built = True
+
+    def add(self, id_client, vector):
+        """
+        Добавляет (или заменяет) клиента без перестроения индекса.
+
+        :param vector: эмбеддинг (D,) или несколько шаблонов клиента (T x D)
+        """
+        templates = normalize(np.atleast_2d(vector))
+        vector = centroid(templates)[None, :]
+        with self._lock:
+            keep = self.template_ids != id_client
+            self.template_ids = self.template_ids[keep]
+            self.template_matrix = self.template_matrix[keep] if self.template_matrix is not None else None
+            if len(templates) > 1:
+                self.template_ids = np.append(self.template_ids, [id_client] * len(templates))
+                self.template_matrix = templates if self.template_matrix is None \
+                    else np.vstack([self.template_matrix, templates])
+            position = np.flatnonzero(self.ids == id_client)
+            if len(position):
+                # Замена тоже через копию: поиск, взявший старую матрицу, не увидит полузаписанную строку
+                row = int(position[0])
+                matrix = self.matrix.copy()
+                matrix[row] = vector[0]
+            else:
+                row = len(self.ids)
+                self.ids = np.append(self.ids, id_client)
+                matrix = vector if self.matrix is None else np.vstack([self.matrix, vector])
+            self.matrix = matrix
+            if self.ivf is not None:
+                # Вектор попадает в ближайший кластер (и уходит из прежнего при замене)
+                self.ivf = self.ivf.assign([row], vector)
+            elif len(self.ids) >= self.ann_threshold:
+                self.ivf = IVFIndex(self.matrix)
+
+    def search(self, query, k=5, rerank=None):
+        """
+        Ищет k наиболее похожих клиентов: первый проход по центроидам, затем
+        rerank лучших кандидатов сравниваются с отдельными шаблонами.
+
+        :param query: эмбеддинг лица
+        :param k: количество кандидатов
+        :param rerank: сколько кандидатов проверять по шаблонам (по умолчанию rerank_top, 0 — только центроиды)
+        :return: список пар (id_client, сходство), отсортированный по убыванию сходства
+        """
+        rerank = self.rerank_top if rerank is None else rerank
+        candidates = self.search_centroids(query, max(k, rerank))
+        if rerank:
+            candidates = self.rescore(query, candidates, rerank)
+        return candidates[:k]
+
+    def rescore(self, query, candidates, top=None):
+        """
+        Второй проход: сходство top первых кандидатов — лучшее из сходства с центроидом
+        и с каждым шаблоном клиента. У клиентов с одним эмбеддингом сходство не меняется.
+
+        :param candidates: список пар (id_client, сходство) после первого прохода
+        :return: кандидаты, заново отсортированные по убыванию сходства
+        """
+        top = self.rerank_top if top is None else top
+        with self._lock:
+            template_ids, template_matrix = self.template_ids, self.template_matrix
+        if template_matrix is None or not len(template_ids) or not candidates or top <= 0:
+            return list(candidates)
+
+        head = [id_client for id_client, _ in candidates[:top]]
+        rows = np.flatnonzero(np.isin(template_ids, head))
+        if not len(rows):
+            return list(candidates)
+        scores = np.asarray(template_matrix[rows]) @ normalize(query)
+        best = {}
+        for id_client, score in zip(template_ids[rows].tolist(), scores.tolist()):
+            best[id_client] = max(best.get(id_client, score), score)
+        rescored = [(id_client, max(score, best.get(id_client, score))) for id_client, score in candidates[:top]]
+        rescored.sort(key=lambda candidate: -candidate[1])
+        return rescored + list(candidates[top:])
+
+    def search_centroids(self, query, k=5):
+        """
+        Первый проход: k ближайших клиентов по центроидам.
+
+        :return: список пар (id_client, сходство), отсортированный по убыванию сходства
+        """
+        with self._lock:
+            ids, matrix, ivf = self.ids, self.matrix, self.ivf
+        if matrix is None:
+            return []
+
+        query = normalize(query)
+        if ivf is not None:
+            rows = ivf.candidates(query, self.n_probe)
+            scores = matrix[rows] @ query
+            best = rows[top_k(scores, k)]
+            return [(int(ids[i]), float(matrix[i] @ query)) for i in best]
+
+        scores = matrix @ query
+        return [(int(ids[i]), float(scores[i])) for i in top_k(scores, k)]
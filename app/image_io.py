@@ -0,0 +1,32 @@
+"""
+Декодирование и преобразование изображений в памяти, без записи на диск.
+"""
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def decode_image(data):
+    """
+    Декодирует изображение (JPEG, PNG, ...) из байтов.
+
+    :param data: байты файла изображения
+    :return: изображение в формате numpy array (BGR) или None, если декодировать не удалось
+    """
+    if not data:
+        return None
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def encode_jpeg(frame, quality=95):
+    """Кодирует кадр (BGR) в байты JPEG"""
+    ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Не удалось закодировать изображение в JPEG")
+    return buffer.tobytes()
+
+
+def frame_to_pil(frame):
+    """Переводит кадр OpenCV (BGR) в PIL.Image (RGB) без записи на диск"""
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
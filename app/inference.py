@@ -0,0 +1,89 @@
+"""
+Пул потоков для тяжелой CV/ML работы (камера, Хаар, MTCNN, ResNet).
+async-эндпоинты отправляют задачи сюда, чтобы не блокировать event loop.
+Если очередь переполнена, задача сразу отклоняется (503), а не копится.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Количество потоков инференса
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 2))
+# Сколько задач может ждать в очереди сверх выполняющихся
+INFERENCE_QUEUE_LIMIT = int(os.getenv("INFERENCE_QUEUE_LIMIT", 8))
+# Количество intra-op потоков torch (0 — оставить значение по умолчанию)
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", 0))
+
+
+class InferenceBusyError(Exception):
+    """Пул инференса перегружен, запрос нужно повторить позже"""
+
+
+class InferenceExecutor:
+    """
+    Ограниченный пул потоков для инференса.
+
+    workers: количество потоков
+    queue_limit: максимальная длина очереди ожидающих задач
+    torch_threads: количество intra-op потоков torch
+    """
+
+    def __init__(self, workers=INFERENCE_WORKERS, queue_limit=INFERENCE_QUEUE_LIMIT,
+                 torch_threads=TORCH_THREADS):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.torch_threads = torch_threads
+        self._pool = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Создает пул потоков и настраивает потоки torch"""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        if self.torch_threads:
+            try:
+                import torch
+                torch.set_num_threads(self.torch_threads)
+            except ImportError:
+                pass
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    @property
+    def pending(self):
+        """Количество задач в работе и в очереди"""
+        return self._pending
+
+    @property
+    def queue_depth(self):
+        """Количество задач, ожидающих свободного потока"""
+        return max(0, self._pending - self.workers)
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Выполняет func(*args, **kwargs) в пуле и возвращает результат.
+        Если пул и очередь заполнены, бросает InferenceBusyError.
+        """
+        self.start()
+        with self._lock:
+            if self._pending >= self.workers + self.queue_limit:
+                raise InferenceBusyError("Сервер распознавания перегружен, повторите запрос позже")
+            self._pending += 1
+
+        # Счетчик уменьшается по завершении задачи в потоке, даже если клиент уже отключился
+        # Контекст копируется, чтобы замеры этапов попали в профиль текущего запроса
+        context = contextvars.copy_context()
+        future = self._pool.submit(context.run, partial(func, *args, **kwargs))
+        future.add_done_callback(self._task_done)
+        return await asyncio.wrap_future(future)
+
+    def _task_done(self, future):
+        with self._lock:
+            self._pending -= 1
@@ -0,0 +1,99 @@
+"""
+Профили CPU-инференса для InceptionResnetV1:
+- fp32 — исходная модель
+- int8-dynamic — динамическое квантование линейных слоев (калибровка не нужна).
+  В InceptionResnetV1 линейный слой один (last_linear), почти все вычисления —
+  свертки, которые остаются fp32, поэтому по скорости профиль почти не отличается от fp32
+- int8-static — статическое квантование всей сети, включая свертки (FX graph mode),
+  нужна калибровка на лицах; ускорение дает только этот профиль
+
+Сравнить скорость и отклонение эмбеддингов от fp32 можно скриптом
+    python -m app.quantization_eval <папка с фото>
+"""
+import copy
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+PROFILES = ("fp32", "int8-dynamic", "int8-static")
+
+# Профиль инференса по умолчанию
+INFERENCE_PROFILE = os.getenv("INFERENCE_PROFILE", "fp32")
+# Папка с фото для калибровки статического квантования
+FACENET_CALIBRATION_DIR = os.getenv("FACENET_CALIBRATION_DIR")
+# Количество inter-op потоков torch (0 — оставить значение по умолчанию)
+TORCH_INTEROP_THREADS = int(os.getenv("TORCH_INTEROP_THREADS", 0))
+
+
+def configure_threads(intra_op=0, inter_op=TORCH_INTEROP_THREADS):
+    """
+    Настраивает потоки torch. inter-op потоки можно задать только до первого параллельного вызова.
+    """
+    import torch
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            logger.warning("Количество inter-op потоков torch уже нельзя изменить")
+
+
+def quantize_dynamic(model):
+    """
+    int8 динамическое квантование линейных слоев.
+    Динамически квантуются только nn.Linear (свертки так не квантуются),
+    поэтому для InceptionResnetV1 это квантование одного last_linear.
+    """
+    import torch
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model, calibration_batches):
+    """
+    int8 статическое квантование (FX graph mode).
+
+    :param calibration_batches: список тензоров Nx3x160x160 с вырезанными лицами
+    """
+    import torch
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    backend = "x86" if "x86" in torch.backends.quantized.supported_engines else "fbgemm"
+    torch.backends.quantized.engine = backend
+    example = (calibration_batches[0],)
+    prepared = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(backend), example)
+    with torch.inference_mode():
+        for batch in calibration_batches:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def effective_profile(profile=INFERENCE_PROFILE, calibration_dir=FACENET_CALIBRATION_DIR):
+    """
+    Профиль, который будет применен на самом деле: int8-static без папки для калибровки
+    заменяется на int8-dynamic. От него зависит версия эмбеддингов, поэтому он известен до загрузки модели.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Неизвестный профиль инференса: {profile}")
+    if profile == "int8-static" and not calibration_dir:
+        return "int8-dynamic"
+    return profile
+
+
+def apply_profile(model, profile=INFERENCE_PROFILE, calibration_batches=None):
+    """
+    Возвращает модель для указанного профиля.
+    Если для int8-static нет калибровочных данных, используется int8-dynamic.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Неизвестный профиль инференса: {profile}")
+    if profile == "fp32":
+        return model
+    if profile == "int8-static":
+        if calibration_batches:
+            return quantize_static(model, calibration_batches)
+        logger.warning("Нет данных для калибровки, вместо int8-static используется int8-dynamic")
+    logger.warning("int8-dynamic квантует только линейные слои, свертки остаются fp32: ускорения почти нет")
+    return quantize_dynamic(model)
@@ -0,0 +1,152 @@
+"""
+Постраничный вывод и выгрузка клиентов.
+Страницы выбираются по ключу (keyset): следующая страница начинается после
+последней записи предыдущей, поэтому запрос идет по индексу и не сканирует
+пропущенные строки, как OFFSET. Сортировка идет по выражениям с coalesce
+(пустые значения — наименьшие), в курсор пишутся те же значения.
+"""
+import base64
+import csv
+import io
+import json
+from datetime import date
+
+from sqlalchemy import and_, or_, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.models import Person, MIDDLE_NAME_SORT_KEY, PAYMENT_DATE_SORT_KEY
+
+# Поля сортировки: название -> выражения без NULL (id_client добавляется в конец для однозначности)
+SORT_FIELDS = {
+    "id": (),
+    "name": (MIDDLE_NAME_SORT_KEY, Person.first_name),
+    "payment_date": (PAYMENT_DATE_SORT_KEY,),
+}
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+EXPORT_COLUMNS = (
+    Person.id_client, Person.first_name, Person.last_name, Person.middle_name, Person.birth_date,
+    Person.phone_number, Person.email, Person.payment_date, Person.payment_amount, Person.photo_path,
+)
+# Сколько строк читать из курсора БД за раз при выгрузке
+EXPORT_CHUNK_SIZE = 1000
+
+
+def encode_cursor(values):
+    """Кодирует значения ключа последней записи страницы в строку для URL"""
+    values = [value.isoformat() if isinstance(value, date) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, sort):
+    """Восстанавливает значения ключа из строки курсора"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("Некорректный курсор страницы")
+    if not isinstance(values, list) or len(values) != len(SORT_FIELDS[sort]) + 1:
+        raise ValueError("Курсор не соответствует сортировке")
+    # Последнее значение — id_client, остальные — строки (ключи сортировки не бывают NULL)
+    if type(values[-1]) is not int or not all(isinstance(value, str) for value in values[:-1]):
+        raise ValueError("Некорректный курсор страницы")
+    if sort == "payment_date":
+        values[0] = date.fromisoformat(values[0])
+    return values
+
+
+def apply_filters(query, not_paid=None, search=None, paid_from=None, paid_to=None):
+    """
+    Фильтры списка клиентов (выполняются в SQL).
+
+    :param not_paid: True — только неплательщики, False — только оплатившие
+    :param search: начало фамилии, имени, телефона или email
+    :param paid_from, paid_to: диапазон дат оплаты
+    """
+    if not_paid is True:
+        query = query.filter(Person.payment_amount == 0)
+    elif not_paid is False:
+        query = query.filter(Person.payment_amount != 0)
+    if search:
+        pattern = f"{search}%"
+        query = query.filter(or_(
+            Person.middle_name.like(pattern), Person.first_name.like(pattern),
+            Person.phone_number.like(pattern), Person.email.like(pattern),
+        ))
+    if paid_from is not None:
+        query = query.filter(Person.payment_date >= paid_from)
+    if paid_to is not None:
+        query = query.filter(Person.payment_date <= paid_to)
+    return query
+
+
+def page_persons(db: Session, sort="id", after=None, limit=DEFAULT_PAGE_SIZE, descending=False, **filters):
+    """
+    Одна страница клиентов.
+
+    :param sort: поле сортировки (id, name, payment_date)
+    :param after: курсор из предыдущей страницы (None — первая страница)
+    :param limit: размер страницы
+    :param descending: сортировка по убыванию
+    :return: (список клиентов, курсор следующей страницы или None)
+    """
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"Неизвестное поле сортировки: {sort}")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    columns = SORT_FIELDS[sort] + (Person.id_client,)
+    # Вместе с клиентом выбираются значения ключа сортировки: из них строится курсор
+    query = apply_filters(db.query(Person, *columns), **filters)
+
+    if after is not None:
+        key = tuple_(*columns) if len(columns) > 1 else columns[0]
+        values = decode_cursor(after, sort)
+        value = tuple_(*values) if len(columns) > 1 else values[0]
+        query = query.filter(key < value if descending else key > value)
+
+    order = [column.desc() if descending else column.asc() for column in columns]
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(list(rows[-1][1:]))
+    return [row[0] for row in rows], next_cursor
+
+
+def export_rows(db: Session, **filters):
+    """
+    Строки для выгрузки, читаются из курсора БД порциями, без загрузки всей таблицы.
+
+    :return: генератор кортежей значений EXPORT_COLUMNS
+    """
+    query = apply_filters(db.query(*EXPORT_COLUMNS), **filters).order_by(Person.id_client)
+    statement = query.statement.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE)
+    for partition in db.execute(statement).partitions():
+        yield from partition
+
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def export_csv(rows):
+    """Генератор CSV-текста порциями (с заголовком)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.key for column in EXPORT_COLUMNS])
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_jsonable(value) for value in row])
+        if i % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_ndjson(rows):
+    """Генератор NDJSON: по одному JSON-объекту на строку"""
+    keys = [column.key for column in EXPORT_COLUMNS]
+    for row in rows:
+        yield json.dumps({key: _jsonable(value) for key, value in zip(keys, row)}, ensure_ascii=False) + "\n"
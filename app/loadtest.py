@@ -0,0 +1,535 @@
+"""
+Нагрузочное тестирование: несколько киосков одновременно отправляют запросы
+верификации и регистрации клиентов.
+
+Киоск в цикле выбирает запрос по заданной доле (верификация по фото с киоска,
+регистрация, верификация по камере сервера), отправляет его, ждет ответ и паузу.
+Количество киосков увеличивается ступенями; для каждой ступени считаются
+пропускная способность, p50/p95/p99 задержки по эндпоинтам и доля ошибок.
+Точка насыщения — первая ступень, на которой пропускная способность почти
+перестала расти, p95 превысил SLO или выросла доля ошибок (в том числе 503
+из-за переполнения очереди инференса).
+
+Кадры берутся из папки с изображениями или видеофайла (--frames), иначе
+генерируются. Без --url приложение запускается в этом же процессе (uvicorn в
+отдельном потоке) с временной БД, в которой заранее создается галерея
+заданного размера, а вместо камеры сервера используется папка с теми же кадрами.
+С --url регистрации навсегда добавили бы тестовых клиентов в БД этого сервера,
+поэтому enroll_upload исключается из долей, если не указан --allow-enroll.
+С --synthetic-model MTCNN и ResNet заменяются случайной проекцией (как в
+app.benchmark): так можно измерить HTTP, БД и поиск по галерее без весов модели.
+
+Запуск:
+    python -m app.loadtest --synthetic-model --gallery-size 10000 --kiosks 1 2 4 8 16 --duration 20
+    python -m app.loadtest --url http://127.0.0.1:8000 --frames photos/ --kiosks 4 8 16 32
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import socket
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+from app.benchmark import synthetic_frame, seed_database, RandomEmbedder, git_commit
+from app.camera import IMAGE_EXTENSIONS
+from app.gallery_index import normalize
+
+# Эндпоинты, которые вызывает киоск
+ENDPOINTS = {
+    "verify_upload": "/persons/verify_faces/upload/",
+    "enroll_upload": "/persons/capture_face_upload/",
+    "verify_camera": "/persons/verify_faces/",
+}
+DEFAULT_MIX = "verify_upload=0.8,enroll_upload=0.1,verify_camera=0.1"
+# Номер первого узора для лиц новых клиентов (дальше номеров кадров киосков)
+NEW_FACE_START = 1_000_000
+
+
+def parse_mix(text):
+    """'verify_upload=0.8,enroll_upload=0.2' -> словарь долей запросов (сумма 1)"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Неизвестный запрос {name}, доступны: {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("Сумма долей запросов должна быть больше 0")
+    return {name: weight / total for name, weight in mix.items()}
+
+
+def target_mix(mix, remote, allow_enroll=False):
+    """
+    Доли запросов для цели нагрузки: на внешнем сервере (remote) регистрации
+    выключены, если их явно не разрешили, — они оставляют клиентов в его БД.
+
+    :param mix: словарь долей из parse_mix
+    :return: словарь долей (сумма 1)
+    """
+    if not remote or allow_enroll or "enroll_upload" not in mix:
+        return mix
+    mix = {name: weight for name, weight in mix.items() if name != "enroll_upload"}
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("Без enroll_upload не осталось запросов: укажите --allow-enroll или другой --mix")
+    return {name: weight / total for name, weight in mix.items()}
+
+
+def load_frames(source, limit=64):
+    """
+    Кадры в JPEG из папки с изображениями или видеофайла.
+
+    :return: список байтов JPEG
+    """
+    frames = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS and len(frames) < limit:
+                with open(os.path.join(source, name), "rb") as f:
+                    frames.append(f.read())
+    else:
+        capture = cv2.VideoCapture(source)
+        while len(frames) < limit:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(cv2.imencode(".jpg", frame)[1].tobytes())
+        capture.release()
+    if not frames:
+        raise ValueError(f"В {source} нет кадров")
+    return frames
+
+
+def generated_frames(count, width=1280, height=720, start=0):
+    """
+    Сгенерированные кадры в JPEG (как в app.benchmark), у каждого кадра свой узор
+    в центре, чтобы разные кадры давали разные эмбеддинги.
+
+    :param start: номер первого узора (кадры с разными номерами не повторяются)
+    """
+    frames = []
+    for i in range(start, start + count):
+        frame = synthetic_frame(width, height, seed=i)
+        pattern = np.random.default_rng(10000 + i).integers(0, 255, (6, 6, 3), dtype=np.uint8)
+        side = min(width, height) // 4
+        top, left = height // 2 - side // 2, width // 2 - side // 2
+        frame[top:top + side, left:left + side] = cv2.resize(pattern, (side, side), interpolation=cv2.INTER_NEAREST)
+        frames.append(cv2.imencode(".jpg", frame)[1].tobytes())
+    return frames
+
+
+def new_face(number):
+    """Кадр с лицом нового клиента: узоры не пересекаются с кадрами киосков и галереи"""
+    return generated_frames(1, start=NEW_FACE_START + number)[0]
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 1) if values else None
+
+
+class Recorder:
+    """Задержки и коды ответов по эндпоинтам"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint, latency_ms, status):
+        self.latencies[endpoint].append(latency_ms)
+        self.statuses[endpoint][status] += 1
+
+    def summary(self, kiosks, elapsed):
+        """
+        Итоги ступени.
+        Ошибки — коды 5xx (кроме 503) и сбои соединения; 503 — запрос отклонен из-за переполнения очереди.
+        """
+        requests = sum(len(values) for values in self.latencies.values())
+        errors = shed = 0
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            statuses = dict(self.statuses[endpoint])
+            errors += sum(count for status, count in statuses.items() if status == "error" or
+                          (isinstance(status, int) and status >= 500 and status != 503))
+            shed += statuses.get(503, 0)
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "per_second": round(len(values) / elapsed, 2),
+                "p50_ms": percentile(values, 50),
+                "p95_ms": percentile(values, 95),
+                "p99_ms": percentile(values, 99),
+                "max_ms": round(max(values), 1),
+                "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+            }
+        all_values = [value for values in self.latencies.values() for value in values]
+        return {
+            "kiosks": kiosks,
+            "seconds": round(elapsed, 1),
+            "requests": requests,
+            "throughput_rps": round((requests - errors - shed) / elapsed, 2),
+            "error_rate": round(errors / requests, 4) if requests else 0.0,
+            "shed_rate": round(shed / requests, 4) if requests else 0.0,
+            "p50_ms": percentile(all_values, 50),
+            "p95_ms": percentile(all_values, 95),
+            "p99_ms": percentile(all_values, 99),
+            "endpoints": endpoints,
+        }
+
+
+class Kiosk:
+    """
+    Симулированный киоск: отправляет запросы по очереди, пока не выйдет время.
+
+    number: номер киоска (для уникальных телефонов и email при регистрации)
+    frames: кадры в JPEG, киоск берет их по кругу со своего смещения
+    new_face: функция номер -> кадр с новым лицом для регистрации; если не задана,
+              регистрация отправляет кадры киоска (повторные регистрации получат 409)
+    """
+
+    sequence = itertools.count(1)
+
+    def __init__(self, number, frames, mix, frames_per_request=3, think_ms=500, seed=0, new_face=None):
+        self.number = number
+        self.frames = frames
+        self.new_face = new_face
+        self.mix = mix
+        self.frames_per_request = frames_per_request
+        self.think = think_ms / 1000
+        self.rng = np.random.default_rng(seed * 1000 + number)
+        self.position = number * 7
+        self.enrolled = 0
+
+    def next_frames(self, count):
+        frames = [self.frames[(self.position + i) % len(self.frames)] for i in range(count)]
+        self.position += count
+        return frames
+
+    def request(self, endpoint):
+        """Параметры httpx для запроса"""
+        if endpoint == "verify_upload":
+            files = [("frames", (f"frame{i}.jpg", data, "image/jpeg"))
+                     for i, data in enumerate(self.next_frames(self.frames_per_request))]
+            return {"files": files}
+        if endpoint == "enroll_upload":
+            self.enrolled += 1
+            # Телефон и email уникальны по всем киоскам и ступеням
+            sequence = next(Kiosk.sequence)
+            suffix = f"{sequence:010d}"
+            form = {
+                "first_name": "Нагрузка", "last_name": "Тестовна", "middle_name": "Киоскова",
+                "birth_date": "1990-01-01", "phone_number": f"+9{suffix}",
+                "email": f"load{suffix}@example.com", "payment_date": "2025-01-01", "payment_amount": "1500",
+            }
+            frame = self.new_face(sequence) if self.new_face else self.next_frames(1)[0]
+            return {"data": form, "files": [("frames", ("frame.jpg", frame, "image/jpeg"))]}
+        return {}
+
+    async def run(self, client, deadline, recorder):
+        names, weights = list(self.mix), list(self.mix.values())
+        # Киоски стартуют не одновременно, как в реальном зале
+        await asyncio.sleep(self.rng.uniform(0, self.think))
+        while time.monotonic() < deadline:
+            endpoint = names[self.rng.choice(len(names), p=weights)]
+            start = time.perf_counter()
+            try:
+                response = await client.post(ENDPOINTS[endpoint], **self.request(endpoint))
+                status = response.status_code
+            except Exception:
+                status = "error"
+            recorder.record(endpoint, (time.perf_counter() - start) * 1000, status)
+            if self.think:
+                await asyncio.sleep(self.think)
+
+
+async def run_level(base_url, kiosks, duration, frames, mix, frames_per_request, think_ms, seed=0,
+                    new_face=None):
+    """Одна ступень нагрузки: kiosks киосков в течение duration секунд"""
+    import httpx
+
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=kiosks, max_keepalive_connections=kiosks)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        start = time.monotonic()
+        deadline = start + duration
+        await asyncio.gather(*(
+            Kiosk(number, frames, mix, frames_per_request, think_ms, seed, new_face).run(client, deadline, recorder)
+            for number in range(kiosks)
+        ))
+        elapsed = time.monotonic() - start
+    return recorder.summary(kiosks, elapsed)
+
+
+def find_saturation(levels, slo_ms, min_gain=0.1, max_error_rate=0.01):
+    """
+    Точка насыщения по результатам ступеней.
+
+    :param slo_ms: допустимый p95 задержки
+    :param min_gain: минимальный относительный рост пропускной способности между ступенями
+    :return: словарь: сколько киосков сервер выдерживает, на какой ступени насыщение и почему
+    """
+    best = None
+    for previous, level in zip([None] + levels[:-1], levels):
+        reason = None
+        if level["error_rate"] + level["shed_rate"] > max_error_rate:
+            reason = f"ошибки и отказы {100 * (level['error_rate'] + level['shed_rate']):.1f}%"
+        elif level["p95_ms"] is not None and level["p95_ms"] > slo_ms:
+            reason = f"p95 {level['p95_ms']} мс больше SLO {slo_ms} мс"
+        elif previous is not None and level["throughput_rps"] < previous["throughput_rps"] * (1 + min_gain):
+            reason = (f"пропускная способность {level['throughput_rps']} запросов/с "
+                      f"против {previous['throughput_rps']} на прошлой ступени")
+        if reason is not None:
+            return {
+                "max_kiosks": best["kiosks"] if best else None,
+                "max_throughput_rps": best["throughput_rps"] if best else None,
+                "saturated_at": level["kiosks"],
+                "reason": reason,
+            }
+        best = level
+    return {
+        "max_kiosks": best["kiosks"] if best else None,
+        "max_throughput_rps": best["throughput_rps"] if best else None,
+        "saturated_at": None,
+        "reason": "насыщение не достигнуто, добавьте ступени с большим количеством киосков",
+    }
+
+
+def seed_gallery(path, size, model_version, known_vectors=()):
+    """
+    Создает БД с size клиентами и их эмбеддингами (случайными векторами).
+
+    :param known_vectors: эмбеддинги кадров, которые получают первые клиенты (чтобы верификация находила совпадения)
+    """
+    from sqlalchemy import insert
+    from app.embedding_store import embedding_to_bytes
+    from app.models import FaceEmbedding
+
+    db = seed_database(path, size)
+    rng = np.random.default_rng(4)
+    known_vectors = list(known_vectors)
+    for offset in range(0, size, 10000):
+        count = min(10000, size - offset)
+        vectors = normalize(rng.normal(size=(count, 512)))
+        for i in range(count):
+            if offset + i < len(known_vectors):
+                vectors[i] = known_vectors[offset + i]
+        db.execute(insert(FaceEmbedding), [
+            {"id_client": offset + i + 1, "model_version": model_version, "vector": embedding_to_bytes(vectors[i])}
+            for i in range(count)
+        ])
+        db.commit()
+    db.close()
+
+
+def install_synthetic_model(main, embedder):
+    """
+    Заменяет MTCNN и ResNet в приложении случайной проекцией RandomEmbedder.
+    Хаар выполняется как обычно (его время входит в замер), но всегда сообщает о лице;
+    батчирование, кэш и поиск по галерее работают как в настоящем приложении.
+    """
+    from app.faceNet_try import FaceDetection
+
+    recognizer = main.face_recognizer
+
+    def detect(images):
+        detections = []
+        for image in images:
+            frame = np.asarray(image)
+            h, w = frame.shape[:2]
+            side = min(h, w) // 2
+            crop = cv2.resize(frame[h // 2 - side // 2:h // 2 + side // 2, w // 2 - side // 2:w // 2 + side // 2],
+                              (160, 160))
+            detection = FaceDetection(np.array([w // 4, h // 4, 3 * w // 4, 3 * h // 4]), None, 1.0, crop)
+            detection._crop = crop
+            detections.append(detection)
+        return detections
+
+    recognizer.detect = detect
+    recognizer.embed_faces = lambda faces: list(embedder.embed_crops(list(faces)))
+    recognizer.batcher.embed_fn = recognizer.embed_faces
+    recognizer.ready = True
+
+    find_faces = main.detector.find_faces
+
+    def always_face(image, *args, **kwargs):
+        faces = find_faces(image, *args, **kwargs)
+        return faces if len(faces) else np.array([[0, 0, image.shape[1], image.shape[0]]])
+
+    main.detector.find_faces = always_face
+
+
+def synthetic_vectors(embedder, frames):
+    """Эмбеддинги кадров так, как их посчитает install_synthetic_model"""
+    crops = []
+    for data in frames:
+        frame = cv2.cvtColor(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+        h, w = frame.shape[:2]
+        side = min(h, w) // 2
+        crops.append(cv2.resize(frame[h // 2 - side // 2:h // 2 + side // 2, w // 2 - side // 2:w // 2 + side // 2],
+                                (160, 160)))
+    return embedder.embed_crops(crops)
+
+
+class InProcessServer:
+    """Приложение в uvicorn в отдельном потоке этого процесса"""
+
+    def __init__(self, app):
+        import uvicorn
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, name="loadtest-uvicorn", daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Не удалось запустить приложение")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def prepare_in_process(tmp_dir, args, frames):
+    """
+    Готовит окружение и импортирует приложение: временная БД с галереей,
+    папка с кадрами вместо камеры, папка для фото регистраций.
+    Переменные окружения задаются до импорта app.main, так как модули читают их при импорте.
+    """
+    frame_dir = os.path.join(tmp_dir, "camera")
+    os.makedirs(frame_dir)
+    for i, data in enumerate(frames):
+        with open(os.path.join(frame_dir, f"{i:05d}.jpg"), "wb") as f:
+            f.write(data)
+
+    database_path = os.path.join(tmp_dir, "loadtest.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database_path}"
+    if args.synthetic_model:
+        os.environ["FACENET_PRELOAD"] = "0"
+
+    from app.faceNet_try import FaceNetVerify
+
+    embedder = RandomEmbedder() if args.synthetic_model else None
+    # Люди с половины кадров киосков уже зарегистрированы (верификация их находит),
+    # с другой половины — нет (верификация проходит все кадры, регистрация сохраняет клиента)
+    known = synthetic_vectors(embedder, frames[:min(len(frames) // 2, args.gallery_size)]) if embedder else ()
+    seed_gallery(database_path, args.gallery_size, FaceNetVerify().model_version, known)
+
+    from app import main
+    from app.photo_store import PhotoStore
+
+    # Фото и кропы регистраций — во временную папку, а не в static приложения
+    main.BASE_DIR = tmp_dir
+    main.photo_store = PhotoStore(tmp_dir)
+    # Камера сервера — папка с кадрами киосков
+    main.capture_service.source = frame_dir
+    if args.no_cache:
+        main.embedding_cache.max_bytes = 0
+    if embedder is not None:
+        install_synthetic_model(main, embedder)
+    return main.app
+
+
+def run_levels(base_url, args, frames, mix):
+    # Для сгенерированных кадров у каждой регистрации новое лицо; лица из папки или видео повторяются
+    face_source = None if args.frames else new_face
+    levels = []
+    for kiosks in args.kiosks:
+        level = asyncio.run(run_level(base_url, kiosks, args.duration, frames, mix,
+                                      args.frames_per_request, args.think_ms, args.seed, face_source))
+        levels.append(level)
+        print(f"киосков {kiosks:>4}: {level['throughput_rps']:>8.2f} запросов/с, p50 {level['p50_ms']} мс, "
+              f"p95 {level['p95_ms']} мс, p99 {level['p99_ms']} мс, ошибки {100 * level['error_rate']:.1f}%, "
+              f"отказы 503 {100 * level['shed_rate']:.1f}%")
+    return levels
+
+
+def print_endpoints(levels):
+    print(f"\n{'киоски':>6} {'эндпоинт':<15} {'запросов':>9} {'в сек':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}  коды")
+    for level in levels:
+        for endpoint, stats in level["endpoints"].items():
+            print(f"{level['kiosks']:>6} {endpoint:<15} {stats['requests']:>9} {stats['per_second']:>8.2f} "
+                  f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}  {stats['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование с симулированными киосками")
+    parser.add_argument("--url", help="адрес запущенного приложения (по умолчанию запускается в этом процессе)")
+    parser.add_argument("--kiosks", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="ступени: количество киосков")
+    parser.add_argument("--duration", type=float, default=20, help="длительность ступени, секунды")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="доли запросов, например verify_upload=0.9,enroll_upload=0.1")
+    parser.add_argument("--allow-enroll", action="store_true",
+                        help="отправлять регистрации на сервер из --url (клиенты останутся в его БД)")
+    parser.add_argument("--think-ms", type=float, default=500, help="пауза киоска между запросами")
+    parser.add_argument("--frames", help="папка с изображениями или видеофайл (по умолчанию кадры генерируются)")
+    parser.add_argument("--frame-count", type=int, default=64, help="сколько разных кадров использовать")
+    parser.add_argument("--frames-per-request", type=int, default=3, help="кадров в одном запросе верификации")
+    parser.add_argument("--gallery-size", type=int, default=10000, help="клиентов в галерее (без --url)")
+    parser.add_argument("--synthetic-model", action="store_true",
+                        help="случайная проекция вместо MTCNN и ResNet (без --url)")
+    parser.add_argument("--no-cache", action="store_true", help="выключить кэш эмбеддингов (без --url)")
+    parser.add_argument("--slo-ms", type=float, default=1000, help="допустимый p95 задержки")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="файл для результатов в JSON")
+    args = parser.parse_args()
+
+    requested_mix = parse_mix(args.mix)
+    mix = target_mix(requested_mix, remote=bool(args.url), allow_enroll=args.allow_enroll)
+    if mix is not requested_mix:
+        print("Регистрации на внешнем сервере выключены (включить: --allow-enroll)")
+    frames = load_frames(args.frames, args.frame_count) if args.frames else generated_frames(args.frame_count)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.url:
+            levels = run_levels(args.url, args, frames, mix)
+        else:
+            app = prepare_in_process(tmp_dir, args, frames)
+            with InProcessServer(app) as server:
+                levels = run_levels(server.url, args, frames, mix)
+
+    saturation = find_saturation(levels, args.slo_ms)
+    print_endpoints(levels)
+    print(f"\nВыдерживает киосков: {saturation['max_kiosks']} "
+          f"({saturation['max_throughput_rps']} запросов/с); насыщение: {saturation['reason']}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "target": args.url or "in-process",
+            "synthetic_model": args.synthetic_model,
+            "gallery_size": None if args.url else args.gallery_size,
+            "mix": mix,
+            "think_ms": args.think_ms,
+            "duration": args.duration,
+            "slo_ms": args.slo_ms,
+        },
+        "levels": levels,
+        "saturation": saturation,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,43 @@
 import os
-import cv2
-from fastapi import FastAPI, Depends, HTTPException, Request, Form
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Depends, HTTPException, Request, Form, File, UploadFile, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, Response, PlainTextResponse
 from sqlalchemy.orm import Session
 from starlette.responses import JSONResponse
-from starlette.staticfiles import StaticFiles
 from starlette.templating import Jinja2Templates
-from app.database import SessionLocal, init_db
+from app.database import SessionLocal, AsyncSessionLocal, init_db
 from app.models import Person, PersonFactory
 from pydantic import BaseModel
 from datetime import date
 from pathlib import Path
+import asyncio
 import io
-import matplotlib.pyplot as plt
+import shutil
+import time
+import tempfile
+import zipfile
 from fastapi.responses import StreamingResponse
-from app.face_detector import FaceDetectorHaar
+from app.face_detector import FaceDetectorHaar, FaceTracker
+from app.duplicates import find_duplicate, duplicate_report, DUPLICATE_ACTION, DUPLICATE_THRESHOLD
 from app.faceNet_try import FaceNetVerify
+from app.embedding_store import (save_templates, save_crops, missing_embeddings_query, load_gallery,
+                                 count_gallery_clients)
+from app.gallery_index import centroid
+from app.reindex import ReindexJob
+from app.image_io import decode_image, frame_to_pil
+from app.frame_pipeline import VerificationPipeline, PREFILTER_WIDTH
+from app.verify_policy import VerificationPolicy, VERIFY_THRESHOLD
+from app.stream import StreamSession, LatestFrame
+from app.embedding_cache import embedding_cache
+from app.photo_store import PhotoStore, CachedStaticFiles, thumbnail_url
+from app.inference import InferenceExecutor, InferenceBusyError
+from app.camera import CaptureService, CameraError
+from app.stats import dashboard_stats, query_monthly_breakdown, query_monthly_breakdown_async
+from app.metrics import (REGISTRY, REQUESTS, REQUEST_SECONDS, FRAMES, NO_FACE_FRAMES, VERIFICATIONS, STREAM_DROPPED,
+                         stage, start_profile, server_timing)
+from app.bulk_import import import_persons, read_records, PhotoSource
+from app.listing import page_persons, export_rows, export_csv, export_ndjson, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
 
 # Путь к папке с фото
@@ -24,13 +46,39 @@ PHOTO_DIR = "static/photo"
 # Экземпляр детектора
 detector = FaceDetectorHaar()
 
-# Экземпляр для сравнения фото
+# Экземпляр для сравнения фото (модели загружаются при старте в фоне или при первом обращении)
 face_recognizer = FaceNetVerify()
 
+# Загружать и прогревать модели при старте приложения, а не на первом запросе
+FACENET_PRELOAD = os.getenv("FACENET_PRELOAD", "1") == "1"
+
+# Пороги решения при верификации (VERIFY_THRESHOLD, VERIFY_STRONG_THRESHOLD, VERIFY_REJECT_THRESHOLD, VERIFY_MARGIN)
+verify_policy = VerificationPolicy()
+# Сколько кандидатов возвращать при верификации
+VERIFY_TOP_K = 5
+# Сколько кадров одного запроса отправлять в модель одним батчем
+VERIFY_FRAME_BATCH = 4
+# Сколько кадров с лицом сохранять как шаблоны клиента при регистрации
+ENROLL_TEMPLATES = int(os.getenv("ENROLL_TEMPLATES", 3))
+# Сколько кадров после первого лица просматривать в поисках остальных шаблонов
+ENROLL_TEMPLATE_FRAMES = int(os.getenv("ENROLL_TEMPLATE_FRAMES", 15))
+
+# Пул потоков для камеры и инференса, чтобы не блокировать event loop
+inference_executor = InferenceExecutor()
+
+# Общий сервис захвата кадров: камера открывается один раз при старте приложения
+capture_service = CaptureService()
+
 app = FastAPI()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Фоновый пересчет эмбеддингов для клиентов без вектора текущей модели
+reindex_job = ReindexJob(SessionLocal, face_recognizer, BASE_DIR)
+# Версия модели, для которой уже проверено, есть ли фото без эмбеддингов
+# (проверка — антиджойн по всем клиентам, на каждом запросе ее не повторяем)
+missing_embeddings_checked = {"model_version": None}
+
 # Получаем абсолютный путь к папке с файлами
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")  # Путь до папки с шаблонами
 STATIC_DIR = os.path.join(BASE_DIR, "static")
@@ -45,8 +93,13 @@ PHOTO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "
 if not os.path.exists(PHOTO_DIR):
     os.makedirs(PHOTO_DIR)
 
+# Фото клиентов сохраняются по хэшу содержимого вместе с уменьшенными копиями
+photo_store = PhotoStore(BASE_DIR)
+templates.env.filters["thumbnail"] = thumbnail_url
+
+
 # Монтируем статические файлы
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 
 app.add_middleware(
     CORSMiddleware,
@@ -58,6 +111,109 @@ app.add_middleware(
 
 
 
+@app.on_event("startup")
+def start_inference():
+    inference_executor.start()
+    capture_service.start()
+    if FACENET_PRELOAD:
+        # Загрузка в фоне: приложение сразу отвечает, готовность видна на /health/ready
+        face_recognizer.start_warmup()
+
+
+@app.on_event("shutdown")
+def stop_inference():
+    reindex_job.stop(timeout=5)
+    capture_service.stop()
+    inference_executor.shutdown()
+
+
+# Метрики, значения которых считываются в момент запроса /metrics
+REGISTRY.gauge("inference_queue_depth", "Задачи, ожидающие свободного потока инференса",
+               lambda: inference_executor.queue_depth)
+REGISTRY.gauge("inference_pending", "Задачи инференса в работе и в очереди", lambda: inference_executor.pending)
+REGISTRY.gauge("gallery_size", "Количество клиентов в индексе галереи", lambda: len(face_recognizer.gallery))
+REGISTRY.gauge("embedding_cache_hits", "Попадания в кэш эмбеддингов", lambda: embedding_cache.hits)
+REGISTRY.gauge("embedding_cache_misses", "Промахи кэша эмбеддингов", lambda: embedding_cache.misses)
+REGISTRY.gauge("embedding_cache_bytes", "Память, занятая кэшем эмбеддингов", lambda: embedding_cache.bytes)
+REGISTRY.gauge("embedding_mean_batch_size", "Средний размер батча ResNet",
+               lambda: face_recognizer.batcher.mean_batch_size)
+
+
+@app.middleware("http")
+async def collect_metrics(request: Request, call_next):
+    # При заголовке X-Profile: 1 разбивка по этапам возвращается в Server-Timing
+    profile = start_profile() if request.headers.get("x-profile") == "1" else None
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    # Путь берется из шаблона маршрута, чтобы не плодить метки на каждый URL
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    REQUESTS.inc(method=request.method, path=path, status=response.status_code)
+    REQUEST_SECONDS.observe(elapsed, method=request.method, path=path)
+    if profile is not None:
+        response.headers["Server-Timing"] = server_timing(profile + [("total", elapsed)])
+    return response
+
+
+@app.get("/metrics")
+def metrics():
+    """Метрики в формате Prometheus"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.exception_handler(InferenceBusyError)
+def inference_busy_handler(request: Request, exc: InferenceBusyError):
+    # Пул инференса и очередь заполнены — просим клиента повторить запрос позже
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
+@app.get("/health/ready")
+def readiness():
+    """
+    Готовность инференса: 200, когда модели загружены и прогреты, иначе 503.
+    При FACENET_PRELOAD=0 модели загружаются первым запросом, поэтому ответ 200 и до загрузки.
+    """
+    ready, status = face_recognizer.readiness(FACENET_PRELOAD)
+    status["camera"] = capture_service.running
+    return JSONResponse(status_code=200 if ready else 503, content=status)
+
+
+@app.post("/admin/reindex")
+def start_reindex():
+    """Запускает фоновый пересчет эмбеддингов для клиентов без вектора текущей модели"""
+    if not reindex_job.start():
+        raise HTTPException(status_code=409, detail="Пересчет эмбеддингов уже идет")
+    return JSONResponse(status_code=202, content=reindex_job.progress())
+
+
+@app.get("/admin/reindex")
+def reindex_progress():
+    """Прогресс пересчета эмбеддингов: обработано, скорость, оценка оставшегося времени"""
+    return reindex_job.progress()
+
+
+@app.get("/admin/cache")
+def cache_stats():
+    """Состояние кэша эмбеддингов: записи, память, попадания и промахи"""
+    return embedding_cache.stats()
+
+
+@app.delete("/admin/cache")
+def clear_cache():
+    """Очищает кэш эмбеддингов"""
+    embedding_cache.clear()
+    return embedding_cache.stats()
+
+
+@app.get("/admin/duplicates")
+def duplicates_report(threshold: float = DUPLICATE_THRESHOLD):
+    """Группы клиентов с похожими лицами (возможные дубликаты) по всем эмбеддингам"""
+    with SessionLocal() as db:
+        return duplicate_report(db, face_recognizer.model_version, threshold)
+
+
 # Pydantic-модель для создания пользователя
 class PersonCreate(BaseModel):
     first_name: str
@@ -73,6 +229,24 @@ class PersonCreate(BaseModel):
     class Config:
         from_attributes = True
 
+def ensure_gallery(db: Session):
+    """
+    Строит индекс галереи из БД (один раз, дальше он обновляется при сохранении фото).
+    Если есть фото без эмбеддингов, один раз после старта (и после смены версии модели)
+    запускает их пересчет в фоне — запрос его не ждет. Повторно пересчет запускается
+    через POST /admin/reindex.
+    """
+    with stage("db_query"):
+        gallery = face_recognizer.gallery
+        # Общий индекс в файлах мог уже построить другой воркер
+        if not gallery.built and not gallery.attach(count_gallery_clients(db, face_recognizer.model_version)):
+            gallery.build(load_gallery(db, face_recognizer.model_version))
+        model_version = face_recognizer.model_version
+        if missing_embeddings_checked["model_version"] != model_version:
+            missing_embeddings_checked["model_version"] = model_version
+            if not reindex_job.running and db.query(missing_embeddings_query(db, model_version).exists()).scalar():
+                reindex_job.start()
+
 # Фиксируем подключение к БД
 def get_db():
     db = SessionLocal()
@@ -106,18 +280,9 @@ def create_person(person: PersonCreate, db: Session = Depends(get_db)):
     return db_person
 """
 
-@app.post("/persons/")
-def create_person(
-    first_name: str = Form(...),
-    last_name: str = Form(...),
-    middle_name: str = Form(...),
-    birth_date: str = Form(...),
-    phone_number: str = Form(...),
-    email: str = Form(...),
-    payment_date: str = Form(...),
-    payment_amount: float = Form(...),
-    db: Session = Depends(get_db)
-):
+def validate_person_form(first_name, last_name, middle_name, birth_date,
+                         phone_number, email, payment_date, payment_amount):
+    """Проверяет данные клиента из формы и возвращает PersonCreate"""
     # Проверка дат
     try:
         birth_date = date.fromisoformat(birth_date)
@@ -144,11 +309,30 @@ def create_person(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    return person_data
+
+@app.post("/persons/")
+def create_person(
+    first_name: str = Form(...),
+    last_name: str = Form(...),
+    middle_name: str = Form(...),
+    birth_date: str = Form(...),
+    phone_number: str = Form(...),
+    email: str = Form(...),
+    payment_date: str = Form(...),
+    payment_amount: float = Form(...),
+    db: Session = Depends(get_db)
+):
+    person_data = validate_person_form(first_name, last_name, middle_name, birth_date,
+                                       phone_number, email, payment_date, payment_amount)
+
     # Используем фабрику для создания объекта
     db_person = PersonFactory.create_person(person_data)
-    db.add(db_person)
-    db.commit()
-    db.refresh(db_person)
+    with stage("commit"):
+        db.add(db_person)
+        db.commit()
+        db.refresh(db_person)
+    dashboard_stats.on_person_added(db_person.payment_amount)
     return db_person
 
 """
@@ -166,76 +350,369 @@ def get_all_persons(db: Session = Depends(get_db)):
     return result
 """
 
+def list_filters(
+        not_paid: Optional[bool] = None,
+        q: Optional[str] = None,
+        paid_from: Optional[date] = None,
+        paid_to: Optional[date] = None,
+):
+    """Общие фильтры списка клиентов из параметров запроса"""
+    return {"not_paid": not_paid, "search": q, "paid_from": paid_from, "paid_to": paid_to}
+
+
+def get_page(db: Session, sort, after, limit, desc, filters):
+    """Страница клиентов, ошибка 400 при неверной сортировке или курсоре"""
+    try:
+        with stage("db_query"):
+            return page_persons(db, sort=sort, after=after, limit=limit, descending=desc, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.get("/persons/")  # URL для отображения списка пользователей
-def show_persons_list(request: Request, db: Session = Depends(get_db)):
-    # Получаем всех пользователей из базы данных
-    persons = db.query(Person).all()
+def show_persons_list(
+        request: Request,
+        sort: str = "id",
+        after: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        desc: bool = False,
+        filters: dict = Depends(list_filters),
+        db: Session = Depends(get_db)
+):
+    # Получаем одну страницу пользователей из базы данных
+    persons, next_cursor = get_page(db, sort, after, limit, desc, filters)
+    next_url = str(request.url.include_query_params(after=next_cursor)) if next_cursor else None
 
     # Передаем данные в шаблон для рендеринга
-    return templates.TemplateResponse("persons_list.html", {"request": request, "persons": persons})
+    return templates.TemplateResponse("persons_list.html", {
+        "request": request, "persons": persons, "next_url": next_url, "filters": filters, "sort": sort
+    })
 
-@app.post("/persons/capture_face_show/")
-async def capture_face_and_save(
-        person: PersonCreate,  # Данные о человеке из тела запроса
+
+@app.get("/api/persons")
+def get_persons_page(
+        sort: str = "id",
+        after: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        desc: bool = False,
+        filters: dict = Depends(list_filters),
         db: Session = Depends(get_db)
 ):
-    # Открываем камеру (0 — это индекс камеры по умолчанию)
-    cap = cv2.VideoCapture(0)
+    """Страница клиентов в JSON; следующая страница запрашивается с after=next_cursor"""
+    persons, next_cursor = get_page(db, sort, after, limit, desc, filters)
+    return {
+        "items": [dict(PersonCreate.model_validate(person).model_dump(), id=person.id_client,
+                       photo_url=person.photo_path, thumbnail_url=thumbnail_url(person.photo_path))
+                  for person in persons],
+        "next_cursor": next_cursor
+    }
+
+
+@app.get("/persons/export")
+def export_persons(format: str = "csv", filters: dict = Depends(list_filters)):
+    """
+    Выгрузка клиентов в CSV или NDJSON потоком, строки читаются из курсора БД порциями.
+    """
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Поддерживаются форматы csv и ndjson")
+
+    def generate():
+        # Своя сессия: поток продолжается после выхода из эндпоинта
+        db = SessionLocal()
+        try:
+            rows = export_rows(db, **filters)
+            yield from export_csv(rows) if format == "csv" else export_ndjson(rows)
+        finally:
+            db.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(generate(), media_type=media_type, headers={
+        "Content-Disposition": f"attachment; filename=persons.{format}"
+    })
 
-    if not cap.isOpened():
-        raise HTTPException(status_code=500, detail="Не удалось открыть камеру")
 
-    db_person = None  # Переменная для хранения записи о человеке
+def camera_frames(max_frames=100):
+    """
+    Генератор кадров с камеры сервера из общего сервиса захвата.
+    Делаем несколько попыток захвата изображения, т.к. сразу может не найтись лицо
+    """
+    # Если камера отвалилась или еще не запускалась, пробуем открыть ее снова
+    capture_service.start()
+    try:
+        frames = capture_service.frames(max_frames)
+        while True:
+            with stage("camera_read"):
+                frame = next(frames, None)
+            if frame is None:
+                return
+            yield frame
+    except CameraError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def enroll_person(person: PersonCreate, frames, db: Session):
+    """
+    Сохраняет клиента с фото по первому кадру, на котором найдено лицо.
+    Эмбеддинги первых ENROLL_TEMPLATES кадров с лицом сохраняются как шаблоны клиента:
+    в галерее по ним ищется центроид, а отдельные шаблоны проверяются в пограничных случаях.
+
+    :param person: данные о клиенте
+    :param frames: кадры в формате numpy array (BGR)
+    """
+    first = None  # первый кадр с лицом: из него сохраняется фото
+    embeddings = []  # эмбеддинги считаются один раз при сохранении фото
+    crops = []  # кропы шаблонов: по ним эмбеддинги пересчитываются при смене модели
+    frames_after_first = 0
+
+    for frame in frames:
+        if first is not None:
+            frames_after_first += 1
+            if frames_after_first > ENROLL_TEMPLATE_FRAMES:
+                break
+        # Быстрая проверка Хааром на уменьшенной копии, кадры без лица не отправляются в MTCNN
+        if len(detector.find_faces(frame, detect_width=PREFILTER_WIDTH)) == 0:
+            continue
+
+        # Один проход MTCNN: кроп лица сразу идет в ResNet
+        detection = face_recognizer.analyze([frame_to_pil(frame)])[0]
+        if detection is None:
+            continue  # FaceNet не нашел лицо, пробуем следующий кадр
+        if first is None:
+            first = frame
+        embeddings.append(detection.embedding)
+        crops.append(detection.crop)
+        if len(embeddings) >= ENROLL_TEMPLATES:
+            break  # Шаблонов достаточно, выходим из цикла
 
-    # Делаем несколько попыток захвата изображения
-    for i in range(100):  # повторяем процесс 100 раз, т.к. сразу может не найтись лицо
-        ret, frame = cap.read()  # Читаем кадр с камеры
+    # Если лицо не найдено
+    if first is None:
+        raise HTTPException(status_code=400, detail="Лицо не распознано на изображении")
+    frame = first
+
+    # Лицо может быть уже зарегистрировано у другого клиента (с другим телефоном/email)
+    ensure_gallery(db)
+    duplicate = find_duplicate(face_recognizer.gallery, centroid(embeddings))
+    if duplicate is not None and DUPLICATE_ACTION == "reject":
+        raise HTTPException(status_code=409, detail={
+            "message": "Лицо уже зарегистрировано у другого клиента",
+            "id_client": duplicate[0],
+            "score": round(duplicate[1], 4),
+        })
+
+    # Сохраняем изображение в хранилище фото (кадр без отрисованных рамок) и его уменьшенную копию.
+    # Имя файла — хэш содержимого, фото однофамильцев не перезаписывают друг друга
+    stored = photo_store.save_frame(frame)
+
+    # Сохраняем путь к фото в базе данных
+    db_person = PersonFactory.create_person(
+        person,
+        photo_path=stored.photo_path  # Путь к фото, доступный через URL
+    )
+
+    with stage("commit"):
+        db.add(db_person)  # Добавляем запись в базу данных
+        db.commit()
+        db.refresh(db_person)
+    dashboard_stats.on_person_added(db_person.payment_amount)
+
+    # Сохраняем кропы и шаблоны рядом с клиентом
+    save_crops(BASE_DIR, db_person.id_client, crops)
+    with stage("commit"):
+        save_templates(db, db_person.id_client, embeddings, face_recognizer.model_version)
+        db.commit()
+    if face_recognizer.gallery.built:
+        face_recognizer.gallery.add(db_person.id_client, embeddings)
+
+    response = {"message": "Фото и данные успешно сохранены", "id_client": db_person.id_client,
+                "templates": len(embeddings)}
+    if duplicate is not None:
+        # DUPLICATE_ACTION=flag: клиент сохранен, но администратору нужно проверить совпадение
+        response["duplicate_of"] = {"id_client": duplicate[0], "score": round(duplicate[1], 4)}
+    return response
+
+
+def match_frames(frames, db: Session, cache=True):
+    """
+    Ищет клиента по кадрам: кадры без лица отбрасываются Хааром, эмбеддинг считается
+    в памяти только для кадров с лицом и сравнивается со всей галереей.
+    Обработка заканчивается, как только решение устойчиво.
+
+    :param frames: кадры в формате numpy array (BGR)
+    :param cache: брать ли результаты для уже присланных изображений из кэша (для живой камеры не нужно)
+    :return: данные найденного клиента или сообщение об отсутствии, плюс top-k кандидатов и статистика
+    """
+    ensure_gallery(db)
+
+    pipeline = VerificationPipeline(detector, face_recognizer, VERIFY_THRESHOLD, top_k=VERIFY_TOP_K,
+                                    batch_size=VERIFY_FRAME_BATCH, to_image=frame_to_pil, cache=cache,
+                                    policy=verify_policy)
+    result = pipeline.run(frames)
+    FRAMES.inc(result["frames_examined"])
+    NO_FACE_FRAMES.inc(result["frames_without_face"])
+
+    with stage("db_query"):
+        matched_person = db.get(Person, result["matched_id"]) if result["matched_id"] is not None else None
+    VERIFICATIONS.inc(result="match" if matched_person else "no_match")
+    stats = {
+        "score": result["score"],
+        "margin": result["margin"],
+        "candidates": [{"id": id_client, "score": score} for id_client, score in result["candidates"]],
+        "frames_examined": result["frames_examined"],
+        "frames_embedded": result["frames_embedded"],
+        "frames_rescored": result["frames_rescored"],
+        "elapsed_ms": result["elapsed_ms"],
+    }
+
+    if matched_person:
+        return {
+            "id": matched_person.id_client,
+            "first_name": matched_person.first_name,
+            "last_name": matched_person.last_name,
+            "middle_name": matched_person.middle_name,
+            "birth_date": matched_person.birth_date,
+            "phone_number": matched_person.phone_number,
+            "email": matched_person.email,
+            "payment_date": matched_person.payment_date,
+            "payment_amount": matched_person.payment_amount,
+            **stats
+        }
+    else:
+        return {"message": "Человек отсутствует в базе", **stats}
 
-        if not ret:
-            raise HTTPException(status_code=500, detail="Не удалось захватить изображение с камеры")
 
-        # Детектируем лицо на кадре
-        faces, _ = detector.detect_faces(frame)
+def enroll_from_camera(person: PersonCreate, db: Session):
+    """Сохранение клиента по кадрам с камеры сервера (выполняется в пуле инференса)"""
+    frames = camera_frames()
+    try:
+        return enroll_person(person, frames, db)
+    finally:
+        frames.close()
 
-        if len(faces) > 0:
-            # Сохраняем изображение в папку static/photo
-            photo_filename = f"{person.first_name}_{person.last_name}_{i}.jpg"
-            photo_path = os.path.join(PHOTO_DIR, photo_filename)
-            cv2.imwrite(photo_path, frame)  # Сохраняем изображение
 
-            # Сохраняем путь к фото в базе данных
-            db_person = Person(
-                first_name=person.first_name,
-                last_name=person.last_name,
-                middle_name=person.middle_name,
-                birth_date=person.birth_date,
-                phone_number=person.phone_number,
-                email=person.email,
-                payment_date=person.payment_date,
-                payment_amount=person.payment_amount,
-                photo_path=f"/static/photo/{photo_filename}"  # Путь к фото, доступный через URL
-            )
+def match_from_camera(db: Session):
+    """Верификация по кадрам с камеры сервера (выполняется в пуле инференса)"""
+    frames = camera_frames()
+    try:
+        return match_frames(frames, db, cache=False)
+    finally:
+        frames.close()
 
-            break  # Если лицо найдено, выходим из цикла
 
-    cap.release()  # Закрываем камеру после завершения работы с ней
+async def read_uploaded_images(request: Request):
+    """
+    Читает изображения из запроса: multipart (поля frames/file, можно несколько)
+    или сырое тело запроса с изображением (image/jpeg, image/png).
 
-    # Если лицо не найдено
-    if db_person is None:
-        raise HTTPException(status_code=400, detail="Лицо не распознано на изображении")
+    :return: список байтов изображений (декодируются уже в пуле инференса)
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        uploads = form.getlist("frames") + form.getlist("file")
+        raw_images = [await upload.read() for upload in uploads if hasattr(upload, "read")]
+    else:
+        raw_images = [await request.body()]
+
+    return raw_images
+
+
+def decode_frames(raw_images):
+    """Декодирует присланные изображения в кадры, ошибка 400 если что-то не декодировалось"""
+    frames = []
+    for data in raw_images:
+        with stage("decode"):
+            frame = decode_image(data)
+        if frame is None:
+            raise HTTPException(status_code=400, detail="Не удалось декодировать изображение")
+        frames.append(frame)
+
+    if not frames:
+        raise HTTPException(status_code=400, detail="Не передано ни одного изображения")
+    return frames
+
+
+@app.post("/persons/capture_face_show/")
+async def capture_face_and_save(
+        person: PersonCreate,  # Данные о человеке из тела запроса
+        db: Session = Depends(get_db)
+):
+    return await inference_executor.run(enroll_from_camera, person, db)
 
-    db.add(db_person)  # Добавляем запись в базу данных
-    db.commit()
-    db.refresh(db_person)
 
-    return {"message": "Фото и данные успешно сохранены"}
+@app.post("/persons/capture_face_upload/")
+async def capture_face_upload(
+    first_name: str = Form(...),
+    last_name: str = Form(...),
+    middle_name: str = Form(...),
+    birth_date: str = Form(...),
+    phone_number: str = Form(...),
+    email: str = Form(...),
+    payment_date: str = Form(...),
+    payment_amount: float = Form(...),
+    frames: List[UploadFile] = File(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Сохранение клиента с фото, присланным с камеры киоска (одно или несколько изображений).
+    Изображения декодируются в памяти.
+    """
+    person_data = validate_person_form(first_name, last_name, middle_name, birth_date,
+                                       phone_number, email, payment_date, payment_amount)
+    raw_images = [await upload.read() for upload in frames]
+    return await inference_executor.run(
+        lambda: enroll_person(person_data, decode_frames(raw_images), db)
+    )
+
+
+@app.post("/persons/import")
+def import_persons_endpoint(
+        records: UploadFile = File(...),
+        photos: Optional[UploadFile] = File(None),
+        embed: bool = Form(True),
+        db: Session = Depends(get_db)
+):
+    """
+    Массовый импорт клиентов из CSV или JSONL (колонка photo — имя файла в zip-архиве photos).
+    Возвращает отчет с ошибками и предупреждениями по строкам. Эмбеддинги в запросе не считаются:
+    при embed=true запускается фоновый пересчет (его прогресс — GET /admin/reindex).
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        photo_source = None
+        if photos is not None:
+            archive_path = os.path.join(tmp_dir, "photos.zip")
+            with open(archive_path, "wb") as f:
+                shutil.copyfileobj(photos.file, f)
+            if not zipfile.is_zipfile(archive_path):
+                raise HTTPException(status_code=400, detail="Фото нужно передать zip-архивом")
+            photo_source = PhotoSource(archive_path)
+        try:
+            report = import_persons(db, read_records(records.file.read(), records.filename or ""),
+                                    photo_source, embed=False)
+        finally:
+            if photo_source is not None:
+                photo_source.close()
+
+    # Новые клиенты с фото — клиенты без эмбеддинга текущей модели: их посчитает фоновая задача,
+    # она же в конце перестроит индекс галереи. Уже идущая задача доберет их следующими пачками
+    if embed and report["photos"]:
+        reindex_job.start()
+        report["reindex"] = reindex_job.progress()
+    return report
 
 
 # Эндпоинт для получения данных неплательщиков
 @app.get("/persons_not_paid/")
-def get_all_persons_not_paid(db: Session = Depends(get_db)):
-    not_paid = db.query(Person).filter(Person.payment_amount == 0).all()
-    return [PersonCreate.from_orm(person) for person in not_paid]
+def get_all_persons_not_paid(
+        response: Response,
+        after: Optional[str] = None,
+        limit: int = MAX_PAGE_SIZE,
+        db: Session = Depends(get_db)
+):
+    # Постранично; курсор следующей страницы передается в заголовке X-Next-Cursor
+    not_paid, next_cursor = get_page(db, "id", after, limit, False, {"not_paid": True})
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [PersonCreate.model_validate(person) for person in not_paid]
 # Эндпоинт для получения данных о количестве клиентов, неплательщиков и уплаченной сумме
 '''
 @app.get("/dashboard/")
@@ -263,96 +740,125 @@ def get_dashboard_data(db: Session = Depends(get_db)):
 def dashboard_page(request: Request):
     return templates.TemplateResponse("dashboard.html", {"request": request})
 
-@app.get("/api/dashboard-data")
-def get_dashboard_data(db: Session = Depends(get_db)):
-    total_clients = db.query(Person).count()
-    not_paid = db.query(Person).filter(Person.payment_amount == 0).count()
-    total_paid = db.query(Person.payment_amount).filter(Person.payment_amount != None).all()
+def dashboard_payload(stats, by_month=None):
+    data = {
+        "total_clients": stats["total_clients"],
+        "not_paid": stats["not_paid"],
+        "total_paid_sum_thousands": stats["total_paid"] / 1000
+    }
+    if by_month is not None:
+        data["by_month"] = by_month
+    return data
 
-    total_paid_sum = sum([x[0] for x in total_paid if x[0] is not None]) / 1000
 
-    # Возвращаем данные в формате JSON
-    return JSONResponse({
-        "total_clients": total_clients,
-        "not_paid": not_paid,
-        "total_paid_sum_thousands": total_paid_sum
-    })
+def dashboard_data_sync(by_month):
+    """Данные дашборда через синхронную сессию (если асинхронный драйвер не установлен)"""
+    with SessionLocal() as db:
+        return dashboard_payload(dashboard_stats.get(db), query_monthly_breakdown(db) if by_month else None)
 
 
+@app.get("/api/dashboard-data")
+async def get_dashboard_data(by_month: bool = False):
+    # Итоги считаются одним SQL-запросом и кэшируются до следующего изменения таблицы клиентов.
+    # Дашборд опрашивается часто, поэтому запрос идет через асинхронную сессию без потока из пула
+    if AsyncSessionLocal is None:
+        return JSONResponse(await run_in_threadpool(dashboard_data_sync, by_month))
+    async with AsyncSessionLocal() as db:
+        stats = await dashboard_stats.get_async(db)
+        months = await query_monthly_breakdown_async(db) if by_month else None
+
+    # Возвращаем данные в формате JSON
+    return JSONResponse(dashboard_payload(stats, months))
 
 
 @app.post("/persons/verify_faces/")
 async def verify_faces(
         db: Session = Depends(get_db)
 ):
-    # Открываем камеру (0 — это индекс камеры по умолчанию)
-    cap = cv2.VideoCapture(0)
-
-    if not cap.isOpened():
-        raise HTTPException(status_code=500, detail="Не удалось открыть камеру")
-
-    is_matched = False  # Флаг для отслеживания совпадения
-    matched_person = None  # Хранение данных о найденном человеке
-    is_match = False  # Инициализация переменной is_match
-
-    # Делаем несколько попыток захвата изображения
-    for i in range(100):  # повторяем процесс 100 раз, т.к. сразу может не найтись лицо
-        ret, frame = cap.read()  # Читаем кадр с камеры
-
-        if not ret:
-            raise HTTPException(status_code=500, detail="Не удалось захватить изображение с камеры")
+    return await inference_executor.run(match_from_camera, db)
 
-        # Сохраняем изображение в папку временно для сравнения
-        captured_photo_path = os.path.join(PHOTO_DIR, "temp_captured.jpg")
-        cv2.imwrite(captured_photo_path, frame)
-        #print(captured_photo_path)
-        # Получаем всех людей из базы данных
-        all_persons = db.query(Person).all()
 
-        # Сравниваем с каждым фото в базе данных
-        for db_person in all_persons:
-            base_dir = os.path.dirname(os.path.abspath(__file__))  # Папка, где находится текущий файл
-
-            # Проверяем наличие пути к фото в БД
-            if db_person.photo_path:
-                db_photo_path = db_person.photo_path.replace('/static', 'static')  # Преобразуем в относительный путь
-                db_photo_path = db_photo_path.replace('\\', '/')  # Заменяем слэши на unix-стиль
-                print(db_photo_path)
-
-                # Проверяем, существует ли файл
-                db_photo_path = os.path.join(base_dir, db_photo_path)
-                db_photo_path = Path(base_dir) / db_photo_path
-
-                if os.path.exists(db_photo_path):
-                    is_match = face_recognizer.verify_faces(captured_photo_path, db_photo_path)
-                    print(is_match)
+@app.post("/persons/verify_faces/upload/")
+async def verify_faces_upload(
+        request: Request,
+        db: Session = Depends(get_db)
+):
+    """
+    Верификация по изображениям, присланным с камеры киоска:
+    multipart (одно или несколько полей frames) или сырое тело image/jpeg.
+    """
+    raw_images = await read_uploaded_images(request)
+    return await inference_executor.run(lambda: match_frames(decode_frames(raw_images), db))
+
+def describe_person(id_client):
+    """Данные клиента для ответа в потоковом распознавании"""
+    with SessionLocal() as db, stage("db_query"):
+        person = db.get(Person, id_client)
+        if person is None:
+            return None
+        return {
+            "id_client": person.id_client,
+            "first_name": person.first_name,
+            "last_name": person.last_name,
+            "middle_name": person.middle_name,
+            "payment_date": person.payment_date.isoformat() if person.payment_date else None,
+            "payment_amount": person.payment_amount,
+        }
 
-                    if is_match:
-                        is_matched = True
-                        matched_person = db_person
-                        break  # Останавливаем цикл, если совпадение найдено
 
-        if is_matched:
-            break  # Если лицо найдено, выходим из внешнего цикла
+def prepare_stream():
+    with SessionLocal() as db:
+        ensure_gallery(db)
+
+
+async def receive_frames(websocket: WebSocket, slot: LatestFrame):
+    """Принимает кадры, пока клиент не отключится; необработанный кадр заменяется новым"""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+        if message.get("bytes"):
+            slot.put(message["bytes"])
+
+
+@app.websocket("/ws/recognize")
+async def recognize_stream(websocket: WebSocket):
+    """
+    Потоковое распознавание: клиент присылает JPEG-кадры (бинарные сообщения),
+    сервер на каждый обработанный кадр отвечает JSON с рамками лиц и найденным клиентом.
+    Пока идет инференс, устаревшие кадры отбрасываются — обрабатывается только самый свежий.
+    """
+    await websocket.accept()
+    await run_in_threadpool(prepare_stream)
+    # Между кадрами одного подключения лицо ищется рядом с рамкой с прошлого кадра
+    session = StreamSession(FaceTracker(detector), face_recognizer, VERIFY_THRESHOLD, to_image=frame_to_pil,
+                            describe=describe_person, policy=verify_policy)
+    # Все отброшенные кадры (замененные новым и пропущенные из-за занятого пула) попадают в метрику
+    slot = LatestFrame(on_drop=STREAM_DROPPED.inc)
+    receiver = asyncio.create_task(receive_frames(websocket, slot))
+    try:
+        while True:
+            getter = asyncio.ensure_future(slot.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                break  # клиент отключился
+            try:
+                result = await inference_executor.run(session.process_bytes, getter.result())
+            except InferenceBusyError:
+                slot.drop()  # пул занят: кадр пропускается, берется следующий
+                continue
+            FRAMES.inc()
+            if result is None:
+                await websocket.send_json({"error": "Не удалось декодировать изображение"})
+                continue
+            await websocket.send_json({**result, "received": slot.received, "dropped": slot.dropped})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
 
-    cap.release()  # Закрываем камеру после завершения работы с ней
-    os.remove(captured_photo_path)  # Удаляем временное фото
 
-    # Проверяем флаг is_matched
-    if is_matched and matched_person:
-        return {
-            "id": matched_person.id_client,
-            "first_name": matched_person.first_name,
-            "last_name": matched_person.last_name,
-            "middle_name": matched_person.middle_name,
-            "birth_date": matched_person.birth_date,
-            "phone_number": matched_person.phone_number,
-            "email": matched_person.email,
-            "payment_date": matched_person.payment_date,
-            "payment_amount": matched_person.payment_amount
-        }
-    else:
-        return {"message": "Человек отсутствует в базе"}
 # Инициализируем базу данных при запуске
 init_db()
 
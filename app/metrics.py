@@ -0,0 +1,176 @@
+"""
+Метрики и замеры этапов обработки.
+
+Время каждого этапа (чтение кадра, декодирование, Хаар, MTCNN, ResNet, поиск
+по галерее, запросы к БД, коммит) собирается в гистограммы, счетчики
+и значения отдаются в формате Prometheus на /metrics.
+Если клиент прислал заголовок X-Profile: 1, разбивка по этапам для этого
+запроса возвращается в заголовке ответа Server-Timing.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+class Counter:
+    """Счетчик с метками"""
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Gauge:
+    """Текущее значение, которое считывается функцией в момент запроса метрик"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, fn):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+
+    def samples(self):
+        yield self.name, {}, self.fn()
+
+
+class Histogram:
+    """Гистограмма с метками (накопительные бакеты, сумма и количество)"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # метки -> [счетчики по бакетам, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return state[2] if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (bucket_counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                yield f"{self.name}_bucket", {**labels, "le": repr(float(bound))}, bucket_count
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, fn):
+        return self.register(Gauge(name, documentation, fn))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram("face_stage_seconds", "Время этапов обработки, секунды", ("stage",))
+REQUESTS = REGISTRY.counter("http_requests_total", "Количество HTTP-запросов", ("method", "path", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "Время обработки HTTP-запросов, секунды",
+                                     ("method", "path"))
+FRAMES = REGISTRY.counter("frames_processed_total", "Количество обработанных кадров")
+NO_FACE_FRAMES = REGISTRY.counter("no_face_frames_total", "Количество кадров без лица")
+VERIFICATIONS = REGISTRY.counter("verifications_total", "Результаты верификации", ("result",))
+VERIFY_PASSES = REGISTRY.counter("verification_passes_total",
+                                 "Решения по кадру: 1 — по центроидам, 2 — после проверки шаблонов", ("passes",))
+STREAM_DROPPED = REGISTRY.counter("stream_dropped_frames_total", "Кадры WebSocket, отброшенные из-за отставания инференса")
+
+# Разбивка по этапам текущего запроса (None — профилирование выключено)
+_profile = contextvars.ContextVar("stage_profile", default=None)
+
+
+def start_profile():
+    """Включает сбор разбивки по этапам для текущего запроса"""
+    profile = []
+    _profile.set(profile)
+    return profile
+
+
+def server_timing(profile):
+    """Разбивка по этапам в формате заголовка Server-Timing (время этапов суммируется)"""
+    totals = {}
+    for name, seconds in profile:
+        totals[name] = totals.get(name, 0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items())
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    profile = _profile.get()
+    if profile is not None:
+        profile.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    """Замеряет время блока как этапа name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
@@ -3,10 +3,10 @@
 Все классы наследуются от Base
 
 """
-from sqlalchemy import Column, Integer, String, Float, Date, LargeBinary
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, LargeBinary, ForeignKey, Index, func, literal_column
 from sqlalchemy.ext.declarative import declarative_base
 from pydantic import BaseModel, EmailStr
-from datetime import date
+from datetime import date, datetime
 
 Base = declarative_base()
 
@@ -32,6 +32,39 @@ class Person(Base):
     payment_amount = Column(Float, nullable=True)
     photo_path = Column(String)  # Путь к фото
 
+    # Индекс для фильтра по диапазону дат оплаты (индексы сортировки — ниже)
+    __table_args__ = (
+        Index("ix_persons_payment_date", "payment_date", "id_client"),
+        # Неплательщики (payment_amount = 0) и суммы для дашборда
+        Index("ix_persons_payment_amount", "payment_amount"),
+    )
+
+
+# Ключи сортировки списка клиентов: пустые фамилия и дата оплаты приравниваются к наименьшему
+# значению, иначе сравнение с курсором страницы дает NULL и такие клиенты пропадают из выдачи
+MIDDLE_NAME_SORT_KEY = func.coalesce(Person.__table__.c.middle_name, literal_column("''"))
+PAYMENT_DATE_SORT_KEY = func.coalesce(Person.__table__.c.payment_date, literal_column("'0001-01-01'"))
+# Индексы по тем же выражениям для постраничного вывода с сортировкой по ФИО и дате оплаты
+Index("ix_persons_name_sort", MIDDLE_NAME_SORT_KEY, Person.__table__.c.first_name, Person.__table__.c.id_client)
+Index("ix_persons_payment_date_sort", PAYMENT_DATE_SORT_KEY, Person.__table__.c.id_client)
+
+
+class FaceEmbedding(Base):
+    """
+    Модель для хранения эмбеддинга лица клиента
+    эмбеддинг считается один раз при сохранении фото и дальше используется при верификации
+    - id клиента
+    - версия модели, которой посчитан вектор (при смене модели векторы пересчитываются)
+    - сам вектор (float32, нормированный) в бинарном виде
+    """
+
+    __tablename__ = "face_embeddings"
+    id = Column(Integer, primary_key=True, index=True)
+    id_client = Column(Integer, ForeignKey("persons.id_client", ondelete="CASCADE"), nullable=False, index=True)
+    model_version = Column(String, nullable=False, index=True)
+    vector = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 
 class PersonCreate(BaseModel):
     first_name: str
@@ -0,0 +1,218 @@
+"""
+Хранилище фото клиентов с именами по хэшу содержимого.
+
+Фото лежит в static/photo/<первые 2 символа хэша>/<хэш>.jpg, уменьшенная копия
+для списка клиентов — в static/thumbs с тем же именем. Одинаковые фото
+сохраняются один раз, файлы с разным содержимым не перезаписывают друг друга
+(раньше фото однофамильцев с одинаковым именем файла затирались). Запись
+атомарная: файл пишется во временный и переименовывается, поэтому читатель
+никогда не видит недописанное фото. Содержимое файла по такому адресу не
+меняется, поэтому браузер может кэшировать его без перепроверки.
+
+Перенос старых фото (имя_фамилия_N.jpg) в хранилище:
+    python -m app.photo_store --migrate
+"""
+import argparse
+import hashlib
+import os
+import re
+import tempfile
+
+import cv2
+from starlette.staticfiles import StaticFiles
+
+# Размер большей стороны уменьшенной копии фото для списка клиентов, пиксели
+PHOTO_THUMB_SIZE = int(os.getenv("PHOTO_THUMB_SIZE", 128))
+# Качество JPEG для кадров с камеры и уменьшенных копий
+PHOTO_JPEG_QUALITY = int(os.getenv("PHOTO_JPEG_QUALITY", 90))
+# Сколько браузер может хранить фото и уменьшенные копии без перепроверки, секунды
+PHOTO_CACHE_MAX_AGE = int(os.getenv("PHOTO_CACHE_MAX_AGE", 365 * 24 * 3600))
+
+PHOTO_URL = "/static/photo"
+THUMB_URL = "/static/thumbs"
+
+# Имя файла по хэшу: 32 шестнадцатеричных символа
+HASHED_NAME = re.compile(r"^[0-9a-f]{32}\.[a-z0-9]+$")
+
+
+def content_hash(data):
+    """Хэш байтов файла (имя файла в хранилище)"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def is_content_addressed(path):
+    """Имя файла — хэш содержимого (такой файл никогда не меняется)"""
+    return bool(HASHED_NAME.match(os.path.basename(path)))
+
+
+def atomic_write(path, data):
+    """Пишет файл целиком во временный в той же папке и заменяет им path"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def thumbnail_url(photo_path):
+    """
+    URL уменьшенной копии фото для списка клиентов.
+    Для старых фото (не из хранилища) уменьшенной копии нет — возвращается само фото.
+    """
+    if not photo_path:
+        return None
+    if is_content_addressed(photo_path):
+        name = os.path.basename(photo_path)
+        return f"{THUMB_URL}/{name[:2]}/{os.path.splitext(name)[0]}.jpg"
+    return photo_path
+
+
+def cache_control(path):
+    """Заголовок Cache-Control для статического файла"""
+    if is_content_addressed(path):
+        return f"public, max-age={PHOTO_CACHE_MAX_AGE}, immutable"
+    # Остальные файлы (кропы, старые фото) могут поменяться: браузер перепроверяет их по ETag
+    return "no-cache"
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    Статические файлы с заголовком Cache-Control: фото и уменьшенные копии с именем
+    по хэшу не меняются, браузер хранит их без перепроверки; остальные файлы
+    перепроверяются по ETag (ответ 304 без тела, если файл не изменился).
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = cache_control(full_path)
+        return response
+
+
+class StoredPhoto:
+    """Результат сохранения фото"""
+
+    def __init__(self, digest, path, photo_path, thumb_path, created):
+        self.digest = digest
+        self.path = path  # путь на диске
+        self.photo_path = photo_path  # путь для БД и URL (/static/photo/...)
+        self.thumb_path = thumb_path
+        self.created = created  # False — такое фото уже было в хранилище
+
+
+class PhotoStore:
+    """
+    Хранилище фото в папке static приложения.
+
+    base_dir: папка приложения (в ней static/photo и static/thumbs)
+    """
+
+    def __init__(self, base_dir, thumb_size=PHOTO_THUMB_SIZE, jpeg_quality=PHOTO_JPEG_QUALITY):
+        self.photo_dir = os.path.join(base_dir, "static", "photo")
+        self.thumb_dir = os.path.join(base_dir, "static", "thumbs")
+        self.thumb_size = thumb_size
+        self.jpeg_quality = jpeg_quality
+
+    def _encode(self, frame):
+        ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError("Не удалось закодировать изображение в JPEG")
+        return buffer.tobytes()
+
+    def thumbnail(self, frame):
+        """Уменьшенная копия кадра: большая сторона — thumb_size пикселей"""
+        height, width = frame.shape[:2]
+        scale = self.thumb_size / max(height, width)
+        if scale >= 1:
+            return frame
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    def save_bytes(self, data, extension=".jpg", frame=None):
+        """
+        Сохраняет файл изображения (байты как есть) и его уменьшенную копию.
+
+        :param frame: уже декодированный кадр (BGR), чтобы не декодировать data повторно
+        :return: StoredPhoto
+        """
+        digest = content_hash(data)
+        extension = extension.lower() if extension else ".jpg"
+        name = f"{digest}{extension}"
+        path = os.path.join(self.photo_dir, digest[:2], name)
+        thumb_path = os.path.join(self.thumb_dir, digest[:2], f"{digest}.jpg")
+
+        created = not os.path.exists(path)
+        if created:
+            atomic_write(path, data)
+        if not os.path.exists(thumb_path):
+            if frame is None:
+                frame = cv2.imread(path, cv2.IMREAD_COLOR)
+            if frame is not None:
+                atomic_write(thumb_path, self._encode(self.thumbnail(frame)))
+        return StoredPhoto(digest, path, f"{PHOTO_URL}/{digest[:2]}/{name}", thumb_path, created)
+
+    def save_frame(self, frame):
+        """Сохраняет кадр с камеры (BGR) в JPEG"""
+        return self.save_bytes(self._encode(frame), ".jpg", frame)
+
+    def save_file(self, source_path):
+        """Сохраняет копию файла изображения (например, при импорте или переносе старых фото)"""
+        with open(source_path, "rb") as f:
+            data = f.read()
+        return self.save_bytes(data, os.path.splitext(source_path)[1] or ".jpg")
+
+
+def migrate_photos(db, base_dir, store=None):
+    """
+    Переносит старые фото клиентов в хранилище и обновляет photo_path в БД.
+    Старые файлы не удаляются.
+
+    :return: словарь: перенесено, не найдено файлов
+    """
+    from app.embedding_store import resolve_photo_path
+    from app.models import Person
+
+    store = store or PhotoStore(base_dir)
+    report = {"migrated": 0, "missing": 0}
+    persons = db.query(Person).filter(Person.photo_path.isnot(None)).all()
+    for person in persons:
+        if is_content_addressed(person.photo_path):
+            continue
+        path = resolve_photo_path(person.photo_path, base_dir)
+        if not os.path.isfile(path):
+            report["missing"] += 1
+            continue
+        person.photo_path = store.save_file(path).photo_path
+        report["migrated"] += 1
+    db.commit()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Хранилище фото клиентов")
+    parser.add_argument("--migrate", action="store_true",
+                        help="перенести старые фото в хранилище и создать уменьшенные копии")
+    args = parser.parse_args()
+    if not args.migrate:
+        parser.print_help()
+        return
+
+    from app.database import SessionLocal, init_db
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    init_db()
+    with SessionLocal() as db:
+        print(migrate_photos(db, base_dir))
+
+
+if __name__ == "__main__":
+    main()
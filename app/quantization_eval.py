@@ -0,0 +1,118 @@
+"""
+Сравнение профилей инференса InceptionResnetV1 на локальных фото:
+задержка на батч и отклонение эмбеддингов от fp32.
+
+Запуск:
+    python -m app.quantization_eval photos/ --profiles fp32 int8-dynamic int8-static --batch-size 8
+
+Половина найденных лиц используется для калибровки int8-static, на второй половине
+считаются метрики. Результат печатается в JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.faceNet_try import FaceNetVerify
+from app.inference_profile import PROFILES, apply_profile, configure_threads
+
+
+def load_faces(directory, mtcnn):
+    """Вырезанные MTCNN лица из всех фото папки"""
+    import torch
+
+    faces = []
+    for name in sorted(os.listdir(directory)):
+        try:
+            image = Image.open(os.path.join(directory, name)).convert("RGB")
+        except OSError:
+            continue
+        with torch.inference_mode():
+            face = mtcnn(image)
+        if face is not None:
+            faces.append(face)
+    return faces
+
+
+def embed(model, faces, batch_size):
+    """Эмбеддинги всех лиц и время каждого батча, секунды"""
+    import torch
+
+    embeddings, timings = [], []
+    with torch.inference_mode():
+        for i in range(0, len(faces), batch_size):
+            batch = torch.stack(faces[i:i + batch_size])
+            start = time.perf_counter()
+            output = model(batch)
+            timings.append(time.perf_counter() - start)
+            embeddings.append(output.numpy())
+    embeddings = np.concatenate(embeddings)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True), timings
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def evaluate(directory, profiles, batch_size=8, repeats=3, threads=0):
+    """
+    :return: словарь профиль -> метрики (задержка, сходство с fp32, совпадение top-1 при поиске)
+    """
+    import torch
+
+    configure_threads(intra_op=threads)
+    recognizer = FaceNetVerify()
+    faces = load_faces(directory, recognizer.mtcnn)
+    if len(faces) < 2:
+        raise SystemExit("Нужно хотя бы два фото с лицами")
+
+    calibration_faces, eval_faces = faces[: len(faces) // 2], faces[len(faces) // 2:]
+    calibration = [torch.stack(calibration_faces[i:i + batch_size])
+                   for i in range(0, len(calibration_faces), batch_size)]
+
+    base_model, _ = recognizer.build_resnet()
+    reference, _ = embed(base_model, eval_faces, batch_size)
+    reference_top1 = np.argsort(-(reference @ reference.T), axis=1)[:, 1]
+
+    results = {"faces": len(faces), "evaluated": len(eval_faces), "batch_size": batch_size,
+               "threads": torch.get_num_threads(), "profiles": {}}
+    for profile in profiles:
+        model = apply_profile(base_model, profile, calibration)
+        embed(model, eval_faces[:batch_size], batch_size)  # прогрев
+        timings = []
+        for _ in range(repeats):
+            embeddings, batch_timings = embed(model, eval_faces, batch_size)
+            timings.extend(batch_timings)
+
+        similarity = np.sum(embeddings * reference, axis=1)
+        top1 = np.argsort(-(embeddings @ embeddings.T), axis=1)[:, 1]
+        results["profiles"][profile] = {
+            "batch_ms_p50": round(statistics.median(timings) * 1000, 2),
+            "batch_ms_p95": round(percentile(timings, 95) * 1000, 2),
+            "faces_per_second": round(len(eval_faces) * repeats / sum(timings), 1),
+            "similarity_to_fp32_mean": round(float(similarity.mean()), 5),
+            "similarity_to_fp32_min": round(float(similarity.min()), 5),
+            "top1_agreement": round(float(np.mean(top1 == reference_top1)), 4),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение профилей инференса FaceNet")
+    parser.add_argument("directory", help="папка с фото лиц")
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=PROFILES)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op потоки torch (0 — по умолчанию)")
+    args = parser.parse_args()
+
+    results = evaluate(args.directory, args.profiles, args.batch_size, args.repeats, args.threads)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
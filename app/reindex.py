@@ -0,0 +1,238 @@
+"""
+Фоновый пересчет эмбеддингов (например, для старых фото без векторов или после смены модели).
+
+Клиенты с фото, у которых нет эмбеддинга текущей версии модели, обрабатываются
+по порядку id пачками в пуле процессов. Каждая пачка коммитится сразу, поэтому после
+падения повторный запуск продолжает с оставшихся клиентов. Пока задача идет,
+верификация работает со старым индексом галереи; в конце индекс строится заново
+и подменяется целиком.
+
+Запуск из командной строки:
+    python -m app.reindex --workers 4
+В приложении: POST /admin/reindex (запуск), GET /admin/reindex (прогресс).
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.embedding_store import (
+    missing_embeddings_query, embed_persons, save_templates, save_crop, load_gallery
+)
+from app.models import Person
+
+logger = logging.getLogger(__name__)
+
+# Количество процессов для эмбеддингов (0 — считать в текущем процессе)
+REINDEX_WORKERS = int(os.getenv("REINDEX_WORKERS", 2))
+# Сколько клиентов обрабатывать между коммитами
+REINDEX_CHUNK_SIZE = int(os.getenv("REINDEX_CHUNK_SIZE", 256))
+# Сколько фото отдавать одному процессу за раз
+REINDEX_BATCH_SIZE = int(os.getenv("REINDEX_BATCH_SIZE", 16))
+
+
+def _init_worker():
+    """Модель загружается один раз на процесс"""
+    global _worker_recognizer
+    from app.faceNet_try import FaceNetVerify
+    _worker_recognizer = FaceNetVerify()
+
+
+def _embed_task(task):
+    """Эмбеддинги для пачки клиентов в процессе пула"""
+    base_dir, persons = task
+    return embed_persons(_worker_recognizer, base_dir, persons, use_batcher=False)
+
+
+class ReindexJob:
+    """
+    Задача пересчета эмбеддингов для recognizer.model_version.
+
+    session_factory: фабрика сессий БД (SessionLocal)
+    recognizer: FaceNetVerify, индекс галереи которого подменяется в конце
+    """
+
+    def __init__(self, session_factory, recognizer, base_dir, workers=REINDEX_WORKERS,
+                 chunk_size=REINDEX_CHUNK_SIZE, batch_size=REINDEX_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.recognizer = recognizer
+        self.base_dir = base_dir
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self._thread = None
+        self._rerun = False  # пока задача шла, появились новые клиенты без эмбеддингов
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._reset("idle")
+
+    def _reset(self, status):
+        self.status = status
+        self.model_version = self.recognizer.model_version
+        self.total = 0
+        self.processed = 0
+        self.embedded = 0
+        self.no_face = 0
+        self.no_photo = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+    def start(self):
+        """
+        Запускает задачу в фоновом потоке.
+        Если задача уже идет, после нее запускается еще один проход — клиенты,
+        добавленные во время прохода (например, импортом), не останутся без эмбеддингов.
+
+        :return: False, если задача уже идет
+        """
+        with self._lock:
+            if self.running:
+                self._rerun = True
+                return False
+            self.status = "running"
+            self._rerun = False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run_background, name="reindex", daemon=True)
+            self._thread.start()
+        return True
+
+    def _run_background(self):
+        while True:
+            self.run()
+            with self._lock:
+                if not self._rerun or self._stop.is_set():
+                    return
+                self._rerun = False
+                self.status = "running"
+
+    def stop(self, timeout=None):
+        """Останавливает задачу после текущей пачки (сделанное уже закоммичено)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def progress(self):
+        """Состояние задачи: счетчики, скорость (клиентов в секунду) и оценка оставшегося времени"""
+        elapsed = ((self.finished_at or time.monotonic()) - self.started_at) if self.started_at else 0
+        rate = self.processed / elapsed if elapsed > 0 else 0
+        remaining = max(self.total - self.processed, 0)
+        return {
+            "status": self.status,
+            "model_version": self.model_version,
+            "total": self.total,
+            "processed": self.processed,
+            "embedded": self.embedded,
+            "no_face": self.no_face,
+            "no_photo": self.no_photo,
+            "elapsed_seconds": round(elapsed, 1),
+            "per_second": round(rate, 2),
+            "eta_seconds": round(remaining / rate, 1) if rate and self.running else None,
+            "error": self.error,
+        }
+
+    def run(self):
+        """Выполняет задачу в текущем потоке (используется и из командной строки)"""
+        self._reset("running")
+        self.started_at = time.monotonic()
+        db = self.session_factory()
+        pool = None
+        try:
+            self.total = missing_embeddings_query(db, self.model_version).count()
+            if self.workers and self.total:
+                # spawn: в процессе приложения уже работают потоки, fork с ними небезопасен
+                pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                           mp_context=multiprocessing.get_context("spawn"))
+            last_id = 0
+            while not self._stop.is_set():
+                # Keyset по id: клиенты без лица не выбираются повторно в рамках одного запуска
+                persons = missing_embeddings_query(db, self.model_version).filter(
+                    Person.id_client > last_id
+                ).order_by(Person.id_client).with_entities(Person.id_client, Person.photo_path).limit(
+                    self.chunk_size
+                ).all()
+                if not persons:
+                    break
+                persons = [tuple(row) for row in persons]
+                last_id = persons[-1][0]
+                self._process_chunk(db, persons, pool)
+                logger.info("Пересчет эмбеддингов: %s", self.progress())
+
+            if not self._stop.is_set():
+                # Индекс строится целиком и подменяется одной операцией, поиск не прерывается
+                self.recognizer.gallery.build(load_gallery(db, self.model_version))
+            self.status = "stopped" if self._stop.is_set() else "done"
+        except Exception as e:
+            db.rollback()
+            self.error = str(e)
+            self.status = "failed"
+            logger.exception("Пересчет эмбеддингов завершился с ошибкой")
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            db.close()
+            self.finished_at = time.monotonic()
+        return self.progress()
+
+    def _process_chunk(self, db, persons, pool):
+        """Считает эмбеддинги для пачки клиентов и коммитит их одной транзакцией"""
+        batches = [(self.base_dir, persons[i:i + self.batch_size]) for i in range(0, len(persons), self.batch_size)]
+        if pool is not None:
+            results = pool.map(_embed_task, batches)
+        else:
+            results = (embed_persons(self.recognizer, self.base_dir, batch, use_batcher=False)
+                       for _, batch in batches)
+
+        saved = []
+        for batch_results in results:
+            for id_client, vectors, crop, status in batch_results:
+                if status == "no_face":
+                    self.no_face += 1
+                elif status == "no_photo":
+                    self.no_photo += 1
+                if vectors is None:
+                    continue
+                if crop is not None:
+                    save_crop(self.base_dir, id_client, crop)
+                # Все шаблоны клиента пересчитываются по своим кропам, их количество не меняется
+                save_templates(db, id_client, vectors, self.model_version)
+                saved.append((id_client, vectors))
+        db.commit()
+
+        # Новые клиенты сразу доступны для поиска, не дожидаясь конца задачи
+        if self.recognizer.gallery.built:
+            for id_client, vectors in saved:
+                self.recognizer.gallery.add(id_client, vectors)
+        self.embedded += len(saved)
+        self.processed += len(persons)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчет эмбеддингов для клиентов без вектора текущей модели")
+    parser.add_argument("--workers", type=int, default=REINDEX_WORKERS,
+                        help="количество процессов (0 — в текущем процессе)")
+    parser.add_argument("--chunk-size", type=int, default=REINDEX_CHUNK_SIZE, help="клиентов между коммитами")
+    parser.add_argument("--batch-size", type=int, default=REINDEX_BATCH_SIZE, help="фото на одну задачу процесса")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    from app.database import SessionLocal, init_db
+    from app.faceNet_try import FaceNetVerify
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    init_db()
+    job = ReindexJob(SessionLocal, FaceNetVerify(), base_dir, workers=args.workers,
+                     chunk_size=args.chunk_size, batch_size=args.batch_size)
+    print(json.dumps(job.run(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Индекс галереи в файлах, отображенных в память (memory-mapped), общий для всех
+воркеров uvicorn.
+
+Матрица эмбеддингов и id клиентов лежат в файлах папки GALLERY_MMAP_DIR. Запись
+(построение, добавление клиента) делает один процесс под файловой блокировкой,
+остальные отображают файлы только для чтения: страницы матрицы находятся в кэше
+ОС в одном экземпляре, а не копируются в каждый воркер.
+
+Рядом лежит gallery.json со счетчиком поколений. Перед поиском воркер проверяет,
+изменился ли он: новые строки (добавленные клиенты) подхватываются без
+перечитывания матрицы, файлы переотображаются только после полного перестроения,
+расширения или замены эмбеддинга уже добавленного клиента.
+
+Шаблоны клиентов с несколькими эмбеддингами лежат во второй паре файлов
+(template_ids, templates). Она только дополняется: при замене шаблонов клиента
+старые строки помечаются id -1 и пропускаются при поиске, место освобождается
+при следующем перестроении.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.gallery_index import (GalleryIndex, IVFIndex, normalize, centroid, group_templates,
+                               GALLERY_ANN_THRESHOLD, GALLERY_ANN_PROBES, GALLERY_RERANK_TOP)
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только между потоками одного процесса
+    fcntl = None
+
+# Папка для общего индекса галереи; если не задана, каждый процесс держит индекс в своей памяти
+GALLERY_MMAP_DIR = os.getenv("GALLERY_MMAP_DIR")
+
+EMBEDDING_DIM = 512
+# Минимальное количество строк в файлах; при заполнении файлы пересоздаются вдвое больше
+MIN_CAPACITY = 1024
+# id строки шаблона, замененного новыми шаблонами клиента
+REMOVED_TEMPLATE = -1
+# Имена файлов: центроиды клиентов и шаблоны
+TABLES = {"": ("ids", "matrix"), "template_": ("template_ids", "templates")}
+
+_thread_lock = threading.Lock()
+
+
+@contextmanager
+def file_lock(path):
+    """Эксклюзивная блокировка между процессами (и потоками) на время записи"""
+    with _thread_lock, open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SharedGalleryIndex(GalleryIndex):
+    """
+    Индекс галереи с матрицей в memory-mapped файлах.
+    Поиск, проверка шаблонов и приближенный индекс (IVF) те же, что у GalleryIndex.
+    """
+
+    def __init__(self, directory, ann_threshold=GALLERY_ANN_THRESHOLD, n_probe=GALLERY_ANN_PROBES,
+                 dim=EMBEDDING_DIM, rerank_top=GALLERY_RERANK_TOP):
+        super().__init__(ann_threshold, n_probe, rerank_top)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self.meta_path = os.path.join(directory, "gallery.json")
+        self.lock_path = os.path.join(directory, "gallery.lock")
+        self.generation = None  # поколение, которое видит этот процесс
+        self._epoch = None  # номер текущих файлов (меняется при перестроении и расширении)
+        self._meta_stamp = None
+        self._ids_map = None
+        self._matrix_map = None
+        self._template_epoch = None
+        self._template_maps = None
+
+    def _paths(self, epoch, table=""):
+        ids_name, matrix_name = TABLES[table]
+        return (os.path.join(self.directory, f"{ids_name}.{epoch}.i64"),
+                os.path.join(self.directory, f"{matrix_name}.{epoch}.f32"))
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, meta):
+        # Замена файла целиком: читатели видят либо старое, либо новое состояние
+        tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _map(self, epoch, capacity, mode, table=""):
+        ids_path, matrix_path = self._paths(epoch, table)
+        return (np.memmap(ids_path, dtype=np.int64, mode=mode, shape=(capacity,)),
+                np.memmap(matrix_path, dtype=np.float32, mode=mode, shape=(capacity, self.dim)))
+
+    def _allocate(self, epoch, capacity, ids, matrix, table=""):
+        """Создает файлы нового поколения и копирует в них строки"""
+        ids_map, matrix_map = self._map(epoch, capacity, "w+", table)
+        ids_map[:len(ids)] = ids
+        matrix_map[:len(ids)] = matrix
+        ids_map.flush()
+        matrix_map.flush()
+
+    def _remove(self, epoch, table=""):
+        # В Linux уже отображенные файлы остаются доступны другим воркерам до переотображения
+        for path in self._paths(epoch, table):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _reserve(self, meta, extra, table=""):
+        """
+        Отображает файлы таблицы для записи. Если файлов еще нет или в них нет места
+        для extra новых строк, создает файлы следующего поколения (в meta записывается новое поколение).
+
+        :return: (ids, матрица) для записи, поколение старых файлов для удаления (или None)
+        """
+        count = meta.get(f"{table}count", 0)
+        capacity = meta.get(f"{table}capacity")
+        old_epoch = None
+        if capacity is None:
+            capacity = max(MIN_CAPACITY, 2 * extra)
+            meta[f"{table}epoch"] = meta.get(f"{table}epoch", 0) + 1
+            self._allocate(meta[f"{table}epoch"], capacity, [], [], table)
+        elif count + extra > capacity:
+            # Места нет: файлы нового поколения вдвое больше
+            ids_map, matrix_map = self._map(meta[f"{table}epoch"], capacity, "r", table)
+            while count + extra > capacity:
+                capacity *= 2
+            old_epoch = meta[f"{table}epoch"]
+            meta[f"{table}epoch"] += 1
+            self._allocate(meta[f"{table}epoch"], capacity, ids_map[:count], matrix_map[:count], table)
+            del ids_map, matrix_map
+        meta[f"{table}count"], meta[f"{table}capacity"] = count, capacity
+        return self._map(meta[f"{table}epoch"], capacity, "r+", table), old_epoch
+
+    def build(self, entries):
+        """
+        Строит индекс заново в новых файлах и переключает на них всех воркеров.
+
+        :param entries: список пар (id_client, вектор), у клиента может быть несколько векторов
+        """
+        ids, matrix, template_ids, templates = group_templates(entries)
+        empty = np.empty((0, self.dim), np.float32)
+        tables = {"": (ids, empty if matrix is None else matrix),
+                  "template_": (template_ids, empty if templates is None else templates)}
+        with file_lock(self.lock_path):
+            meta = self._read_meta() or {"epoch": 0, "generation": 0}
+            new_meta = {"generation": meta["generation"] + 1}
+            for table, (table_ids, table_matrix) in tables.items():
+                epoch = meta.get(f"{table}epoch", 0) + 1
+                capacity = max(MIN_CAPACITY, 2 * len(table_ids))
+                self._allocate(epoch, capacity, table_ids, table_matrix, table)
+                new_meta.update({f"{table}epoch": epoch, f"{table}count": len(table_ids),
+                                 f"{table}capacity": capacity})
+            self._write_meta(new_meta)
+            for table in tables:
+                if f"{table}capacity" in meta:
+                    self._remove(meta[f"{table}epoch"], table)
+        self.refresh()
+        self.built = True
+
+    def attach(self, expected_count):
+        """
+        Подключается к индексу, уже построенному другим воркером.
+
+        :param expected_count: количество клиентов с эмбеддингами в БД; если в файлах другое, индекс устарел
+        :return: True, если индекс подключен и перестраивать его не нужно
+        """
+        meta = self._read_meta()
+        if meta is None or meta["count"] != expected_count:
+            return False
+        self.refresh()
+        self.built = True
+        return True
+
+    def add(self, id_client, vector):
+        """
+        Добавляет (или заменяет) клиента; другие воркеры увидят его при следующем поиске.
+
+        :param vector: эмбеддинг (D,) или несколько шаблонов клиента (T x D)
+        """
+        templates = normalize(np.atleast_2d(vector))
+        vector = centroid(templates)
+        with file_lock(self.lock_path):
+            meta = self._read_meta() or {"generation": 0}
+            removed = []
+            position = []
+            if "capacity" in meta:
+                ids_map, matrix_map = self._map(meta["epoch"], meta["capacity"], "r")
+                position = np.flatnonzero(ids_map[:meta["count"]] == id_client)
+            if len(position):
+                # Замена строки: другие воркеры читают файлы без блокировки, поэтому
+                # строка меняется в копии файлов нового поколения, а не на месте
+                count = meta["count"]
+                matrix = np.array(matrix_map[:count])
+                matrix[position[0]] = vector
+                removed.append((meta["epoch"], ""))
+                meta["epoch"] += 1
+                self._allocate(meta["epoch"], meta["capacity"], ids_map[:count], matrix)
+                del ids_map, matrix_map
+            else:
+                (ids_map, matrix_map), old_epoch = self._reserve(meta, 1)
+                if old_epoch is not None:
+                    removed.append((old_epoch, ""))
+                count = meta["count"]
+                # Сначала строка, потом счетчик: читатели не увидят незаписанную строку
+                matrix_map[count] = vector
+                ids_map[count] = id_client
+                matrix_map.flush()
+                ids_map.flush()
+                meta["count"] = count + 1
+
+            new_templates = len(templates) if len(templates) > 1 else 0
+            if new_templates or "template_capacity" in meta:
+                (template_ids, template_matrix), old_epoch = self._reserve(meta, new_templates, "template_")
+                if old_epoch is not None:
+                    removed.append((old_epoch, "template_"))
+                template_count = meta["template_count"]
+                # Старые шаблоны клиента больше не участвуют в поиске
+                old_rows = np.flatnonzero(template_ids[:template_count] == id_client)
+                template_ids[old_rows] = REMOVED_TEMPLATE
+                template_matrix[template_count:template_count + new_templates] = templates[:new_templates]
+                template_ids[template_count:template_count + new_templates] = id_client
+                template_matrix.flush()
+                template_ids.flush()
+                meta["template_count"] = template_count + new_templates
+
+            meta["generation"] += 1
+            self._write_meta(meta)
+            for epoch, table in removed:
+                self._remove(epoch, table)
+        self.refresh()
+
+    def refresh(self):
+        """Подхватывает изменения, сделанные другими процессами (если gallery.json поменялся)"""
+        try:
+            stat = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._meta_stamp:
+            return
+        meta = self._read_meta()
+        if meta is None:
+            return
+        count = meta["count"]
+
+        with self._lock:
+            ivf = self.ivf
+            if meta["epoch"] != self._epoch:
+                # Файлы перестроены или расширены: отображаем заново
+                try:
+                    self._ids_map, self._matrix_map = self._map(meta["epoch"], meta["capacity"], "r")
+                except FileNotFoundError:
+                    return  # файлы уже заменил другой процесс, новое состояние подхватится при следующем поиске
+                self._epoch = meta["epoch"]
+                ivf = None
+                known = 0
+            else:
+                known = len(self.ids)
+            ids, matrix = self._ids_map[:count], self._matrix_map[:count]
+
+            template_ids, template_matrix = np.empty(0, dtype=np.int64), None
+            if "template_capacity" in meta:
+                if meta["template_epoch"] != self._template_epoch:
+                    try:
+                        self._template_maps = self._map(meta["template_epoch"], meta["template_capacity"], "r",
+                                                        "template_")
+                    except FileNotFoundError:
+                        return
+                    self._template_epoch = meta["template_epoch"]
+                template_count = meta["template_count"]
+                template_ids = self._template_maps[0][:template_count]
+                template_matrix = self._template_maps[1][:template_count]
+
+            if count >= self.ann_threshold:
+                if ivf is None:
+                    ivf = IVFIndex(np.asarray(matrix))
+                elif count > known:
+                    # Новые строки попадают в ближайшие кластеры
+                    ivf = ivf.assign(np.arange(known, count), matrix[known:])
+            else:
+                ivf = None
+
+            self.ids, self.matrix, self.ivf = ids, (matrix if count else None), ivf
+            self.template_ids, self.template_matrix = template_ids, template_matrix
+            self.generation = meta["generation"]
+            self._meta_stamp = stamp
+
+    def search(self, query, k=5, rerank=None):
+        self.refresh()
+        return super().search(query, k, rerank)
+
+    def rescore(self, query, candidates, top=None):
+        self.refresh()
+        return super().rescore(query, candidates, top)
+
+    def __len__(self):
+        self.refresh()
+        return super().__len__()
+
+
+def make_gallery():
+    """Общий индекс в файлах, если задан GALLERY_MMAP_DIR, иначе индекс в памяти процесса"""
+    if GALLERY_MMAP_DIR:
+        return SharedGalleryIndex(GALLERY_MMAP_DIR)
+    return GalleryIndex()
@@ -0,0 +1,185 @@
+"""
+Статистика для дашборда.
+Итоги считаются одним агрегирующим SQL-запросом и хранятся в кэше процесса:
+при добавлении клиента кэш обновляется инкрементально, при любом другом
+изменении таблицы клиентов — сбрасывается после коммита.
+Кэш живет в одном процессе, поэтому итоги дополнительно устаревают через
+DASHBOARD_CACHE_TTL секунд: при нескольких воркерах изменения, сделанные
+другим воркером, появятся на дашборде не позже этого срока.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import case, event, extract, func, select
+from sqlalchemy.orm import Session, object_session
+
+from app.models import Person
+
+# Сколько секунд итоги живут в кэше (0 — кэш отключен)
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", 30))
+
+
+def dashboard_stats_statement():
+    """Количество клиентов, количество неплательщиков и сумма оплат одним запросом"""
+    return select(
+        func.count(Person.id_client),
+        func.coalesce(func.sum(case((Person.payment_amount == 0, 1), else_=0)), 0),
+        func.coalesce(func.sum(Person.payment_amount), 0),
+    )
+
+
+def dashboard_stats_from_row(row):
+    total_clients, not_paid, total_paid = row
+    return {
+        "total_clients": int(total_clients),
+        "not_paid": int(not_paid),
+        "total_paid": float(total_paid),
+    }
+
+
+def query_dashboard_stats(db: Session):
+    """
+    Количество клиентов, количество неплательщиков и сумма оплат одним запросом.
+    """
+    return dashboard_stats_from_row(db.execute(dashboard_stats_statement()).one())
+
+
+async def query_dashboard_stats_async(db):
+    """То же для асинхронной сессии"""
+    return dashboard_stats_from_row((await db.execute(dashboard_stats_statement())).one())
+
+
+def monthly_breakdown_statement():
+    """Количество клиентов и сумма оплат по месяцам оплаты (группировка в SQL)"""
+    year = extract("year", Person.payment_date)
+    month = extract("month", Person.payment_date)
+    return select(
+        year, month,
+        func.count(Person.id_client),
+        func.coalesce(func.sum(case((Person.payment_amount == 0, 1), else_=0)), 0),
+        func.coalesce(func.sum(Person.payment_amount), 0),
+    ).where(Person.payment_date.isnot(None)).group_by(year, month).order_by(year, month)
+
+
+def monthly_breakdown_from_rows(rows):
+    return [
+        {
+            "month": f"{int(y):04d}-{int(m):02d}",
+            "clients": int(clients),
+            "not_paid": int(not_paid),
+            "paid_sum": float(paid_sum),
+        }
+        for y, m, clients, not_paid, paid_sum in rows
+    ]
+
+
+def query_monthly_breakdown(db: Session):
+    """
+    Количество клиентов и сумма оплат по месяцам оплаты (группировка в SQL).
+    """
+    return monthly_breakdown_from_rows(db.execute(monthly_breakdown_statement()).all())
+
+
+async def query_monthly_breakdown_async(db):
+    """То же для асинхронной сессии"""
+    return monthly_breakdown_from_rows((await db.execute(monthly_breakdown_statement())).all())
+
+
+class DashboardStatsCache:
+    """
+    Кэш итогов для дашборда.
+
+    Запрос к БД идет вне блокировки, поэтому каждое изменение увеличивает
+    счетчик поколений: результат запроса сохраняется, только если за время
+    запроса кэш не менялся (иначе он мог не увидеть добавленного клиента).
+    """
+
+    def __init__(self, ttl=DASHBOARD_CACHE_TTL):
+        self.ttl = ttl
+        self._stats = None
+        self._stored_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self):
+        """Итоги из кэша (None при промахе) и текущее поколение"""
+        with self._lock:
+            if self._stats is not None and time.monotonic() - self._stored_at < self.ttl:
+                return dict(self._stats), self._generation
+            self._stats = None
+            return None, self._generation
+
+    def _store(self, stats, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._stats = dict(stats)
+                self._stored_at = time.monotonic()
+
+    def get(self, db: Session):
+        """Итоги из кэша, при промахе — одним запросом к БД"""
+        cached, generation = self._lookup()
+        if cached is not None:
+            return cached
+        stats = query_dashboard_stats(db)
+        self._store(stats, generation)
+        return stats
+
+    async def get_async(self, db):
+        """То же, что get, для асинхронной сессии"""
+        cached, generation = self._lookup()
+        if cached is not None:
+            return cached
+        stats = await query_dashboard_stats_async(db)
+        self._store(stats, generation)
+        return stats
+
+    def on_person_added(self, payment_amount):
+        """Инкрементальное обновление итогов после добавления клиента (после коммита)"""
+        with self._lock:
+            self._generation += 1
+            if self._stats is None:
+                return
+            self._stats["total_clients"] += 1
+            if payment_amount == 0:
+                self._stats["not_paid"] += 1
+            if payment_amount is not None:
+                self._stats["total_paid"] += payment_amount
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._stats = None
+
+
+dashboard_stats = DashboardStatsCache()
+
+
+# Любое изменение или удаление клиентов через ORM сбрасывает кэш. Сброс откладывается
+# до коммита: иначе параллельный запрос итогов успеет сохранить в кэш еще не
+# закоммиченные (старые) значения под новым поколением
+PENDING_INVALIDATION = "dashboard_stats_pending"
+
+
+@event.listens_for(Person, "after_update")
+@event.listens_for(Person, "after_delete")
+def _invalidate_on_change(mapper, connection, target):
+    object_session(target).info[PENDING_INVALIDATION] = True
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _invalidate_on_bulk_change(context):
+    if context.mapper.class_ is Person:
+        context.session.info[PENDING_INVALIDATION] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop(PENDING_INVALIDATION, False):
+        dashboard_stats.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending_invalidation(session):
+    session.info.pop(PENDING_INVALIDATION, None)
@@ -0,0 +1,169 @@
+"""
+Потоковое распознавание для турникетов (WebSocket /ws/recognize).
+
+Киоск присылает JPEG-кадры, сервер отвечает рамками лиц и результатом поиска
+по галерее на каждый обработанный кадр:
+1. обрабатывается только самый свежий кадр — пока идет инференс, старые кадры
+   заменяются новыми и отбрасываются
+2. пока лицо остается в кадре (рамка Хаара почти не сдвинулась), эмбеддинг
+   не пересчитывается, используется результат предыдущего кадра
+"""
+import asyncio
+import os
+import time
+
+import numpy as np
+
+from app.frame_pipeline import downscale, PREFILTER_WIDTH
+from app.verify_policy import VerificationPolicy
+
+# Минимальное пересечение рамок (IoU), при котором считается, что в кадре то же лицо
+STREAM_TRACK_IOU = float(os.getenv("STREAM_TRACK_IOU", 0.5))
+# Через сколько кадров пересчитывать эмбеддинг, даже если лицо то же
+STREAM_REEMBED_EVERY = int(os.getenv("STREAM_REEMBED_EVERY", 15))
+
+
+def iou(box1, box2):
+    """Пересечение рамок (x, y, w, h), деленное на объединение"""
+    x1, y1 = max(box1[0], box2[0]), max(box1[1], box2[1])
+    x2 = min(box1[0] + box1[2], box2[0] + box2[2])
+    y2 = min(box1[1] + box1[3], box2[1] + box2[3])
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    union = box1[2] * box1[3] + box2[2] * box2[3] - intersection
+    return intersection / union if union else 0.0
+
+
+class LatestFrame:
+    """
+    Ячейка для одного кадра: новый кадр заменяет необработанный старый.
+
+    on_drop: вызывается на каждый отброшенный кадр (например, счетчик метрики)
+    """
+
+    def __init__(self, on_drop=None):
+        self._data = None
+        self._event = asyncio.Event()
+        self._on_drop = on_drop
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, data):
+        self.received += 1
+        if self._data is not None:
+            self.drop()  # предыдущий кадр так и не дождался обработки
+        self._data = data
+        self._event.set()
+
+    def drop(self):
+        """Кадр отброшен: заменен новым или пул инференса занят"""
+        self.dropped += 1
+        if self._on_drop is not None:
+            self._on_drop()
+
+    async def get(self):
+        """Ждет и забирает самый свежий кадр"""
+        await self._event.wait()
+        self._event.clear()
+        data, self._data = self._data, None
+        return data
+
+
+class StreamSession:
+    """
+    Состояние одного подключения: рамка отслеживаемого лица и последний результат.
+
+    detector: детектор Хаара (нужен find_faces)
+    recognizer: FaceNetVerify (нужны analyze, search_gallery и rescore_gallery)
+    describe: функция id_client -> словарь с данными клиента для ответа
+    policy: правила решения по кадру (по умолчанию VerificationPolicy с порогом threshold)
+    """
+
+    def __init__(self, detector, recognizer, threshold, to_image=None, describe=None,
+                 track_iou=STREAM_TRACK_IOU, reembed_every=STREAM_REEMBED_EVERY, prefilter_width=PREFILTER_WIDTH,
+                 policy=None):
+        self.detector = detector
+        self.recognizer = recognizer
+        self.policy = policy or VerificationPolicy(threshold)
+        self.threshold = self.policy.threshold
+        self.to_image = to_image or (lambda frame: frame)
+        self.describe = describe or (lambda id_client: {"id_client": id_client})
+        self.track_iou = track_iou
+        self.reembed_every = reembed_every
+        self.prefilter_width = prefilter_width
+        self.frames = 0
+        self.embedded = 0
+        self.reset()
+
+    def reset(self):
+        """Лицо пропало из кадра: следующее лицо распознается заново"""
+        self.box = None
+        self.match = None
+        self.score = None
+        self.margin = None
+        self.frames_since_embed = 0
+
+    def find_boxes(self, frame):
+        """Рамки Хаара на уменьшенной копии, пересчитанные в координаты исходного кадра"""
+        small = downscale(frame, self.prefilter_width)
+        scale = frame.shape[1] / small.shape[1]
+        return [tuple(int(round(v * scale)) for v in box) for box in self.detector.find_faces(small)]
+
+    def process(self, frame):
+        """
+        Обрабатывает кадр.
+
+        :param frame: кадр в формате numpy array (BGR)
+        :return: словарь: рамки лиц, найденный клиент (или None), сходство, отрыв от второго кандидата,
+                 tracked — результат взят с предыдущего кадра без эмбеддинга
+        """
+        start = time.perf_counter()
+        self.frames += 1
+        boxes = self.find_boxes(frame)
+        result = {"boxes": [list(box) for box in boxes], "match": None, "score": None, "margin": None,
+                  "tracked": False}
+        if not boxes:
+            self.reset()
+            return self._finish(result, start)
+
+        # Отслеживается самое крупное лицо (ближайшее к турникету)
+        box = max(boxes, key=lambda b: b[2] * b[3])
+        if (self.box is not None and iou(box, self.box) >= self.track_iou
+                and self.frames_since_embed < self.reembed_every):
+            self.box = box
+            self.frames_since_embed += 1
+            result.update(match=self.match, score=self.score, margin=self.margin, tracked=True)
+            return self._finish(result, start)
+
+        # Живые кадры не повторяются, кэш по содержимому здесь не помогает
+        detection = self.recognizer.analyze([self.to_image(frame)], cache=False)[0]
+        self.embedded += 1
+        if detection is None:
+            self.reset()
+            return self._finish(result, start)
+
+        decision = self.policy.evaluate(self.recognizer, detection.embedding, 1)
+        match = None
+        if decision.id_client is not None:
+            # Тот же клиент, что и раньше: данные из БД не запрашиваются повторно
+            same = self.match is not None and self.match["id_client"] == decision.id_client
+            match = self.match if same else self.describe(decision.id_client)
+        self.box, self.match, self.score, self.margin = box, match, decision.score, decision.margin
+        self.frames_since_embed = 0
+        result.update(match=match, score=decision.score, margin=decision.margin)
+        return self._finish(result, start)
+
+    def process_bytes(self, data):
+        """Декодирует JPEG и обрабатывает кадр; None, если изображение не декодируется"""
+        from app.image_io import decode_image
+        frame = decode_image(data)
+        if frame is None:
+            return None
+        return self.process(frame)
+
+    @staticmethod
+    def _finish(result, start):
+        result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        for key in ("score", "margin"):
+            if result[key] is not None:
+                result[key] = float(np.round(result[key], 4))
+        return result
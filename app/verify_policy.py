@@ -0,0 +1,114 @@
+"""
+Правила решения при верификации по одному эмбеддингу.
+
+1. Первый проход — поиск по центроидам клиентов (одна строка на клиента).
+   Если лучший кандидат выше порога уверенного совпадения и заметно оторвался
+   от второго, решение принимается сразу. Если он ниже порога отказа, отдельные
+   шаблоны его уже не вытянут — совпадения нет.
+2. Только для пограничных случаев лучшие кандидаты сравниваются с отдельными
+   шаблонами (кадрами регистрации) и решение принимается по обычному порогу.
+
+Пороги задаются переменными окружения для каждой установки. В ответе
+возвращается отрыв лучшего кандидата от второго (margin).
+"""
+import os
+
+from app.gallery_index import GALLERY_RERANK_TOP
+from app.metrics import VERIFY_PASSES
+
+# Порог косинусного сходства, выше которого лица считаются совпадающими
+VERIFY_THRESHOLD = float(os.getenv("VERIFY_THRESHOLD", 0.5))
+# Сходство, при котором одного кадра достаточно для решения (уже после первого прохода)
+VERIFY_STRONG_THRESHOLD = float(os.getenv("VERIFY_STRONG_THRESHOLD", 0.8))
+# Сходство, ниже которого совпадения нет без проверки отдельных шаблонов
+VERIFY_REJECT_THRESHOLD = float(os.getenv("VERIFY_REJECT_THRESHOLD", 0.35))
+# Насколько лучший кандидат должен опережать второго, чтобы совпадение было однозначным
+VERIFY_MARGIN = float(os.getenv("VERIFY_MARGIN", 0.05))
+
+
+class Decision:
+    """
+    Решение по одному эмбеддингу.
+
+    id_client: найденный клиент (None — совпадения нет)
+    score: сходство лучшего кандидата (None, если галерея пуста)
+    margin: отрыв лучшего кандидата от второго (None, если кандидат один)
+    candidates: пары (id_client, сходство) по убыванию сходства
+    passes: 1 — решение по центроидам, 2 — понадобилась проверка шаблонов
+    confident: совпадение уверенное, следующие кадры можно не обрабатывать
+    """
+
+    def __init__(self, id_client, score, margin, candidates, passes, confident=False):
+        self.id_client = id_client
+        self.score = score
+        self.margin = margin
+        self.candidates = candidates
+        self.passes = passes
+        self.confident = confident
+
+
+def decision_margin(candidates):
+    """Отрыв лучшего кандидата от второго (None, если кандидатов меньше двух)"""
+    if len(candidates) < 2:
+        return None
+    return candidates[0][1] - candidates[1][1]
+
+
+class VerificationPolicy:
+    """
+    Пороги и порядок проходов поиска по галерее.
+
+    recognizer в evaluate: нужны search_gallery(embedding, k, rerank) и rescore_gallery(embedding, candidates, top)
+    """
+
+    def __init__(self, threshold=VERIFY_THRESHOLD, strong_threshold=VERIFY_STRONG_THRESHOLD,
+                 reject_threshold=VERIFY_REJECT_THRESHOLD, margin=VERIFY_MARGIN, rerank_top=GALLERY_RERANK_TOP):
+        self.threshold = threshold
+        self.strong_threshold = strong_threshold
+        self.reject_threshold = min(reject_threshold, threshold)
+        self.margin = margin
+        self.rerank_top = rerank_top
+
+    def _unambiguous(self, margin):
+        return margin is None or margin >= self.margin
+
+    def first_pass(self, candidates):
+        """
+        Решение по кандидатам поиска по центроидам.
+
+        :return: Decision или None, если нужна проверка шаблонов
+        """
+        if not candidates:
+            return Decision(None, None, None, [], 1)
+        id_client, score = candidates[0]
+        margin = decision_margin(candidates)
+        if score >= self.strong_threshold and self._unambiguous(margin):
+            return Decision(id_client, score, margin, candidates, 1, confident=True)
+        if score < self.reject_threshold:
+            return Decision(None, score, margin, candidates, 1)
+        return None
+
+    def second_pass(self, candidates):
+        """Решение по кандидатам, проверенным по отдельным шаблонам"""
+        id_client, score = candidates[0]
+        margin = decision_margin(candidates)
+        if score >= self.threshold and self._unambiguous(margin):
+            return Decision(id_client, score, margin, candidates, 2, confident=score >= self.strong_threshold)
+        return Decision(None, score, margin, candidates, 2)
+
+    def evaluate(self, recognizer, embedding, k=5):
+        """
+        Ищет клиента по эмбеддингу: дешевый проход по центроидам и, только если он
+        не дал однозначного ответа, проверка шаблонов лучших кандидатов.
+
+        :param k: сколько кандидатов вернуть в решении
+        :return: Decision
+        """
+        # Второй кандидат нужен для отрыва, rerank_top — для проверки шаблонов
+        candidates = recognizer.search_gallery(embedding, max(k, 2, self.rerank_top), rerank=0)
+        decision = self.first_pass(candidates)
+        if decision is None:
+            decision = self.second_pass(recognizer.rescore_gallery(embedding, candidates, self.rerank_top))
+        decision.candidates = decision.candidates[:k]
+        VERIFY_PASSES.inc(passes=str(decision.passes))
+        return decision